@@ -1,9 +1,22 @@
+import heapq
+import os
+import re
+import tempfile
+import time
 import pandas as pd
 import numpy as np
 import pulp
+from scipy import sparse
+from scipy.optimize import Bounds, LinearConstraint, milp
 import matplotlib.pyplot as plt
 import seaborn as sns
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from min_cost_flow import MinCostFlow
+from presolve import presolve
+from snapshot import read_preferences, read_table
+from matching_instance import MatchingInstance, MINUTES_PER_DAY, interval_mask, parse_time
+from solver_config import SolverConfig
 
 
 #Sets and Parameters
@@ -64,11 +77,12 @@ from collections import defaultdict
 
 def load_data_first():
     """Load necessary CSV files for course matching."""
-    # Load CSV files
-    course_data = pd.read_csv('backend/course.csv')
-    student_data = pd.read_csv('backend/student.csv')
-    elective_capacity_data = pd.read_csv('backend/elective_capacity.csv')
-    elective_preference_data = pd.read_csv('backend/elective_preference.csv')
+    # Load CSV files (from their snapshots when up to date, see snapshot.py)
+    course_data = read_table('backend/course.csv')
+    student_data = read_table('backend/student.csv')
+    elective_capacity_data = read_table('backend/elective_capacity.csv')
+    # Streamed in chunks with compact dtypes, each preference once with its best rank
+    elective_preference_data = read_preferences('backend/elective_preference.csv')
     
     # Strip whitespace from column names
     course_data.columns = course_data.columns.str.strip()
@@ -83,132 +97,681 @@ def load_data_first():
     
     return course_data, student_data, elective_capacity_data, elective_preference_data
 
-def optimize_course_matching():
+def calculate_utility(rank):
+    """Utility of a preference rank: 9 for a first choice, never below 1."""
+    return max(10 - rank, 1)
+
+def _solve_cbc(model, config):
     """
-    Optimize course matching for students
+    Solve a PuLP model with CBC using the threads, time limit, gap, message
+    level and warm start (initial values set on the variables) of config. CBC's log is read back for the stop reason and final gap,
+    and printed when config.msg is set.
+    Returns a solver report: {'status': ..., 'gap': ...} where status is
+    'optimal', 'gap_limit' (stopped within the gap tolerance), 'time_limit',
+    'infeasible' or 'not_solved'.
     """
-    # Load data
-    course_data, student_data, elective_capacity_data, elective_preference_data = load_data_first()
+    with tempfile.TemporaryDirectory() as log_dir:
+        log_path = os.path.join(log_dir, 'cbc.log')
+        # With logPath, PuLP sends CBC's output to the file only (and warns if msg is set too)
+        model.solve(pulp.PULP_CBC_CMD(msg=False, threads=config.threads, timeLimit=config.time_limit,
+                                      gapRel=config.mip_rel_gap, warmStart=config.warm_start, logPath=log_path))
+        with open(log_path) as log_file:
+            log = log_file.read()
+    if config.msg:
+        print(log)
     
-    # Create PuLP model
-    model = pulp.LpProblem("Course_Matching", pulp.LpMaximize)
+    result = re.search(r"^Result - (.*)$", log, re.MULTILINE)
+    result = result.group(1) if result else ''
+    gap = re.search(r"^Gap:\s+(\S+)", log, re.MULTILINE)
+    gap = abs(float(gap.group(1))) if gap else None
+    if model.sol_status == pulp.LpSolutionOptimal and 'gap' not in result:
+        status, gap = 'optimal', 0.0
+    elif model.sol_status in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible):
+        status = 'time_limit' if 'time' in result.lower() else 'gap_limit'
+    elif model.sol_status == pulp.LpSolutionInfeasible:
+        status = 'infeasible'
+    else:
+        status = 'time_limit' if 'time' in result.lower() else 'not_solved'
+    return {'status': status, 'gap': gap}
+
+def _has_solution(report):
+    """Whether the solver stopped with a feasible solution."""
+    return report['status'] in ('optimal', 'gap_limit', 'time_limit', 'heuristic')
+
+def _solve_course_ilp(instance, config):
+    """
+    Course matching engine 'ilp': binary program solved with CBC through PuLP.
+    The model is presolved first (see presolve.py), so only the contested
+    pairs reach the solver.
+    Returns the solution as an array aligned with the eligible pairs (None if
+    there is none) and the solver report.
+    """
+    # Decision variables, one per eligible pair
+    # X[s,c] = 1 if student s is assigned to course c, 0 otherwise
+    n_pairs = len(instance.elig_course)
+    print(f"Decision variables: {n_pairs} (full students x courses model: "
+          f"{instance.num_students * instance.num_courses})")
     
-    # Prepare data
-    students = student_data['student_id'].tolist()
-    courses = course_data['course_id'].tolist()
+    student_ids = instance.student_ids[instance.pair_student]
+    course_ids = instance.course_ids[instance.elig_course]
     
-    # Decision variables
-    # X[s,c] = 1 if student s is assigned to course c, 0 otherwise
-    X = pulp.LpVariable.dicts("X", 
-                             [(s, c) for s in students for c in courses], 
-                             cat=pulp.LpBinary)
+    # Constraints, as (name, pairs, sense, rhs)
+    rows = []
+    # 1. Mandatory course constraints
+    for i in np.flatnonzero(instance.elig_mandatory).tolist():
+        rows.append((f"Mandatory_{student_ids[i]}_{course_ids[i]}", [i], '=', 1))
     
-    # Objective function: utility based on preference ranking
-    def calculate_utility(rank):
-        return max(10 - rank, 1)
+    # 2. Elective course constraints: exact number of electives
+    electives = np.flatnonzero(~instance.elig_mandatory)
+    for pairs in np.split(electives, np.flatnonzero(np.diff(instance.pair_student[electives])) + 1):
+        if len(pairs):
+            student = instance.pair_student[pairs[0]]
+            rows.append((f"ElectiveLimit_{instance.student_ids[student]}", pairs,
+                         '=', instance.required_electives[student]))
     
-    # Preference utility
-    preference_utility = []
-    for _, pref in elective_preference_data.iterrows():
-        student_id = pref['student_id']
-        course_id = pref['course_id']
-        utility = calculate_utility(pref['preference_rank'])
-        preference_utility.append(utility * X[(student_id, course_id)])
+    # 3. Elective course capacity constraints
+    by_course = np.argsort(instance.elig_course, kind='stable')
+    sorted_courses = instance.elig_course[by_course]
+    for pairs in np.split(by_course, np.flatnonzero(np.diff(sorted_courses)) + 1):
+        if len(pairs):
+            course = instance.elig_course[pairs[0]]
+            if instance.capacity[course] >= 0:
+                rows.append((f"ElectiveCapacity_{instance.course_ids[course]}", pairs, '<', instance.capacity[course]))
+    
+    # Fix mandatory pairs, forced and uncontested electives before the solver sees them
+    utility = instance.pair_utility
+    fixed, rows, presolve_stats = _presolve(n_pairs, rows, utility)
+    if fixed is None:
+        return None, {'status': 'infeasible', 'gap': None, 'presolve': presolve_stats}
+    free = np.flatnonzero(fixed < 0)
+    
+    # Create PuLP model over the free pairs
+    model = pulp.LpProblem("Course_Matching", pulp.LpMaximize)
+    X = pulp.LpVariable.dicts("X", free.tolist(), cat=pulp.LpBinary)
     
     # Set objective: maximize preference utility
-    model += pulp.lpSum(preference_utility), "Preference Utility"
+    model += pulp.LpAffineExpression((X[i], int(utility[i])) for i in free[utility[free] > 0].tolist()), \
+        "Preference Utility"
+    for name, pairs, sense, rhs in rows:
+        total = pulp.lpSum(X[i] for i in pairs)
+        model += (total == rhs if sense == '=' else total <= rhs), name
     
-    # Constraints
-    # 1. Mandatory course constraints
-    for _, student in student_data.iterrows():
-        student_id = student['student_id']
-        program_id = student['program_id']
-        
-        # Identify mandatory courses for this student's program
-        mandatory_courses = course_data[
-            (course_data['program_id'] == program_id) & 
-            (course_data['mandatory'] == 1)
-        ]['course_id'].tolist()
-        
-        # Ensure all mandatory courses are assigned
-        for course_id in mandatory_courses:
-            model += X[(student_id, course_id)] == 1, f"Mandatory_{student_id}_{course_id}"
+    # Seed the incumbent with the Gale-Shapley matching, completed along augmenting paths
+    start = None
+    if config.warm_start:
+        start, _ = _solve_course_gale_shapley(instance, config)
+        start = np.where(fixed >= 0, fixed, augment_course_assignment(instance, start))
+        for i in free.tolist():
+            X[i].setInitialValue(start[i])
+        violations = validate_course_solution(instance, start)
+        print("Warm start from Gale-Shapley: "
+              + (f"incomplete {violations}" if any(violations.values()) else "feasible"))
+        if any(violations.values()):
+            start = None
     
-    # 2. Elective course constraints
-    for _, student in student_data.iterrows():
-        student_id = student['student_id']
-        program_id = student['program_id']
-        required_electives = student['required_electives']
+    # Solve the model
+    report = dict(_solve_cbc(model, config), presolve=presolve_stats)
+    
+    # Check solution status; a feasible warm start is the answer of last resort
+    if not _has_solution(report) or model.sol_status not in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible):
+        if start is not None and report['status'] == 'time_limit':
+            print("No incumbent within the time limit, returning the warm start")
+            return start, dict(report, gap=None)
+        return None, report
+    
+    values = fixed.astype(float)
+    values[free] = [X[i].varValue or 0 for i in free.tolist()]
+    return values, report
+
+def _presolve(n_vars, rows, objective):
+    """presolve() with a summary line of what it removed."""
+    fixed, rows, stats = presolve(n_vars, rows, objective)
+    print(f"Presolve: fixed {stats['fixed_variables']} of {stats['variables']} variables, "
+          f"removed {stats['dropped_rows']} of {stats['rows']} rows"
+          + (" (infeasible)" if fixed is None else ""))
+    return fixed, rows, stats
+
+def _solve_milp(objective, matrix, row_lower, row_upper, lower, upper, config):
+    """
+    Maximize objective @ x over binary x with row_lower <= matrix @ x <= row_upper
+    and lower <= x <= upper, with HiGHS in-process (no model files are written).
+    Uses the time limit, gap and message level of config (SciPy does not
+    expose the HiGHS thread count).
+    Returns the rounded solution (None if no feasible solution was found) and
+    the solver report, see _solve_cbc.
+    """
+    constraints = [LinearConstraint(matrix, row_lower, row_upper)] if matrix.shape[0] else []
+    milp_options = {'disp': bool(config.msg)}
+    if config.time_limit is not None:
+        milp_options['time_limit'] = config.time_limit
+    if config.mip_rel_gap is not None:
+        milp_options['mip_rel_gap'] = config.mip_rel_gap
+    result = milp(-objective, constraints=constraints, integrality=np.ones(len(objective)),
+                  bounds=Bounds(lower, upper), options=milp_options)
+    print(f"HiGHS status: {result.message}")
+    
+    gap = getattr(result, 'mip_gap', None)
+    if result.status == 0:
+        status = 'gap_limit' if gap and gap > 1e-9 else 'optimal'
+    elif result.status == 1:
+        status = 'time_limit'
+    elif result.status == 2:
+        status = 'infeasible'
+    else:
+        status = 'not_solved'
+    report = {'status': status, 'gap': gap if result.x is not None else None}
+    if result.x is None:
+        return None, report
+    return np.round(result.x), report
+
+def _group_rows(groups):
+    """
+    Constraint matrix with one row per distinct non-negative value of groups,
+    and a 1 in column k of the row of groups[k]. Returns (matrix, row values).
+    """
+    columns = np.flatnonzero(groups >= 0)
+    keys, rows = np.unique(groups[columns], return_inverse=True)
+    matrix = sparse.csr_array((np.ones(len(columns)), (rows, columns)), shape=(len(keys), len(groups)))
+    return matrix, keys
+
+def _solve_course_milp(instance, config):
+    """
+    Course matching engine 'milp': the 'ilp' model assembled as a SciPy sparse
+    matrix and solved in-process by HiGHS through scipy.optimize.milp.
+    Returns the solution as an array aligned with the eligible pairs (None if
+    there is none) and the solver report.
+    """
+    n_pairs = len(instance.elig_course)
+    print(f"Decision variables: {n_pairs} (full students x courses model: "
+          f"{instance.num_students * instance.num_courses})")
+    
+    # 1. Mandatory courses are fixed through the variable bounds
+    lower = instance.elig_mandatory.astype(float)
+    upper = np.ones(n_pairs)
+    
+    # 2. Elective limit: one row per student with eligible electives
+    elective_limit, students = _group_rows(np.where(instance.elig_mandatory, -1, instance.pair_student))
+    required = instance.required_electives[students]
+    
+    # 3. Capacity: one row per course with a capacity
+    capacity, courses = _group_rows(np.where(instance.capacity[instance.elig_course] >= 0, instance.elig_course, -1))
+    seats = instance.capacity[courses]
+    
+    matrix = sparse.vstack([elective_limit, capacity], format='csr')
+    row_lower = np.concatenate([required, np.full(len(seats), -np.inf)])
+    row_upper = np.concatenate([required, seats])
+    return _solve_milp(instance.pair_utility.astype(float), matrix, row_lower, row_upper, lower, upper, config)
+
+def _solve_course_flow(instance, config):
+    """
+    Course matching engine 'flow': the elective stage as a transportation
+    problem, solved exactly as a min-cost flow (no external solver).
+    Returns the solution as an array aligned with the eligible pairs (None if
+    there is none) and the solver report.
+    
+    source -> student (capacity required_electives, cost 0)
+    student -> eligible elective (capacity 1, cost max_utility - utility)
+    elective -> sink (capacity elective_capacity, cost 0)
+    """
+    electives = np.flatnonzero(~instance.elig_mandatory)
+    pair_student = instance.pair_student[electives]
+    pair_course = instance.elig_course[electives]
+    students = np.unique(pair_student)
+    courses, seats = np.unique(pair_course, return_counts=True)
+    student_node = np.zeros(instance.num_students, dtype=np.int64)
+    student_node[students] = 2 + np.arange(len(students))
+    course_node = np.zeros(instance.num_courses, dtype=np.int64)
+    course_node[courses] = 2 + len(students) + np.arange(len(courses))
+    network = MinCostFlow(2 + len(students) + len(courses))
+    source, sink = 0, 1
+    
+    demand = 0
+    for student in students.tolist():
+        required = int(instance.required_electives[student])
+        demand += required
+        network.add_edge(source, int(student_node[student]), required, 0)
+    
+    # The elective limit fixes the total flow, so minimizing
+    # max_utility - utility is the same as maximizing utility.
+    utility = instance.pair_utility[electives]
+    max_utility = int(utility.max()) if len(utility) else 0
+    arcs = [
+        network.add_edge(u, v, 1, max_utility - cost)
+        for u, v, cost in zip(student_node[pair_student].tolist(), course_node[pair_course].tolist(), utility.tolist())
+    ]
+    
+    # Courses without a capacity row are limited only by their eligible students
+    capacity = np.where(instance.capacity[courses] >= 0, instance.capacity[courses], seats)
+    for course, seats_left in zip(courses.tolist(), capacity.tolist()):
+        network.add_edge(int(course_node[course]), sink, seats_left, 0)
+    
+    total_flow, _ = network.solve(source, sink)
+    if total_flow < demand:
+        return None, {'status': 'infeasible', 'gap': None}
+    
+    # Mandatory pairs are always assigned
+    values = np.ones(len(instance.elig_course))
+    values[electives] = [network.flow(arc_id) for arc_id in arcs]
+    return values, {'status': 'optimal', 'gap': 0.0}
+
+def _solve_course_aggregated(instance, config):
+    """
+    Course matching engine 'aggregated': the 'ilp' model over student types
+    instead of students (see MatchingInstance.elective_types), solved with CBC.
+    Returns the solution as an array aligned with the eligible pairs (None if
+    there is none) and the solver report.
+    
+    N[t,c] = number of students of type t assigned to elective c, 0..size[t]
+    sum over c of N[t,c] == size[t] * required_electives[t]
+    sum over t of N[t,c] <= capacity[c]
+    
+    Students of one type are interchangeable, so the counts are handed out
+    round-robin over the type's members, which gives every member its number
+    of distinct electives. Members are taken in input order, or shuffled with
+    config.seed.
+    """
+    student_type, first = instance.elective_types()
+    size = np.bincount(student_type, minlength=len(first))
+    # Elective pairs of each type's first student stand for the whole type
+    electives = ~instance.elig_mandatory
+    rows = [np.flatnonzero(electives[instance.elig_indptr[s]:instance.elig_indptr[s + 1]]) + instance.elig_indptr[s]
+            for s in first.tolist()]
+    n_vars = sum(map(len, rows))
+    print(f"Aggregated model: {instance.num_students} students in {len(first)} types, {n_vars} variables "
+          f"(per-student model: {int(np.count_nonzero(electives))})")
+    
+    model = pulp.LpProblem("Course_Matching_Aggregated", pulp.LpMaximize)
+    N = {}
+    for t, type_rows in enumerate(rows):
+        for i in type_rows.tolist():
+            N[t, i] = pulp.LpVariable(f"N_{t}_{instance.course_ids[instance.elig_course[i]]}",
+                                      0, int(size[t]), cat=pulp.LpInteger)
+    
+    utility = instance.pair_utility
+    model += pulp.LpAffineExpression((var, int(utility[i])) for (t, i), var in N.items() if utility[i]), \
+        "Preference Utility"
+    
+    # 1. Elective course constraints: exact number of electives for every member
+    for t, type_rows in enumerate(rows):
+        required = int(size[t] * instance.required_electives[first[t]])
+        model += pulp.lpSum(N[t, i] for i in type_rows.tolist()) == required, f"TypeElectives_{t}"
+    
+    # 2. Elective course capacity constraints
+    by_course = defaultdict(list)
+    for (t, i), var in N.items():
+        by_course[int(instance.elig_course[i])].append(var)
+    for course, variables in by_course.items():
+        if instance.capacity[course] >= 0:
+            model += pulp.lpSum(variables) <= instance.capacity[course], \
+                f"ElectiveCapacity_{instance.course_ids[course]}"
+    
+    report = _solve_cbc(model, config)
+    if not _has_solution(report) or model.sol_status not in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible):
+        return None, report
+    
+    # Split the counts back out to students; members' elective pairs line up with the
+    # first student's, at the end of their eligibility rows
+    rng = None if config.seed is None else np.random.default_rng(config.seed)
+    members = np.split(np.argsort(student_type, kind='stable'), np.cumsum(size)[:-1])
+    values = instance.elig_mandatory.astype(float)
+    for t, type_rows in enumerate(rows):
+        students = members[t] if rng is None else rng.permutation(members[t])
+        counts = [int(round(N[t, i].varValue or 0)) for i in type_rows.tolist()]
+        offsets = np.repeat(np.arange(len(type_rows)) - len(type_rows), counts)
+        slots = np.arange(len(offsets))
+        values[instance.elig_indptr[students[slots % size[t]] + 1] + offsets] = 1
+    return values, report
+
+def gale_shapley_electives(students, required_electives, preferences, priority, capacities):
+    """
+    Student-proposing deferred acceptance for electives.
+    
+    students: queue order; required_electives: student_id -> number of electives
+    preferences: student_id -> course_ids, best first
+    priority: (course_id, student_id) -> priority of the student at the course
+    capacities: course_id -> seats (courses without a capacity have no seats)
+    
+    A full course keeps its highest-priority students; among equal priorities the
+    student who got the seat last is bumped first and a newcomer loses ties.
+    Each student walks their list once through a pointer, and each course holds
+    a min-heap keyed on (priority, -arrival), so a proposal costs O(log capacity).
+    Returns student_id -> list of assigned course_ids.
+    """
+    queue = deque(s for s in students if required_electives[s] > 0)
+    preferences = {s: list(dict.fromkeys(courses)) for s, courses in preferences.items()}
+    next_choice = defaultdict(int)
+    assignments = defaultdict(list)
+    holders = defaultdict(list)  # course_id -> heap of (priority, -arrival, student_id)
+    arrival = 0
+    
+    while queue:
+        student_id = queue.popleft()
+        if len(assignments[student_id]) >= required_electives[student_id]:
+            continue
         
-        # Identify elective courses for this student's program
-        elective_courses = course_data[
-            (course_data['program_id'] == program_id) & 
-            (course_data['mandatory'] == 0)
-        ]['course_id'].tolist()
+        student_preferences = preferences.get(student_id, [])
+        if next_choice[student_id] >= len(student_preferences):
+            continue
+        course_id = student_preferences[next_choice[student_id]]
+        next_choice[student_id] += 1
         
-        # Ensure exact number of electives are assigned
-        if elective_courses:
-            model += pulp.lpSum(X[(student_id, c)] for c in elective_courses) == required_electives, f"ElectiveLimit_{student_id}"
-    
-    # 3. Elective course capacity constraints
-    for _, capacity in elective_capacity_data.iterrows():
-        course_id = capacity['course_id']
-        max_capacity = capacity['capacity']
+        heap = holders[course_id]
+        student_priority = priority.get((course_id, student_id), 0)
+        bumped = None
+        if len(heap) < capacities.get(course_id, 0):
+            arrival += 1
+            heapq.heappush(heap, (student_priority, -arrival, student_id))
+        elif heap and student_priority > heap[0][0]:
+            arrival += 1
+            _, _, bumped = heapq.heapreplace(heap, (student_priority, -arrival, student_id))
+        else:
+            queue.append(student_id)
+            continue
         
-        model += pulp.lpSum(X[(s, course_id)] for s in students) <= max_capacity, f"ElectiveCapacity_{course_id}"
+        assignments[student_id].append(course_id)
+        if len(assignments[student_id]) < required_electives[student_id]:
+            queue.append(student_id)
+        if bumped is not None:
+            assignments[bumped].remove(course_id)
+            queue.append(bumped)
     
-    # Solve the model
-    model.solve()
+    return assignments
+
+def _solve_course_gale_shapley(instance, config):
+    """
+    Course matching engine 'gale_shapley': mandatory courses are assigned
+    directly and electives by deferred acceptance, with course priority
+    (max_rank + 1) - rank. Fast, stable but not utility-optimal, and it may
+    leave students short of electives; meant for quick previews.
+    Returns the solution as an array aligned with the eligible pairs and the
+    solver report.
+    """
+    max_rank = int(instance.pref_rank.max()) if len(instance.pref_rank) else 0
+    pref_student = np.repeat(np.arange(instance.num_students), np.diff(instance.pref_indptr))
+    priority = dict(zip(zip(instance.pref_course.tolist(), pref_student.tolist()),
+                        (max_rank + 1 - instance.pref_rank).tolist()))
+    
+    # Preference lists are the rank-sorted rows of the preference matrix, restricted to program electives
+    preferences = {}
+    for student in range(instance.num_students):
+        program_electives = set(instance.program_electives.get(instance.student_program[student], ()))
+        row = instance.pref_course[instance.pref_indptr[student]:instance.pref_indptr[student + 1]]
+        preferences[student] = [c for c in row.tolist() if c in program_electives]
+    capacities = {c: int(seats) for c, seats in enumerate(instance.capacity.tolist()) if seats >= 0}
     
-    # Check solution status
-    if pulp.LpStatus[model.status] != 'Optimal':
+    assignments = gale_shapley_electives(range(instance.num_students), instance.required_electives.tolist(),
+                                         preferences, priority, capacities)
+    assigned = {(student, course) for student, courses in assignments.items() for course in courses}
+    values = [1.0 if mandatory or (student, course) in assigned else 0.0
+              for student, course, mandatory in zip(instance.pair_student.tolist(), instance.elig_course.tolist(),
+                                                    instance.elig_mandatory.tolist())]
+    return np.array(values), {'status': 'heuristic', 'gap': None}
+
+def validate_course_solution(instance, values):
+    """
+    Check a course matching solution (aligned with the eligible pairs) against the constraints.
+    Returns the number of violations per constraint: missing mandatory courses,
+    students with the wrong number of electives and courses over capacity.
+    """
+    chosen = values > 0.5
+    electives = chosen & ~instance.elig_mandatory
+    elective_count = np.bincount(instance.pair_student[electives], minlength=instance.num_students)
+    load = np.bincount(instance.elig_course[chosen], minlength=instance.num_courses)
+    return {
+        'missing_mandatory': int(np.count_nonzero(instance.elig_mandatory & ~chosen)),
+        'wrong_elective_count': int(np.count_nonzero(elective_count != instance.required_electives)),
+        'over_capacity': int(np.count_nonzero((instance.capacity >= 0) & (load > instance.capacity))),
+    }
+
+def augment_course_assignment(instance, values):
+    """
+    Complete a course assignment (aligned with the eligible pairs) along
+    augmenting paths: a student short of electives takes a seat in an eligible
+    elective and, if it is full, one of its holders moves on to another of their
+    electives, and so on, until a course with a free seat is reached. Paths are
+    found by breadth-first search over the courses, so they are shortest.
+    Returns the completed copy of values; students for which no path exists
+    stay short.
+    """
+    values = (np.asarray(values) > 0.5).astype(float)
+    pair_index = {(s, c): i for i, (s, c) in enumerate(zip(instance.pair_student.tolist(), instance.elig_course.tolist()))}
+    electives = defaultdict(list)  # student -> eligible electives
+    held = defaultdict(set)  # student -> assigned electives
+    holders = defaultdict(set)  # course -> students holding it as an elective
+    for i in np.flatnonzero(~instance.elig_mandatory).tolist():
+        s, c = int(instance.pair_student[i]), int(instance.elig_course[i])
+        electives[s].append(c)
+        if values[i]:
+            held[s].add(c)
+            holders[c].add(s)
+    load = np.bincount(instance.elig_course[values > 0.5], minlength=instance.num_courses)
+    capacity = instance.capacity
+    
+    def move(student, old, new):
+        if old is not None:
+            held[student].discard(old)
+            holders[old].discard(student)
+            values[pair_index[(student, old)]] = 0
+            load[old] -= 1
+        held[student].add(new)
+        holders[new].add(student)
+        values[pair_index[(student, new)]] = 1
+        load[new] += 1
+    
+    for student in range(instance.num_students):
+        while len(held[student]) < instance.required_electives[student]:
+            # BFS: parent[course] = (previous course, student moving from it into course)
+            parent = {}
+            queue = deque()
+            for c in electives[student]:
+                if c not in held[student]:
+                    parent[c] = (None, student)
+                    queue.append(c)
+            end = None
+            while queue:
+                c = queue.popleft()
+                if capacity[c] < 0 or load[c] < capacity[c]:
+                    end = c
+                    break
+                for holder in holders[c]:
+                    for other in electives[holder]:
+                        if other not in parent and other not in held[holder]:
+                            parent[other] = (c, holder)
+                            queue.append(other)
+            if end is None:
+                break
+            while end is not None:
+                previous, mover = parent[end]
+                move(mover, previous, end)
+                end = previous
+    return values
+
+
+def _no_progress(phase):
+    pass
+
+def _finish_report(report, engine, objective, started):
+    """Complete a solver report with the engine, objective and wall time, and print it."""
+    report = dict(report, engine=engine, objective=objective, seconds=time.perf_counter() - started)
+    gap = 'n/a' if report['gap'] is None else f"{report['gap']:.2%}"
+    objective = 'n/a' if objective is None else f"{objective:g}"
+    print(f"Solver report ({engine}): status {report['status']}, objective {objective}, "
+          f"gap {gap}, {report['seconds']:.2f}s")
+    return report
+
+# Engines for the course matching stage, selectable by name
+COURSE_ENGINES = {
+    'ilp': _solve_course_ilp,
+    'flow': _solve_course_flow,
+    'gale_shapley': _solve_course_gale_shapley,
+    'milp': _solve_course_milp,
+    'aggregated': _solve_course_aggregated,
+}
+
+def solve_course_matching(course_data, student_data, elective_capacity_data, elective_preference_data, engine='ilp',
+                          solver_config=None, progress=None):
+    """
+    Match students to courses with the given engine and return the results table,
+    or None if no feasible matching exists.
+    solver_config: SolverConfig of the 'ilp' and 'milp' solvers (default: from
+    the environment). The solver report (status, objective, gap, seconds) is
+    kept in results_df.attrs['solver_report'].
+    progress: called with the name of each phase as it starts ('build', 'solve', 'extract')
+    """
+    if engine not in COURSE_ENGINES:
+        raise ValueError(f"Unknown course matching engine '{engine}', expected one of {sorted(COURSE_ENGINES)}")
+    progress = progress or _no_progress
+    
+    progress('build')
+    instance = MatchingInstance.from_course_data(course_data, student_data, elective_capacity_data,
+                                                 elective_preference_data)
+    
+    if solver_config is None:
+        solver_config = SolverConfig.from_env()
+    
+    progress('solve')
+    started = time.perf_counter()
+    values, report = COURSE_ENGINES[engine](instance, solver_config)
+    objective = None if values is None else float(instance.pair_utility @ values)
+    report = _finish_report(report, engine, objective, started)
+    if values is None:
         print("Could not find an optimal solution.")
         return None
     
-    # Extract results
-    results = []
-    for _, student in student_data.iterrows():
-        student_id = student['student_id']
-        program_id = student['program_id']
-        
-        # Find mandatory courses
-        mandatory_courses = course_data[
-            (course_data['program_id'] == program_id) & 
-            (course_data['mandatory'] == 1)
-        ]
-        
-        # Find elective courses
-        elective_courses = course_data[
-            (course_data['program_id'] == program_id) & 
-            (course_data['mandatory'] == 0)
-        ]
-        
-        # Track assigned courses
-        for _, course in mandatory_courses.iterrows():
-            if X[(student_id, course['course_id'])].value() > 0.5:
-                results.append({
-                    'student_id': student_id,
-                    'student_name': student_data[student_data['student_id'] == student_id]['name'].iloc[0],
-                    'course_type': 'Mandatory',
-                    'course_id': course['course_id'],
-                    'course_name': course['course_name']
-                })
-        
-        for _, course in elective_courses.iterrows():
-            if X[(student_id, course['course_id'])].value() > 0.5:
-                results.append({
-                    'student_id': student_id,
-                    'student_name': student_data[student_data['student_id'] == student_id]['name'].iloc[0],
-                    'course_type': 'Elective',
-                    'course_id': course['course_id'],
-                    'course_name': course['course_name']
-                })
-    
-    # Convert to DataFrame and export
-    results_df = pd.DataFrame(results)
-    results_df.to_csv('student_course_matching.csv', index=False)
+    violations = validate_course_solution(instance, values)
+    if any(violations.values()):
+        print(f"Warning: course matching violates constraints: {violations}")
     
-    print("Course matching completed. Results saved to student_course_matching.csv")
+    # Extract results: threshold the solution and decode the integer ids
+    progress('extract')
+    chosen = np.flatnonzero(values > 0.5)
+    students = instance.pair_student[chosen]
+    courses = instance.elig_course[chosen]
+    results_df = pd.DataFrame({
+        'student_id': instance.student_ids[students],
+        'student_name': instance.student_names[students],
+        'course_type': np.where(instance.elig_mandatory[chosen], 'Mandatory', 'Elective'),
+        'course_id': instance.course_ids[courses],
+        'course_name': instance.course_names[courses],
+    })
+    results_df.attrs['solver_report'] = report
+    return results_df
+
+def find_program_blocks(course_data, student_data):
+    """
+    Split the programs into independent blocks. Programs only interact through
+    courses they share, so each block can be matched on its own.
+    Returns a list of program_id lists, largest block (by students) first.
+    """
+    parent = {}
+    
+    def find(program_id):
+        parent.setdefault(program_id, program_id)
+        while parent[program_id] != program_id:
+            parent[program_id] = parent[parent[program_id]]
+            program_id = parent[program_id]
+        return program_id
+    
+    for program_id in student_data['program_id']:
+        find(program_id)
+    
+    # A course listed under several programs ties those programs together
+    first_program = {}
+    for course_id, program_id in zip(course_data['course_id'], course_data['program_id']):
+        root = find(program_id)
+        if course_id in first_program:
+            parent[root] = find(first_program[course_id])
+        else:
+            first_program[course_id] = program_id
+    
+    blocks = defaultdict(list)
+    for program_id in parent:
+        blocks[find(program_id)].append(program_id)
+    
+    students_per_program = student_data['program_id'].value_counts()
+    return sorted(blocks.values(), key=lambda programs: -sum(students_per_program.get(p, 0) for p in programs))
+
+def solve_course_matching_by_program(course_data, student_data, elective_capacity_data, elective_preference_data,
+                                     engine='ilp', max_workers=None, solver_config=None):
+    """
+    Solve every independent program block as its own course matching problem,
+    in parallel across a process pool, and merge the results into one table.
+    Returns None if any block has no feasible matching.
+    """
+    blocks = find_program_blocks(course_data, student_data)
+    if len(blocks) <= 1:
+        return solve_course_matching(course_data, student_data, elective_capacity_data,
+                                     elective_preference_data, engine=engine, solver_config=solver_config)
+    
+    block_inputs = []
+    for programs in blocks:
+        block_courses = course_data[course_data['program_id'].isin(programs)]
+        block_students = student_data[student_data['program_id'].isin(programs)]
+        block_inputs.append((
+            block_courses,
+            block_students,
+            elective_capacity_data[elective_capacity_data['course_id'].isin(block_courses['course_id'])],
+            elective_preference_data[elective_preference_data['student_id'].isin(block_students['student_id'])],
+        ))
+    
+    print(f"Solving {len(blocks)} independent program blocks: {blocks}")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(solve_course_matching, *inputs, engine=engine, solver_config=solver_config)
+                   for inputs in block_inputs]
+        block_results = [future.result() for future in futures]
+    
+    if any(results_df is None for results_df in block_results):
+        return None
+    
+    # Keep the student order of student.csv, as the single model does
+    student_order = {student_id: i for i, student_id in enumerate(student_data['student_id'])}
+    results_df = pd.concat(block_results, ignore_index=True)
+    results_df = results_df.sort_values('student_id', key=lambda ids: ids.map(student_order), kind='stable')
+    results_df = results_df.reset_index(drop=True)
+    results_df.attrs['solver_report'] = [block_df.attrs['solver_report'] for block_df in block_results]
+    return results_df
+
+def optimize_course_matching(engine='ilp', parallel=False, max_workers=None, solver_config=None, progress=None,
+                             save=True):
+    """
+    Optimize course matching for students
+    
+    engine: name of the course matching engine, see COURSE_ENGINES
+        'ilp'  - binary program solved with CBC (default)
+        'milp' - the same model as a sparse matrix, solved in-process by HiGHS
+        'flow' - exact min-cost flow for the elective stage, no external solver
+        'aggregated' - the 'ilp' model over groups of students with identical
+            choices, for large cohorts with few distinct preference lists
+        'gale_shapley' - deferred acceptance, a fast (not optimal) preview
+    parallel: solve each independent program block in its own process
+    max_workers: size of the process pool (default: number of CPUs)
+    solver_config: SolverConfig with threads, time limit, gap and message level
+        for 'ilp' and 'milp' (default: from the MATCHING_SOLVER_* environment variables)
+    progress: called with the name of each phase as it starts ('load', 'build',
+        'solve', 'extract'; the program blocks of a parallel run go from 'load' to 'solve')
+    save: write the result to student_course_matching.csv
+    """
+    progress = progress or _no_progress
+    # Load data
+    progress('load')
+    course_data, student_data, elective_capacity_data, elective_preference_data = load_data_first()
+    
+    if parallel:
+        progress('solve')
+        results_df = solve_course_matching_by_program(course_data, student_data, elective_capacity_data,
+                                                      elective_preference_data, engine=engine,
+                                                      max_workers=max_workers, solver_config=solver_config)
+    else:
+        results_df = solve_course_matching(course_data, student_data, elective_capacity_data,
+                                           elective_preference_data, engine=engine, solver_config=solver_config,
+                                           progress=progress)
+    if results_df is None:
+        return None
+    
+    # Export
+    if save:
+        results_df.to_csv('student_course_matching.csv', index=False)
+        print("Course matching completed. Results saved to student_course_matching.csv")
     return results_df
 
 def main():
@@ -274,17 +837,21 @@ if __name__ == "__main__":
 # - Capacity: Ensures no lab section exceeds its maximum capacity
 
 
-def load_data_second():
+def load_data_second(student_course_matching=None):
     """
     Load necessary data for lab matching optimization
+    student_course_matching: the course matching (default: read from student_course_matching.csv)
     """
-    # Load CSV files
-    student_course_matching = pd.read_csv('student_course_matching.csv')
-    lab_time_data = pd.read_csv('backend/lab_time.csv')
-    day_data = pd.read_csv('backend/day.csv')
-    pre_lab_ele_man_data = pd.read_csv('backend/pre_lab_ele_man.csv')
-    theory_time_data = pd.read_csv('backend/theory_time.csv')
-    course_data = pd.read_csv('backend/course.csv')
+    # Load CSV files (from their snapshots when up to date, see snapshot.py)
+    if student_course_matching is None:
+        student_course_matching = pd.read_csv('student_course_matching.csv')
+    else:
+        student_course_matching = student_course_matching.copy()
+    lab_time_data = read_table('backend/lab_time.csv')
+    day_data = read_table('backend/day.csv')
+    pre_lab_ele_man_data = read_preferences('backend/pre_lab_ele_man.csv')
+    theory_time_data = read_table('backend/theory_time.csv')
+    course_data = read_table('backend/course.csv')
     
     # Strip whitespace from column names and data
     for df in [student_course_matching, lab_time_data, day_data, 
@@ -307,167 +874,668 @@ def check_time_conflict(day1, start1, end1, day2, start2, end2):
     if day1 != day2:
         return False
     try:
-        start1 = int(start1)
-        end1 = int(end1)
-        start2 = int(start2)
-        end2 = int(end2)
+        start1 = parse_time(start1)
+        end1 = parse_time(end1)
+        start2 = parse_time(start2)
+        end2 = parse_time(end2)
         if end1 <= start2 or end2 <= start1:
             return False
         return True
     except ValueError:
         return False
 
-def optimize_lab_matching():
+def build_conflict_index(lab_time_data, theory_time_data):
     """
-    Optimize lab matching for students based on course matching and preferences
+    Find every pair of overlapping sections once per run.
+    
+    Lab and theory sessions are converted to minute-of-week intervals and
+    each day is swept in start order, keeping the sessions still running in
+    a heap, so the cost is O(n log n + number of conflicts).
+    
+    Returns a dict with:
+        'lab_slots':        lab_id -> (start, end) in minutes of the week
+        'theory_slots':     course_id -> list of (start, end) theory sessions
+        'lab_conflicts':    lab_id -> set of lab_ids overlapping it
+        'theory_conflicts': lab_id -> set of course_ids whose theory overlaps it
+        'lab_cliques':      maximal sets of labs running at the same instant
     """
-    (student_course_matching, lab_time_data, day_mapping, 
-     pre_lab_ele_man_data, theory_time_data, course_data) = load_data_second()
+    index = {
+        'lab_slots': {},
+        'theory_slots': defaultdict(list),
+        'lab_conflicts': defaultdict(set),
+        'theory_conflicts': defaultdict(set),
+        'lab_cliques': [],
+    }
+    sessions_by_day = defaultdict(list)
+    skipped = 0
     
-    print("Initial Data Analysis:")
-    print("Total students in course matching:", len(student_course_matching['student_id'].unique()))
-    print("Total lab time entries:", len(lab_time_data))
+    for course_id, lab, day, start, end in zip(lab_time_data['course_id'], lab_time_data['lab'],
+                                               lab_time_data['id_day'], lab_time_data['start_time'],
+                                               lab_time_data['end_time']):
+        try:
+            offset = (int(day) - 1) * MINUTES_PER_DAY
+            slot = (offset + parse_time(start), offset + parse_time(end))
+        except ValueError:
+            skipped += 1
+            continue
+        lab_id = f"{course_id}-{lab}"
+        index['lab_slots'][lab_id] = slot
+        sessions_by_day[day].append((slot[0], slot[1], ('lab', lab_id)))
     
-    model = pulp.LpProblem("Lab_Matching", pulp.LpMaximize)
+    for course_id, day, start, end in zip(theory_time_data['course_id'], theory_time_data['id_day'],
+                                          theory_time_data['start_time'], theory_time_data['end_time']):
+        try:
+            offset = (int(day) - 1) * MINUTES_PER_DAY
+            slot = (offset + parse_time(start), offset + parse_time(end))
+        except ValueError:
+            skipped += 1
+            continue
+        index['theory_slots'][course_id].append(slot)
+        sessions_by_day[day].append((slot[0], slot[1], ('theory', course_id)))
+    
+    # Sweep line per day: everything still running when a session starts overlaps it.
+    # The running set right before the first session ends after a run of starts is
+    # a maximal clique of the interval graph; its labs are kept for clique rows.
+    conflicting_pairs = 0
+    for sessions in sessions_by_day.values():
+        sessions.sort()
+        running = []  # heap of (end, session)
+        grew = False
+        for start, end, session in sessions:
+            if grew and running and running[0][0] <= start:
+                index['lab_cliques'].append({key for _, (kind, key) in running if kind == 'lab'})
+                grew = False
+            while running and running[0][0] <= start:
+                heapq.heappop(running)
+            for _, other in running:
+                conflicting_pairs += 1
+                for (kind, key), (other_kind, other_key) in ((session, other), (other, session)):
+                    if kind != 'lab':
+                        continue
+                    if other_kind == 'lab':
+                        index['lab_conflicts'][key].add(other_key)
+                    else:
+                        index['theory_conflicts'][key].add(other_key)
+            heapq.heappush(running, (end, session))
+            grew = True
+        if grew:
+            index['lab_cliques'].append({key for _, (kind, key) in running if kind == 'lab'})
+    index['lab_cliques'] = [clique for clique in index['lab_cliques'] if len(clique) > 1]
+    
+    print(f"Conflict index: {len(index['lab_slots'])} lab sections, "
+          f"{sum(len(s) for s in index['theory_slots'].values())} theory sessions, "
+          f"{conflicting_pairs} overlapping pairs"
+          + (f", {skipped} sessions skipped (invalid day or time)" if skipped else ""))
+    return index
 
-    def calculate_utility(rank):
-        return max(10 - rank, 1)
+def student_conflict_cliques(student_labs, lab_cliques):
+    """
+    Restrict the maximal lab cliques to one student's candidate labs.
+    Keeps the restrictions with two or more labs that are not contained in another.
+    """
+    student_labs = set(student_labs)
+    cliques = {frozenset(clique & student_labs) for clique in lab_cliques}
+    cliques = sorted((clique for clique in cliques if len(clique) > 1), key=len, reverse=True)
+    kept = []
+    for clique in cliques:
+        if not any(clique <= other for other in kept):
+            kept.append(clique)
+    return kept
+
+def build_lab_results(student_course_matching, assigned_labs, lab_time_data, day_mapping, theory_time_data):
+    """
+    Build the student_lab_matching table: every row of the course matching with
+    its theory time and the time of the assigned lab ('N/A' where there is none).
+    assigned_labs holds one (student_id, course_id, lab_id) row per assigned lab.
+    """
+    theory = theory_time_data.drop_duplicates('course_id')[['course_id', 'id_day', 'start_time', 'end_time']]
+    theory = pd.DataFrame({
+        'course_id': theory['course_id'],
+        'theory_day': theory['id_day'].map(day_mapping).fillna('Unknown'),
+        'theory_start_time': theory['start_time'],
+        'theory_end_time': theory['end_time'],
+    })
+    labs = lab_time_data.drop_duplicates('lab_id')[['lab_id', 'id_day', 'start_time', 'end_time']]
+    labs = pd.DataFrame({
+        'lab_id': labs['lab_id'],
+        'lab_day': labs['id_day'].map(day_mapping).fillna('Unknown'),
+        'lab_start_time': labs['start_time'],
+        'lab_end_time': labs['end_time'],
+    })
+    assigned = (assigned_labs[['student_id', 'course_id', 'lab_id']]
+                .drop_duplicates(['student_id', 'course_id'])
+                .merge(labs, on='lab_id')
+                .drop(columns='lab_id'))
+    
+    results_df = (student_course_matching[['student_id', 'student_name', 'course_id', 'course_name', 'course_type']]
+                  .merge(theory, on='course_id', how='left')
+                  .merge(assigned, on=['student_id', 'course_id'], how='left'))
+    time_columns = ['theory_day', 'theory_start_time', 'theory_end_time', 'lab_day', 'lab_start_time', 'lab_end_time']
+    results_df[time_columns] = results_df[time_columns].astype(object).fillna('N/A')
+    
+    # One block of rows per student, in order of first appearance
+    student_order = {student_id: i for i, student_id in enumerate(results_df['student_id'].unique())}
+    results_df = results_df.sort_values('student_id', key=lambda ids: ids.map(student_order), kind='stable')
+    # Each student keeps the name of their first course matching row
+    results_df['student_name'] = results_df.groupby('student_id')['student_name'].transform('first')
+    return results_df.reset_index(drop=True)
+
+def _lab_conflict_rows(instance, conflict_index, conflict_formulation):
+    """
+    Time conflict rows of the lab model, from the conflict index.
+    Returns (rows, blocked): rows is a list of (name, candidates) that may hold
+    at most one lab, either one row per conflicting pair ('pairwise') or per
+    maximal clique of a student's labs ('clique'); blocked lists the candidates
+    whose lab overlaps a lecture of one of the student's courses.
+    """
+    student_ids = instance.student_ids[instance.cand_student]
+    lab_ids = instance.section_lab_id[instance.cand_section]
+    by_student = np.argsort(instance.cand_student, kind='stable')
+    candidate_rows = [rows.tolist() for rows in
+                      np.split(by_student, np.flatnonzero(np.diff(instance.cand_student[by_student])) + 1) if len(rows)]
+    enrolled = defaultdict(set)
+    for student, course in zip(instance.enroll_student.tolist(), instance.enroll_course.tolist()):
+        if course >= 0:
+            enrolled[student].add(instance.course_ids[course])
 
-    students = student_course_matching['student_id'].unique()
-    lab_time_data['lab_id'] = lab_time_data.apply(
-        lambda x: f"{x['course_id']}-{x['lab']}", axis=1
-    )
+    lab_time_conflicts = []
+    blocked = []
+    for rows in candidate_rows:
+        courses = enrolled[instance.cand_student[rows[0]]]
+        position = {lab_ids[k]: i for i, k in enumerate(rows)}
+        for i, k in enumerate(rows):
+            for other_lab_id in conflict_index['lab_conflicts'][lab_ids[k]]:
+                j = position.get(other_lab_id, -1)
+                if j > i:
+                    lab_time_conflicts.append((k, rows[j]))
+            # A lab cannot overlap the lecture of any course the student takes
+            if conflict_index['theory_conflicts'][lab_ids[k]] & courses:
+                blocked.append(k)
+
+    if conflict_formulation == 'clique':
+        conflict_rows = []
+        for rows in candidate_rows:
+            row_of = {lab_ids[k]: k for k in rows}
+            student_id = student_ids[rows[0]]
+            for c, clique in enumerate(student_conflict_cliques(row_of, conflict_index['lab_cliques'])):
+                conflict_rows.append((f"LabTimeClique_{student_id}_{c}", [row_of[lab_id] for lab_id in sorted(clique)]))
+        print(f"Lab time conflict rows: {len(conflict_rows)} clique rows "
+              f"(pairwise formulation: {len(lab_time_conflicts)} rows)")
+    else:
+        conflict_rows = [(f"LabTimeConflict_{student_ids[k1]}_{lab_ids[k1]}_{lab_ids[k2]}", [k1, k2])
+                         for k1, k2 in lab_time_conflicts]
+        print(f"Lab time conflict rows: {len(conflict_rows)} pairwise rows")
+    return conflict_rows, blocked
+
+def _solve_lab_ilp(instance, conflict_index, conflict_formulation, config):
+    """
+    Lab matching engine 'ilp': binary program solved with CBC through PuLP.
+    The model is presolved first (see presolve.py), so only the contested
+    candidates reach the solver.
+    Returns the solution as an array aligned with the lab candidates (None if
+    there is none) and the solver report.
+    """
+    n_candidates = len(instance.cand_section)
+    print(f"Lab decision variables: {n_candidates} (full students x labs model: "
+          f"{instance.num_students * len(instance.section_lab_id)})")
+
+    student_ids = instance.student_ids[instance.cand_student]
+    lab_ids = instance.section_lab_id[instance.cand_section]
+
+    # Constraints, as (name, candidates, sense, rhs)
+    rows = []
+    # 1. Exactly one lab per enrolled course with labs
+    indptr = instance.cand_indptr
+    for e in np.flatnonzero(np.diff(indptr)).tolist():
+        rows.append((f"LabAssignment_{instance.student_ids[instance.enroll_student[e]]}_"
+                     f"{instance.course_ids[instance.enroll_course[e]]}", range(indptr[e], indptr[e + 1]), '=', 1))
+
+    # 2. Lab capacity
+    by_section = np.argsort(instance.cand_section, kind='stable')
+    sorted_sections = instance.cand_section[by_section]
+    for candidates in np.split(by_section, np.flatnonzero(np.diff(sorted_sections)) + 1):
+        if len(candidates):
+            section = instance.cand_section[candidates[0]]
+            rows.append((f"LabCapacity_{instance.section_lab_id[section]}", candidates,
+                         '<', instance.section_capacity[section]))
+
+    # 3. Time conflicts, looked up in the conflict index built once for all students
+    conflict_rows, lab_theory_conflicts = _lab_conflict_rows(instance, conflict_index, conflict_formulation)
+    rows.extend((name, candidates, '<', 1) for name, candidates in conflict_rows)
+    rows.extend((f"LabTheoryConflict_{student_ids[k]}_{lab_ids[k]}", [k], '=', 0) for k in lab_theory_conflicts)
+
+    # Fix forced and uncontested labs before the solver sees them
+    utility = instance.cand_utility
+    model_rows = rows
+    fixed, rows, presolve_stats = _presolve(n_candidates, rows, utility)
+    if fixed is None:
+        return None, {'status': 'infeasible', 'gap': None, 'presolve': presolve_stats}
+    free = np.flatnonzero(fixed < 0)
 
-    Y = pulp.LpVariable.dicts("Y", 
-        [(s, l) for s in students for l in lab_time_data['lab_id']], 
-        cat=pulp.LpBinary
-    )
+    model = pulp.LpProblem("Lab_Matching", pulp.LpMaximize)
+    Y = pulp.LpVariable.dicts("Y", free.tolist(), cat=pulp.LpBinary)
+    model += pulp.LpAffineExpression((Y[k], int(utility[k])) for k in free[utility[free] > 0].tolist()), \
+        "Lab Preference Utility"
+    for name, candidates, sense, rhs in rows:
+        total = pulp.lpSum(Y[k] for k in candidates)
+        model += (total == rhs if sense == '=' else total <= rhs), name
+
+    # Seed the incumbent with the Gale-Shapley matching, completed along augmenting paths
+    start = None
+    if config.warm_start:
+        start, _ = _solve_lab_gale_shapley(instance, conflict_index, conflict_formulation, config)
+        start = np.where(fixed >= 0, fixed, augment_lab_assignment(instance, start))
+        for k in free.tolist():
+            Y[k].setInitialValue(start[k])
+        violated = [name for name, candidates, sense, rhs in model_rows
+                    if (start[list(candidates)].sum() != rhs if sense == '=' else start[list(candidates)].sum() > rhs)]
+        print("Warm start from Gale-Shapley: "
+              + (f"incomplete ({len(violated)} rows violated)" if violated else "feasible"))
+        if violated:
+            start = None
+
+    report = dict(_solve_cbc(model, config), presolve=presolve_stats)
+    print("\nSolver Status:", pulp.LpStatus[model.status])
 
-    lab_utility = []
-    for _, pref in pre_lab_ele_man_data.iterrows():
-        student_id = pref['student_id']
-        course_id = pref['course_id']
-        lab_num = pref['lab']
-        lab_id = f"{course_id}-{lab_num}"
+    # A feasible warm start is the answer of last resort
+    if not _has_solution(report) or model.sol_status not in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible):
+        if start is not None and report['status'] == 'time_limit':
+            print("No incumbent within the time limit, returning the warm start")
+            return start, dict(report, gap=None)
+        return None, report
 
-        course_match = student_course_matching[
-            (student_course_matching['student_id'] == student_id) & 
-            (student_course_matching['course_id'] == course_id)
-        ]
+    # The solution as one array aligned with the candidates
+    values = fixed.astype(float)
+    values[free] = [Y[k].varValue or 0 for k in free.tolist()]
+    return values, report
 
-        course_has_lab = course_data[
-            (course_data['course_id'] == course_id) & 
-            (course_data['has_lab'] == 1)
-        ]
+def _solve_lab_milp(instance, conflict_index, conflict_formulation, config):
+    """
+    Lab matching engine 'milp': the 'ilp' model assembled as a SciPy sparse
+    matrix and solved in-process by HiGHS through scipy.optimize.milp.
+    Returns the solution as an array aligned with the lab candidates (None if
+    there is none) and the solver report.
+    """
+    n_candidates = len(instance.cand_section)
+    print(f"Lab decision variables: {n_candidates} (full students x labs model: "
+          f"{instance.num_students * len(instance.section_lab_id)})")
+
+    # 1. Exactly one lab per enrolled course with labs
+    assignment, _ = _group_rows(instance.cand_enrollment)
+
+    # 2. Lab capacity
+    capacity, sections = _group_rows(instance.cand_section)
+
+    # 3. Time conflicts; labs overlapping a lecture are fixed to 0 through the bounds
+    conflict_rows, blocked = _lab_conflict_rows(instance, conflict_index, conflict_formulation)
+    columns = [rows for _, rows in conflict_rows]
+    conflicts = sparse.csr_array(
+        (np.ones(sum(map(len, columns))),
+         (np.repeat(np.arange(len(columns)), [len(rows) for rows in columns]).astype(np.int64),
+          np.fromiter((k for rows in columns for k in rows), dtype=np.int64))),
+        shape=(len(columns), n_candidates))
+    upper = np.ones(n_candidates)
+    upper[blocked] = 0
+
+    matrix = sparse.vstack([assignment, capacity, conflicts], format='csr')
+    row_lower = np.concatenate([np.ones(assignment.shape[0]), np.full(len(sections) + len(columns), -np.inf)])
+    row_upper = np.concatenate([np.ones(assignment.shape[0]), instance.section_capacity[sections], np.ones(len(columns))])
+    return _solve_milp(instance.cand_utility.astype(float), matrix, row_lower, row_upper,
+                       np.zeros(n_candidates), upper, config)
+
+def _solve_lab_gale_shapley(instance, conflict_index, conflict_formulation, config):
+    """
+    Lab matching engine 'gale_shapley': deferred acceptance over the lab
+    sections with the capacities of lab_time.csv.
+    
+    Each (student, course) proposes to its ranked labs, best first, then to the
+    remaining labs of the course. A lab that overlaps something the student
+    already holds (labs, or the lectures of their courses) is skipped. A full lab
+    keeps the students with the highest (priority, student_id), priority being
+    (max_rank + 1) - rank, or 0 for an unranked lab.
+    
+    Sections use the capacity and time arrays of the instance, with a weekly
+    occupancy bitmask per student (one bit per minute of the week), so a
+    conflict check is one AND and a proposal is O(1) plus a heap operation on the lab.
+    Returns the solution as an array aligned with the lab candidates and the
+    solver report.
+    """
+    capacity = instance.section_capacity.tolist()
+    lab_mask = [interval_mask(start, end)
+                for start, end in zip(instance.section_start.tolist(), instance.section_end.tolist())]
+    
+    # Weekly occupancy starts with the lectures of the student's courses
+    theory_mask = defaultdict(int)
+    for course, start, end in zip(instance.theory_course.tolist(), instance.theory_start.tolist(),
+                                  instance.theory_end.tolist()):
+        theory_mask[course] |= interval_mask(start, end)
+    occupancy = [0] * instance.num_students
+    for student, course in zip(instance.enroll_student.tolist(), instance.enroll_course.tolist()):
+        if course >= 0:
+            occupancy[student] |= theory_mask[course]
+    
+    # Proposal lists: ranked labs by rank, then unranked labs in lab_time order
+    ranks = instance.cand_rank
+    priority = np.where(ranks > 0, instance.max_lab_rank + 1 - ranks, 0).tolist()
+    order = np.lexsort((np.where(ranks > 0, ranks, np.iinfo(np.int32).max), instance.cand_enrollment))
+    choices = defaultdict(list)  # enrollment -> [candidate, ...]
+    for k, e in zip(order.tolist(), instance.cand_enrollment[order].tolist()):
+        choices[e].append(k)
+    
+    student_ids = instance.student_ids.tolist()
+    cand_student = instance.cand_student.tolist()
+    cand_enrollment = instance.cand_enrollment.tolist()
+    cand_section = instance.cand_section.tolist()
+    
+    queue = deque(choices)
+    next_choice = defaultdict(int)
+    held = {}  # enrollment -> candidate
+    holders = defaultdict(list)  # lab -> heap of (priority, student_id, candidate)
+    
+    while queue:
+        e = queue.popleft()
+        if e in held:
+            continue
+        options = choices[e]
+        if next_choice[e] >= len(options):
+            continue
+        k = options[next_choice[e]]
+        next_choice[e] += 1
+        
+        student = cand_student[k]
+        lab = cand_section[k]
+        mask = lab_mask[lab]
+        if occupancy[student] & mask:
+            queue.append(e)
+            continue
+        
+        heap = holders[lab]
+        entry = (priority[k], student_ids[student], k)
+        if len(heap) < capacity[lab]:
+            heapq.heappush(heap, entry)
+        elif heap and entry > heap[0]:
+            _, _, bumped = heapq.heapreplace(heap, entry)
+            del held[cand_enrollment[bumped]]
+            occupancy[cand_student[bumped]] &= ~mask
+            queue.append(cand_enrollment[bumped])
+        else:
+            queue.append(e)
+            continue
+        held[e] = k
+        occupancy[student] |= mask
+    
+    missing_labs = [(student_ids[instance.enroll_student[e]], instance.course_ids[instance.enroll_course[e]])
+                    for e in choices if e not in held]
+    if missing_labs:
+        print(f"Warning: {len(missing_labs)} student-course pairs still need lab assignments")
+        print("First few missing assignments:", missing_labs[:5])
+    
+    values = np.zeros(len(cand_section))
+    values[list(held.values())] = 1
+    return values, {'status': 'heuristic', 'gap': None}
 
-        if not course_match.empty and not course_has_lab.empty and lab_id in lab_time_data['lab_id'].values:
-            utility = calculate_utility(pref['preference_rank'])
-            lab_utility.append(utility * Y[(student_id, lab_id)])
+# Sections tried per student repack in augment_lab_assignment, which bounds its search
+REPACK_NODES = 10_000
 
-    model += pulp.lpSum(lab_utility), "Lab Preference Utility"
+def augment_lab_assignment(instance, values):
+    """
+    Complete a lab assignment (aligned with the lab candidates) along
+    augmenting paths: a course without a lab takes a section, displacing at
+    most one other lab, either a holder of the section if it is full or a lab
+    of the same student that clashes with it; the displaced lab is placed the
+    same way, and so on, until a move displaces nothing. Paths are found by
+    breadth-first search over the displaced enrollments, so they are shortest.
+    A course whose every section clashes with two or more labs of the student
+    has no such path: the student's labs are then repacked together, all of
+    them into sections with a free seat (a bounded depth-first search).
+    Returns the completed copy of values; courses that neither finds a lab for
+    stay without one.
+    """
+    values = (np.asarray(values) > 0.5).astype(float)
+    lab_mask = [interval_mask(start, end)
+                for start, end in zip(instance.section_start.tolist(), instance.section_end.tolist())]
+    theory_mask = defaultdict(int)
+    for course, start, end in zip(instance.theory_course.tolist(), instance.theory_start.tolist(),
+                                  instance.theory_end.tolist()):
+        theory_mask[course] |= interval_mask(start, end)
+    busy = [0] * instance.num_students  # theory sessions of every student
+    for student, course in zip(instance.enroll_student.tolist(), instance.enroll_course.tolist()):
+        if course >= 0:
+            busy[student] |= theory_mask[course]
+    
+    indptr = instance.cand_indptr.tolist()
+    cand_section = instance.cand_section.tolist()
+    cand_enrollment = instance.cand_enrollment.tolist()
+    enroll_student = instance.enroll_student.tolist()
+    capacity = instance.section_capacity.tolist()
+    held = {}  # enrollment -> candidate
+    holders = defaultdict(set)  # section -> enrollments holding it
+    labs = defaultdict(set)  # student -> enrollments holding a lab
+    for k in np.flatnonzero(values).tolist():
+        e = cand_enrollment[k]
+        held[e] = k
+        holders[cand_section[k]].add(e)
+        labs[enroll_student[e]].add(e)
+    
+    def displaced_by(e, k):
+        """Enrollments that lose their lab when e takes candidate k, None if e cannot take it."""
+        section, student = cand_section[k], enroll_student[e]
+        if busy[student] & lab_mask[section]:
+            return None
+        clashes = [other for other in labs[student]
+                   if other != e and lab_mask[cand_section[held[other]]] & lab_mask[section]]
+        if len(holders[section]) >= capacity[section]:
+            return clashes + [None] if not clashes else None  # None: any holder of the section
+        return clashes
+    
+    def assign(e, k):
+        if e in held:
+            unassign(e)
+        held[e] = k
+        values[k] = 1
+        holders[cand_section[k]].add(e)
+        labs[enroll_student[e]].add(e)
+    
+    def unassign(e):
+        k = held.pop(e)
+        values[k] = 0
+        holders[cand_section[k]].discard(e)
+        labs[enroll_student[e]].discard(e)
+    
+    enrollments = defaultdict(list)  # student -> enrollments with lab candidates
+    for e in range(len(indptr) - 1):
+        if indptr[e] < indptr[e + 1]:
+            enrollments[enroll_student[e]].append(e)
+    utility = instance.cand_utility.tolist()
+    
+    def repack(student):
+        """Give every lab course of student a section with a free seat at once; False (unchanged) if none is found."""
+        kept = {e: held[e] for e in enrollments[student] if e in held}
+        for e in kept:
+            unassign(e)
+        # Fewest candidates first; the held section, then the best ranked, first within a course
+        order = sorted(enrollments[student], key=lambda e: indptr[e + 1] - indptr[e])
+        choices = [sorted(range(indptr[e], indptr[e + 1]), key=lambda k: (kept.get(e) != k, -utility[k]))
+                   for e in order]
+        chosen = []
+        budget = [REPACK_NODES]
+        
+        def search(i, mask):
+            if i == len(order):
+                return True
+            for k in choices[i]:
+                section = cand_section[k]
+                if budget[0] <= 0:
+                    return False
+                budget[0] -= 1
+                if len(holders[section]) < capacity[section] and not (mask | busy[student]) & lab_mask[section]:
+                    chosen.append(k)
+                    if search(i + 1, mask | lab_mask[section]):
+                        return True
+                    chosen.pop()
+            return False
+        
+        found = search(0, 0)
+        for e, k in (zip(order, chosen) if found else kept.items()):
+            assign(e, k)
+        return found
+    
+    # Paths change the assignment, so later passes may find paths the earlier ones could not
+    progress = True
+    while progress:
+        progress = False
+        for student in {enroll_student[e] for e in range(len(indptr) - 1)
+                        if e not in held and indptr[e] < indptr[e + 1]}:
+            progress |= repack(student)
+        for e in range(len(indptr) - 1):
+            if e in held or indptr[e] == indptr[e + 1]:
+                continue
+            # BFS: parent[displaced enrollment] = (enrollment it made room for, candidate taken)
+            parent = {e: None}
+            queue = deque([e])
+            end = None
+            while queue and end is None:
+                mover = queue.popleft()
+                for k in range(indptr[mover], indptr[mover + 1]):
+                    if held.get(mover) == k:
+                        continue
+                    displaced = displaced_by(mover, k)
+                    if displaced is None or len(displaced) > 1:
+                        continue
+                    if not displaced:
+                        end = (mover, k)
+                        break
+                    candidates = holders[cand_section[k]] if displaced[0] is None else displaced
+                    for other in candidates:
+                        if other not in parent:
+                            parent[other] = (mover, k)
+                            queue.append(other)
+            if end is None:
+                continue
+            
+            # Replay the path from the unassigned enrollment; the search read the initial state,
+            # so a path that meets itself is checked move by move and undone if it no longer fits
+            moves = [end]
+            mover = end[0]
+            while parent[mover] is not None:
+                moves.append(parent[mover])
+                mover = parent[mover][0]
+            snapshot = dict(held)
+            for (mover, k), (displaced, _) in zip(reversed(moves), list(reversed(moves))[1:] + [(None, None)]):
+                room = displaced_by(mover, k)
+                if room == [None] and displaced in holders[cand_section[k]]:
+                    room = [displaced]
+                if room is None or room != ([displaced] if displaced is not None else []):
+                    for other in list(held):
+                        unassign(other)
+                    for other, kept in snapshot.items():
+                        assign(other, kept)
+                    break
+                if displaced is not None:
+                    unassign(displaced)
+                assign(mover, k)
+            else:
+                progress = True
+    return values
 
-    for student_id in students:
-        student_courses = student_course_matching[
-            student_course_matching['student_id'] == student_id
-        ]
-        for _, course in student_courses.iterrows():
-            course_has_lab = course_data[
-                (course_data['course_id'] == course['course_id']) & 
-                (course_data['has_lab'] == 1)
-            ]
-            if not course_has_lab.empty:
-                possible_labs = lab_time_data[
-                    lab_time_data['course_id'] == course['course_id']
-                ]
-                course_lab_ids = [
-                    f"{course['course_id']}-{lab['lab']}" 
-                    for _, lab in possible_labs.iterrows()
-                ]
-                model += pulp.lpSum(Y[(student_id, l)] for l in course_lab_ids) == 1, \
-                    f"LabAssignment_{student_id}_{course['course_id']}"
 
-    lab_time_conflicts = []
-    for student_id in students:
-        student_courses_with_labs = student_course_matching[
-            (student_course_matching['student_id'] == student_id) & 
-            (student_course_matching['course_id'].isin(
-                course_data[course_data['has_lab'] == 1]['course_id']
-            ))
-        ]
-        lab_schedules = []
-        for _, course in student_courses_with_labs.iterrows():
-            course_labs = lab_time_data[lab_time_data['course_id'] == course['course_id']]
-            for _, lab in course_labs.iterrows():
-                lab_schedules.append({
-                    'course_id': lab['course_id'],
-                    'lab': lab['lab'],
-                    'day': day_mapping.get(lab['id_day'], 'Unknown'),
-                    'start_time': lab['start_time'],
-                    'end_time': lab['end_time']
-                })
-        for i in range(len(lab_schedules)):
-            for j in range(i+1, len(lab_schedules)):
-                lab1 = lab_schedules[i]
-                lab2 = lab_schedules[j]
-                if check_time_conflict(
-                    lab1['day'], lab1['start_time'], lab1['end_time'],
-                    lab2['day'], lab2['start_time'], lab2['end_time']
-                ):
-                    lab_id1 = f"{lab1['course_id']}-{lab1['lab']}"
-                    lab_id2 = f"{lab2['course_id']}-{lab2['lab']}"
-                    lab_time_conflicts.append((student_id, lab_id1, lab_id2))
-
-    for student_id, lab_id1, lab_id2 in lab_time_conflicts:
-        model += Y[(student_id, lab_id1)] + Y[(student_id, lab_id2)] <= 1, \
-            f"LabTimeConflict_{student_id}_{lab_id1}_{lab_id2}"
-
-    model.solve()
-    print("\nSolver Status:", pulp.LpStatus[model.status])
+# Engines for the lab matching stage, selectable by name
+LAB_ENGINES = {
+    'ilp': _solve_lab_ilp,
+    'gale_shapley': _solve_lab_gale_shapley,
+    'milp': _solve_lab_milp,
+}
 
-    if pulp.LpStatus[model.status] not in ['Optimal', 'Feasible']:
+def solve_lab_matching(student_course_matching, lab_time_data, day_mapping,
+                       pre_lab_ele_man_data, theory_time_data, course_data,
+                       conflict_formulation='pairwise', engine='ilp', solver_config=None, progress=None):
+    """
+    Match students to lab sections for the courses they were assigned and
+    return the student_lab_matching table, or None if no solution exists.
+    
+    conflict_formulation: how lab time conflicts enter the ILP
+        'pairwise' - one Y[s,l1] + Y[s,l2] <= 1 row per conflicting pair (default)
+        'clique'   - one sum(Y[s,l]) <= 1 row per maximal set of labs running at
+                     the same instant; fewer rows and a tighter LP relaxation
+    engine: name of the lab matching engine, see LAB_ENGINES
+        'ilp'          - binary program solved with CBC (default)
+        'milp'         - the same model as a sparse matrix, solved in-process by HiGHS
+        'gale_shapley' - deferred acceptance, a fast (not optimal) preview
+    solver_config: SolverConfig of the 'ilp' and 'milp' solvers (default: from
+        the environment); the solver report is kept in results_df.attrs['solver_report']
+    progress: called with the name of each phase as it starts ('build', 'solve', 'extract')
+    """
+    if conflict_formulation not in ('pairwise', 'clique'):
+        raise ValueError(f"Unknown conflict formulation '{conflict_formulation}', expected 'pairwise' or 'clique'")
+    if engine not in LAB_ENGINES:
+        raise ValueError(f"Unknown lab matching engine '{engine}', expected one of {sorted(LAB_ENGINES)}")
+    progress = progress or _no_progress
+    
+    progress('build')
+    print("Initial Data Analysis:")
+    print("Total students in course matching:", len(student_course_matching['student_id'].unique()))
+    print("Total lab time entries:", len(lab_time_data))
+    
+    lab_time_data = lab_time_data.assign(
+        lab_id=lab_time_data['course_id'].astype(str) + '-' + lab_time_data['lab'].astype(str))
+
+    # Only the labs of courses the student is enrolled in (with has_lab == 1) can be assigned
+    instance = MatchingInstance.from_lab_data(student_course_matching, lab_time_data, pre_lab_ele_man_data,
+                                              theory_time_data, course_data)
+    conflict_index = build_conflict_index(lab_time_data, theory_time_data)
+
+    if solver_config is None:
+        solver_config = SolverConfig.from_env()
+
+    progress('solve')
+    started = time.perf_counter()
+    values, report = LAB_ENGINES[engine](instance, conflict_index, conflict_formulation, solver_config)
+    objective = None if values is None else float(instance.cand_utility @ values)
+    report = _finish_report(report, engine, objective, started)
+    if values is None:
         print("Could not find a solution.")
         return None
 
-    results = []
-    for student_id in students:
-        student_courses = student_course_matching[
-            student_course_matching['student_id'] == student_id
-        ]
-        student_name = student_courses['student_name'].iloc[0]
-
-        for _, course in student_courses.iterrows():
-            theory_time = theory_time_data[theory_time_data['course_id'] == course['course_id']]
-            lab_day = lab_start_time = lab_end_time = 'N/A'
-            course_info = course_data[course_data['course_id'] == course['course_id']]
-            has_lab = course_info['has_lab'].iloc[0] if not course_info.empty else 0
-
-            if has_lab == 1:
-                course_labs = lab_time_data[lab_time_data['course_id'] == course['course_id']]
-                for _, lab in course_labs.iterrows():
-                    lab_id = f"{lab['course_id']}-{lab['lab']}"
-                    if Y[(student_id, lab_id)].value() > 0.5:
-                        lab_day = day_mapping.get(lab['id_day'], 'Unknown')
-                        lab_start_time = lab['start_time']
-                        lab_end_time = lab['end_time']
-                        break
+    # Extract results: decode the assigned candidates
+    progress('extract')
+    chosen = np.flatnonzero(values > 0.5)
+    assigned_labs = pd.DataFrame({
+        'student_id': instance.student_ids[instance.cand_student[chosen]],
+        'course_id': instance.course_ids[instance.enroll_course[instance.cand_enrollment[chosen]]],
+        'lab_id': instance.section_lab_id[instance.cand_section[chosen]],
+    })
+    results_df = build_lab_results(student_course_matching, assigned_labs, lab_time_data, day_mapping, theory_time_data)
+    results_df.attrs['solver_report'] = report
+    return results_df
 
-            results.append({
-                'student_id': student_id,
-                'student_name': student_name,
-                'course_id': course['course_id'],
-                'course_name': course['course_name'],
-                'course_type': course['course_type'],
-                'theory_day': day_mapping.get(theory_time['id_day'].iloc[0], 'Unknown') if not theory_time.empty else 'N/A',
-                'theory_start_time': theory_time['start_time'].iloc[0] if not theory_time.empty else 'N/A',
-                'theory_end_time': theory_time['end_time'].iloc[0] if not theory_time.empty else 'N/A',
-                'lab_day': lab_day,
-                'lab_start_time': lab_start_time,
-                'lab_end_time': lab_end_time
-            })
+def optimize_lab_matching(conflict_formulation='pairwise', engine='ilp', solver_config=None, progress=None,
+                          student_course_matching=None, save=True):
+    """
+    Optimize lab matching for students based on course matching and preferences
+    
+    conflict_formulation: 'pairwise' (default) or 'clique', see solve_lab_matching
+    engine: 'ilp' (default), 'milp' or 'gale_shapley', see LAB_ENGINES
+    solver_config: SolverConfig for 'ilp' and 'milp', see solve_lab_matching
+    progress: called with the name of each phase as it starts ('load', 'build', 'solve', 'extract')
+    student_course_matching: the course matching to assign labs for (default: read
+        from student_course_matching.csv)
+    save: write the result to student_lab_matching.csv
+    """
+    progress = progress or _no_progress
+    progress('load')
+    (student_course_matching, lab_time_data, day_mapping, 
+     pre_lab_ele_man_data, theory_time_data, course_data) = load_data_second(student_course_matching)
+    
+    results_df = solve_lab_matching(student_course_matching, lab_time_data, day_mapping,
+                                    pre_lab_ele_man_data, theory_time_data, course_data,
+                                    conflict_formulation=conflict_formulation, engine=engine,
+                                    solver_config=solver_config, progress=progress)
+    if results_df is None:
+        return None
 
-    results_df = pd.DataFrame(results)
-    results_df.to_csv('student_lab_matching.csv', index=False)
-    print("Course matching completed. Results saved to student_lab_matching.csv")
+    if save:
+        results_df.to_csv('student_lab_matching.csv', index=False)
+        print("Course matching completed. Results saved to student_lab_matching.csv")
     return results_df
 
 def main():
@@ -1,82 +1,242 @@
 import pandas as pd
 import sqlite3
 
-#load csv
-
-
-def load_csvs_to_db(csv_folder_path, db_name="student_matching.db"):
-    # Define the filenames and corresponding table names
-    files_tables = {
-        "course.csv": "course",
-        "day.csv": "day",
-        "elective_capacity.csv": "elective_capacity",
-        "elective_preference.csv": "elective_preference",
-        "lab_time.csv": "lab_time",
-        "pre_lab_ele_man.csv": "pre_lab_ele_man",
-        "program.csv": "program",
-        "student.csv": "student",
-        "theory_time.csv": "theory"
-    }
-
-    # Create connection to the SQLite database
-    conn = sqlite3.connect(db_name)
+# SQLite storage of the backend tables.
+#
+# The schema keys every table on its natural primary key (a course listed under
+# several programs has a row per program, as in course.csv) and indexes the
+# columns the loaders join and filter on (student_id, course_id, program_id,
+# (course_id, lab)). Names and string values are stripped once at import, so
+# the loaders return clean tables. A preference listed twice keeps its best
+# rank, as the matching models do.
+
+DB_NAME = "student_matching.db"
+
+SCHEMA = """
+CREATE TABLE program (
+    program_id INTEGER PRIMARY KEY,
+    program TEXT
+);
+CREATE TABLE day (
+    id_day INTEGER PRIMARY KEY,
+    day TEXT
+);
+CREATE TABLE course (
+    course_id INTEGER NOT NULL,
+    course_name TEXT,
+    mandatory INTEGER NOT NULL,
+    program_id INTEGER NOT NULL,
+    has_lab INTEGER NOT NULL,
+    PRIMARY KEY (course_id, program_id)
+);
+CREATE INDEX course_program ON course (program_id);
+CREATE TABLE student (
+    student_id INTEGER PRIMARY KEY,
+    name TEXT,
+    program TEXT,
+    program_id INTEGER NOT NULL,
+    required_electives INTEGER NOT NULL
+);
+CREATE INDEX student_program ON student (program_id);
+CREATE TABLE elective_capacity (
+    course_id INTEGER PRIMARY KEY,
+    course_name TEXT,
+    capacity INTEGER NOT NULL
+);
+CREATE TABLE elective_preference (
+    student_id INTEGER NOT NULL,
+    program_id INTEGER,
+    course_id INTEGER NOT NULL,
+    preference_rank INTEGER NOT NULL,
+    PRIMARY KEY (student_id, course_id)
+);
+CREATE INDEX elective_preference_course ON elective_preference (course_id);
+CREATE TABLE lab_time (
+    course_id INTEGER NOT NULL,
+    course_name TEXT,
+    allowed_for_program_id INTEGER,
+    lab INTEGER NOT NULL,
+    id_day INTEGER,
+    start_time TEXT,
+    end_time TEXT,
+    capacity INTEGER,
+    PRIMARY KEY (course_id, lab)
+);
+CREATE TABLE pre_lab_ele_man (
+    student_id INTEGER NOT NULL,
+    program_id INTEGER,
+    course_id INTEGER NOT NULL,
+    lab INTEGER NOT NULL,
+    preference_rank INTEGER NOT NULL,
+    PRIMARY KEY (student_id, course_id, lab)
+);
+CREATE INDEX pre_lab_ele_man_lab ON pre_lab_ele_man (course_id, lab);
+CREATE TABLE theory_time (
+    course_id INTEGER NOT NULL,
+    course_name TEXT,
+    id_day INTEGER,
+    start_time TEXT,
+    end_time TEXT
+);
+CREATE INDEX theory_time_course ON theory_time (course_id);
+"""
+
+COURSE_MATCHING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS student_course_matching (
+    student_id INTEGER NOT NULL,
+    student_name TEXT,
+    course_type TEXT,
+    course_id INTEGER NOT NULL,
+    course_name TEXT,
+    PRIMARY KEY (student_id, course_id)
+);
+CREATE INDEX IF NOT EXISTS student_course_matching_course ON student_course_matching (course_id);
+"""
+
+# CSV file -> (table, conflict clause of its insert)
+FILES_TABLES = {
+    "course.csv": ("course", ""),
+    "day.csv": ("day", ""),
+    "elective_capacity.csv": ("elective_capacity", ""),
+    "elective_preference.csv": ("elective_preference", "ON CONFLICT (student_id, course_id) DO UPDATE SET "
+                                "preference_rank = MIN(preference_rank, excluded.preference_rank)"),
+    "lab_time.csv": ("lab_time", ""),
+    "pre_lab_ele_man.csv": ("pre_lab_ele_man", "ON CONFLICT (student_id, course_id, lab) DO UPDATE SET "
+                            "preference_rank = MIN(preference_rank, excluded.preference_rank)"),
+    "program.csv": ("program", ""),
+    "student.csv": ("student", ""),
+    "theory_time.csv": ("theory_time", ""),
+}
+
+
+def _clean(df):
+    """Strip column names and string values; rows as tuples of plain Python values."""
+    df.columns = df.columns.str.strip()
+    for col in df.select_dtypes(include=['object']).columns:
+        df[col] = df[col].str.strip()
+    return df.astype(object).where(df.notna(), None)
+
+
+def _insert_rows(conn, table, df, conflict=""):
+    columns = ", ".join(df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) {conflict}",
+                     df.itertuples(index=False, name=None))
+
+
+def load_csvs_to_db(csv_folder_path, db_name=DB_NAME):
+    """
+    Rebuild the database from the CSVs in csv_folder_path, in one transaction.
+    The course matching of an earlier run is kept.
+    """
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        # The import is all or nothing; a crash loses at most the rebuild itself
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("BEGIN")
+        for table, _ in FILES_TABLES.values():
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        for statement in SCHEMA.split(";"):
+            if statement.strip():
+                conn.execute(statement)
+        for filename, (table, conflict) in FILES_TABLES.items():
+            df = _clean(pd.read_csv(f"{csv_folder_path}/{filename}"))
+            _insert_rows(conn, table, df, conflict)
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    print(f"All tables loaded into {db_name}")
 
-    # Read each CSV and store in the database
-    for filename, table_name in files_tables.items():
-        df = pd.read_csv(f"{csv_folder_path}/{filename}")
-        df.to_sql(table_name, conn, if_exists="replace", index=False)
 
-    conn.commit()
-    conn.close()
-    print(f"All tables loaded into {db_name}")
+def save_course_matching(results_df, db_name=DB_NAME):
+    """Replace the stored course matching with results_df."""
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    try:
+        conn.executescript(COURSE_MATCHING_SCHEMA)
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM student_course_matching")
+        _insert_rows(conn, "student_course_matching",
+                     _clean(results_df[['student_id', 'student_name', 'course_type', 'course_id',
+                                        'course_name']].copy()))
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _program_filter(column, program_ids):
+    """SQL condition and parameters restricting column to program_ids (None: every program)."""
+    if program_ids is None:
+        return "1", []
+    program_ids = [int(program_id) for program_id in program_ids]
+    return f"{column} IN ({', '.join('?' * len(program_ids))})", program_ids
 
 #load data for elective course matching
 
-def load_data_first():
+def load_data_first(db_name=DB_NAME, program_ids=None):
     """
     Load data for elective course matching from the SQLite database.
+    program_ids: only the students and courses of these programs (None: all),
+    e.g. one independent block of solve_course_matching_by_program
     """
-    conn = sqlite3.connect('student_matching.db')
-
-    course_data = pd.read_sql_query("SELECT * FROM course", conn)
-    student_data = pd.read_sql_query("SELECT * FROM student", conn)
-    elective_capacity_data = pd.read_sql_query("SELECT * FROM elective_capacity", conn)
-    elective_preference_data = pd.read_sql_query("SELECT * FROM elective_preference", conn)
-
-    # Clean up whitespace
-    for df in [course_data, student_data, elective_capacity_data, elective_preference_data]:
-        df.columns = df.columns.str.strip()
-        for col in df.select_dtypes(include=['object']).columns:
-            df[col] = df[col].str.strip()
-
-    conn.close()
+    conn = sqlite3.connect(db_name)
+    try:
+        condition, params = _program_filter("program_id", program_ids)
+        course_data = pd.read_sql_query(f"SELECT * FROM course WHERE {condition}", conn, params=params)
+        student_data = pd.read_sql_query(f"SELECT * FROM student WHERE {condition}", conn, params=params)
+        # IN rather than a join: a course of several programs has several course rows
+        elective_capacity_data = pd.read_sql_query(
+            f"SELECT * FROM elective_capacity WHERE course_id IN (SELECT course_id FROM course WHERE {condition})",
+            conn, params=params)
+        # Preferences of the selected students for electives of their own program
+        condition, params = _program_filter("s.program_id", program_ids)
+        elective_preference_data = pd.read_sql_query(
+            "SELECT p.student_id, p.program_id, p.course_id, p.preference_rank "
+            "FROM elective_preference p "
+            "JOIN student s ON s.student_id = p.student_id "
+            "JOIN course c ON c.course_id = p.course_id AND c.program_id = s.program_id AND c.mandatory = 0 "
+            f"WHERE {condition}", conn, params=params)
+    finally:
+        conn.close()
     return course_data, student_data, elective_capacity_data, elective_preference_data
 
 #load data for lab course matching
 
-def load_data_second():
+def load_data_second(db_name=DB_NAME):
     """
-    Load data for lab matching optimization from the SQLite database.
+    Load data for lab matching optimization from the SQLite database: only the
+    lab sections and lab preferences of the courses in the stored course
+    matching, and the lectures of those courses.
     """
-    conn = sqlite3.connect('student_matching.db')
-
-    student_course_matching = pd.read_sql_query("SELECT * FROM student_course_matching", conn)
-    lab_time_data = pd.read_sql_query("SELECT * FROM lab_time", conn)
-    day_data = pd.read_sql_query("SELECT * FROM day", conn)
-    pre_lab_ele_man_data = pd.read_sql_query("SELECT * FROM pre_lab_ele_man", conn)
-    theory_time_data = pd.read_sql_query("SELECT * FROM theory_time", conn)
-    course_data = pd.read_sql_query("SELECT * FROM course", conn)
-
-    # Clean up whitespace
-    for df in [student_course_matching, lab_time_data, day_data,
-               pre_lab_ele_man_data, theory_time_data, course_data]:
-        df.columns = df.columns.str.strip()
-        for col in df.select_dtypes(include=['object']).columns:
-            df[col] = df[col].str.strip()
+    conn = sqlite3.connect(db_name)
+    try:
+        student_course_matching = pd.read_sql_query("SELECT * FROM student_course_matching", conn)
+        matched_courses = "SELECT DISTINCT course_id FROM student_course_matching"
+        lab_time_data = pd.read_sql_query(
+            "SELECT * FROM lab_time WHERE course_id IN (SELECT course_id FROM course WHERE has_lab = 1) "
+            f"AND course_id IN ({matched_courses})", conn)
+        day_data = pd.read_sql_query("SELECT id_day, day FROM day", conn)
+        # Preferences for the labs of courses each student was actually matched to
+        pre_lab_ele_man_data = pd.read_sql_query(
+            "SELECT p.* FROM pre_lab_ele_man p "
+            "JOIN student_course_matching m ON m.student_id = p.student_id AND m.course_id = p.course_id", conn)
+        theory_time_data = pd.read_sql_query(
+            f"SELECT * FROM theory_time WHERE course_id IN ({matched_courses})", conn)
+        course_data = pd.read_sql_query(f"SELECT * FROM course WHERE course_id IN ({matched_courses})", conn)
+    finally:
+        conn.close()
 
     # Map day IDs to day names
     day_mapping = dict(zip(day_data['id_day'], day_data['day']))
 
-    conn.close()
     return (student_course_matching, lab_time_data, day_mapping,
-            pre_lab_ele_man_data, theory_time_data, course_data)
\ No newline at end of file
+            pre_lab_ele_man_data, theory_time_data, course_data)
@@ -0,0 +1,1128 @@
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from algorithm_f import (solve_course_matching, gale_shapley_electives, solve_lab_matching, solve_course_matching_by_program, find_program_blocks,
+                         calculate_utility, check_time_conflict, build_conflict_index, student_conflict_cliques,
+                         validate_course_solution, augment_course_assignment, augment_lab_assignment)
+from matching_instance import MatchingInstance
+from solver_config import SolverConfig
+from presolve import presolve
+from incremental import IncrementalMatching
+from jobs import JobQueue, run_matching
+from result_cache import ResultCache, input_fingerprint
+from snapshot import write_snapshot, read_table, read_preferences, normalize
+import sql_db
+from student_registry import register_student, read_csv_shared, program_ids
+from preference_upload import ingest_preferences
+
+
+def make_course_instance(seed, n_students=30, n_programs=2, n_mandatory=2, n_electives=5):
+    """Build a random course matching instance with the columns of the backend CSVs"""
+    rng = np.random.default_rng(seed)
+    courses = []
+    capacities = []
+    course_id = 1
+    for program_id in range(1, n_programs + 1):
+        for i in range(n_mandatory + n_electives):
+            mandatory = int(i < n_mandatory)
+            courses.append([course_id, f"Course {course_id}", mandatory, program_id, int(rng.integers(0, 2))])
+            if not mandatory:
+                capacities.append([course_id, f"Course {course_id}", int(rng.integers(5, 15))])
+            course_id += 1
+    course_data = pd.DataFrame(courses, columns=['course_id', 'course_name', 'mandatory', 'program_id', 'has_lab'])
+
+    students = []
+    preferences = []
+    for i in range(n_students):
+        student_id = 1000 + i
+        program_id = int(rng.integers(1, n_programs + 1))
+        students.append([student_id, f"Student {student_id}", f"P{program_id}", program_id, 2])
+        electives = course_data[(course_data['program_id'] == program_id) & (course_data['mandatory'] == 0)]['course_id']
+        ranked = rng.permutation(electives.to_numpy())[:int(rng.integers(2, len(electives) + 1))]
+        for rank, elective in enumerate(ranked, start=1):
+            preferences.append([student_id, program_id, int(elective), rank])
+    student_data = pd.DataFrame(students, columns=['student_id', 'name', 'program', 'program_id', 'required_electives'])
+    elective_capacity_data = pd.DataFrame(capacities, columns=['course_id', 'course_name', 'capacity'])
+    elective_preference_data = pd.DataFrame(preferences, columns=['student_id', 'program_id', 'course_id', 'preference_rank'])
+    return course_data, student_data, elective_capacity_data, elective_preference_data
+
+
+def total_utility(results_df, elective_preference_data):
+    """Sum of preference utilities over the assigned (student, course) pairs"""
+    merged = results_df.merge(elective_preference_data, on=['student_id', 'course_id'])
+    return sum(calculate_utility(rank) for rank in merged['preference_rank'])
+
+
+def legacy_gale_shapley_electives(students, required_electives, preferences, priority, capacities):
+    """The list-based deferred acceptance loop of the original gale_shapley_course_matching"""
+    rows = [{'student_id': s, 'required_electives': required_electives[s], 'assigned_electives': 0}
+            for s in students if required_electives[s] > 0]
+    course_assignments = defaultdict(list)
+    student_assignments = defaultdict(list)
+    unmatched_students = [row['student_id'] for row in rows]
+    proposed_to = defaultdict(set)
+    while unmatched_students:
+        student_id = unmatched_students.pop(0)
+        row = next(r for r in rows if r['student_id'] == student_id)
+        if row['assigned_electives'] >= row['required_electives']:
+            continue
+        next_preferences = [c for c in preferences.get(student_id, []) if c not in proposed_to[student_id]]
+        if not next_preferences:
+            continue
+        course_id = next_preferences[0]
+        proposed_to[student_id].add(course_id)
+        if len(course_assignments[course_id]) < capacities.get(course_id, 0):
+            course_assignments[course_id].append(student_id)
+            student_assignments[student_id].append(course_id)
+            row['assigned_electives'] += 1
+            if row['assigned_electives'] < row['required_electives']:
+                unmatched_students.append(student_id)
+        else:
+            current = course_assignments[course_id]
+            ranked = sorted(((s, priority.get((course_id, s), 0)) for s in current + [student_id]),
+                            key=lambda x: x[1], reverse=True)
+            selected = [s for s, _ in ranked[:capacities.get(course_id, 0)]]
+            if student_id in selected:
+                bumped_students = [s for s in current if s not in selected]
+                course_assignments[course_id] = selected
+                student_assignments[student_id].append(course_id)
+                row['assigned_electives'] += 1
+                if row['assigned_electives'] < row['required_electives']:
+                    unmatched_students.append(student_id)
+                for bumped in bumped_students:
+                    student_assignments[bumped].remove(course_id)
+                    next(r for r in rows if r['student_id'] == bumped)['assigned_electives'] -= 1
+                    unmatched_students.append(bumped)
+            else:
+                unmatched_students.append(student_id)
+    return student_assignments
+
+
+class TestCourseEngines(unittest.TestCase):
+
+    def check_feasible(self, results_df, instance):
+        course_data, student_data, elective_capacity_data, _ = instance
+        electives = results_df[results_df['course_type'] == 'Elective']
+        # Exact number of electives per student
+        counts = electives.groupby('student_id').size()
+        for student_id, required in zip(student_data['student_id'], student_data['required_electives']):
+            self.assertEqual(counts.get(student_id, 0), required)
+        # Capacities respected
+        load = electives.groupby('course_id').size()
+        for course_id, capacity in zip(elective_capacity_data['course_id'], elective_capacity_data['capacity']):
+            self.assertLessEqual(load.get(course_id, 0), capacity)
+        # Every mandatory course of the program assigned
+        mandatory = results_df[results_df['course_type'] == 'Mandatory']
+        expected = student_data.merge(course_data[course_data['mandatory'] == 1], on='program_id')
+        self.assertEqual(len(mandatory), len(expected))
+
+    def test_flow_engine_matches_ilp_optimum(self):
+        """The min-cost flow engine reaches the same total utility as the ILP"""
+        for seed in range(5):
+            instance = make_course_instance(seed)
+            ilp_df = solve_course_matching(*instance, engine='ilp')
+            flow_df = solve_course_matching(*instance, engine='flow')
+            self.assertIsNotNone(ilp_df)
+            self.assertIsNotNone(flow_df)
+            self.assertListEqual(list(flow_df.columns), list(ilp_df.columns))
+            self.check_feasible(flow_df, instance)
+            self.assertEqual(total_utility(flow_df, instance[3]), total_utility(ilp_df, instance[3]))
+
+    def test_milp_engine_matches_ilp_optimum(self):
+        """HiGHS on the sparse matrix model reaches the same total utility as CBC"""
+        for seed in range(3):
+            instance = make_course_instance(seed)
+            ilp_df = solve_course_matching(*instance, engine='ilp')
+            milp_df = solve_course_matching(*instance, engine='milp',
+                                            solver_config=SolverConfig(time_limit=30, mip_rel_gap=0, msg=0))
+            self.assertListEqual(list(milp_df.columns), list(ilp_df.columns))
+            self.check_feasible(milp_df, instance)
+            self.assertEqual(total_utility(milp_df, instance[3]), total_utility(ilp_df, instance[3]))
+        course_data, student_data, elective_capacity_data, elective_preference_data = make_course_instance(0)
+        elective_capacity_data['capacity'] = 1
+        self.assertIsNone(solve_course_matching(course_data, student_data, elective_capacity_data,
+                                                elective_preference_data, engine='milp'))
+
+    def test_aggregated_engine_matches_ilp_optimum(self):
+        """Solving over student types reaches the same total utility as the per-student model"""
+        for seed in range(3):
+            course_data, student_data, elective_capacity_data, elective_preference_data = make_course_instance(seed)
+            # Clone every student so that the types have several members
+            clones = student_data.assign(student_id=student_data['student_id'] + 500)
+            student_data = pd.concat([student_data, clones], ignore_index=True)
+            elective_preference_data = pd.concat([elective_preference_data, elective_preference_data.assign(
+                student_id=elective_preference_data['student_id'] + 500)], ignore_index=True)
+            elective_capacity_data['capacity'] *= 2
+            instance = (course_data, student_data, elective_capacity_data, elective_preference_data)
+            ilp_df = solve_course_matching(*instance, engine='ilp')
+            aggregated_df = solve_course_matching(*instance, engine='aggregated')
+            self.check_feasible(aggregated_df, instance)
+            self.assertEqual(total_utility(aggregated_df, instance[3]), total_utility(ilp_df, instance[3]))
+            seeded = [solve_course_matching(*instance, engine='aggregated', solver_config=SolverConfig(msg=0, seed=7))
+                      for _ in range(2)]
+            self.check_feasible(seeded[0], instance)
+            pd.testing.assert_frame_equal(seeded[0], seeded[1])
+
+    def test_flow_engine_reports_infeasible(self):
+        """Not enough elective seats means no matching"""
+        course_data, student_data, elective_capacity_data, elective_preference_data = make_course_instance(0)
+        elective_capacity_data['capacity'] = 1
+        self.assertIsNone(solve_course_matching(course_data, student_data, elective_capacity_data,
+                                                elective_preference_data, engine='flow'))
+
+    def test_program_blocks(self):
+        """Each program is its own block unless a course is shared"""
+        course_data, student_data, _, _ = make_course_instance(0, n_programs=3)
+        self.assertEqual(sorted(map(sorted, find_program_blocks(course_data, student_data))), [[1], [2], [3]])
+        shared = pd.concat([course_data, course_data[course_data['program_id'] == 1].assign(program_id=2)])
+        self.assertEqual(sorted(map(sorted, find_program_blocks(shared, student_data))), [[1, 2], [3]])
+
+    def test_parallel_blocks_match_single_model(self):
+        """Solving program blocks in a process pool gives the same optimum"""
+        instance = make_course_instance(3, n_programs=3)
+        single_df = solve_course_matching(*instance, engine='flow')
+        parallel_df = solve_course_matching_by_program(*instance, engine='flow', max_workers=2)
+        self.check_feasible(parallel_df, instance)
+        self.assertListEqual(parallel_df['student_id'].unique().tolist(), single_df['student_id'].unique().tolist())
+        self.assertEqual(total_utility(parallel_df, instance[3]), total_utility(single_df, instance[3]))
+
+    def test_gale_shapley_matches_legacy_loop(self):
+        """The heap-based deferred acceptance returns the same matching as the original loop"""
+        for seed in range(20):
+            rng = np.random.default_rng(seed)
+            students = list(range(60))
+            courses = list(range(8))
+            required = {s: int(rng.integers(0, 4)) for s in students}
+            preferences = {s: [int(c) for c in rng.permutation(courses)[:int(rng.integers(0, 8))]] for s in students}
+            # Few distinct priorities so that ties are common
+            priority = {(c, s): int(rng.integers(1, 4)) for s in students for c in courses}
+            capacities = {c: int(rng.integers(0, 12)) for c in courses}
+            expected = legacy_gale_shapley_electives(students, required, preferences, priority, capacities)
+            result = gale_shapley_electives(students, required, preferences, priority, capacities)
+            for s in students:
+                self.assertListEqual(sorted(result.get(s, [])), sorted(expected.get(s, [])))
+
+    def test_warm_start_keeps_optimum(self):
+        """Seeding CBC with the Gale-Shapley matching does not change the optimum"""
+        instance = make_course_instance(2)
+        cold_df = solve_course_matching(*instance, engine='ilp')
+        warm_df = solve_course_matching(*instance, engine='ilp', solver_config=SolverConfig(msg=0, warm_start=True))
+        self.check_feasible(warm_df, instance)
+        self.assertEqual(total_utility(warm_df, instance[3]), total_utility(cold_df, instance[3]))
+
+    def test_augment_completes_assignment(self):
+        """Augmenting paths fill the missing electives without breaking capacities"""
+        for seed in range(5):
+            matching = MatchingInstance.from_course_data(*make_course_instance(seed))
+            values = augment_course_assignment(matching, matching.elig_mandatory)
+            self.assertEqual(validate_course_solution(matching, values),
+                             {'missing_mandatory': 0, 'wrong_elective_count': 0, 'over_capacity': 0})
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            solve_course_matching(*make_course_instance(0), engine='simplex')
+
+
+def make_lab_instance(seed, n_students=40, n_courses=4, n_labs=3):
+    """Build a random lab matching instance with the columns of the backend CSVs"""
+    rng = np.random.default_rng(seed)
+    course_data = pd.DataFrame({
+        'course_id': range(1, n_courses + 1),
+        'course_name': [f"Course {c}" for c in range(1, n_courses + 1)],
+        'mandatory': 1, 'program_id': 1, 'has_lab': 1,
+    })
+    sections = []
+    for course_id in range(1, n_courses + 1):
+        for lab in range(1, n_labs + 1):
+            start = int(rng.integers(8, 18))
+            sections.append([course_id, f"Course {course_id}", 1, lab, lab,
+                             f"{start:02d}:00:00", f"{start + 2:02d}:00:00", int(rng.integers(5, 20))])
+    lab_time_data = pd.DataFrame(sections, columns=['course_id', 'course_name', 'allowed_for_program_id', 'lab',
+                                                    'id_day', 'start_time', 'end_time', 'capacity'])
+    theory_time_data = pd.DataFrame({
+        'course_id': range(1, n_courses + 1),
+        'course_name': [f"Course {c}" for c in range(1, n_courses + 1)],
+        'id_day': 5, 'start_time': '08:00:00', 'end_time': '10:00:00',
+    })
+    matching = []
+    preferences = []
+    for i in range(n_students):
+        student_id = 2000 + i
+        for course_id in rng.choice(range(1, n_courses + 1), size=2, replace=False):
+            matching.append([student_id, f"Student {student_id}", 'Mandatory', int(course_id), f"Course {course_id}"])
+            for rank, lab in enumerate(rng.permutation(range(1, n_labs + 1))[:2], start=1):
+                preferences.append([student_id, 1, int(course_id), int(lab), rank])
+    student_course_matching = pd.DataFrame(matching, columns=['student_id', 'student_name', 'course_type',
+                                                              'course_id', 'course_name'])
+    pre_lab_ele_man_data = pd.DataFrame(preferences, columns=['student_id', 'program_id', 'course_id', 'lab',
+                                                              'preference_rank'])
+    day_mapping = {1: 'Monday', 2: 'Tuesday', 3: 'Wednesday', 4: 'Thursday', 5: 'Friday'}
+    return (student_course_matching, lab_time_data, day_mapping,
+            pre_lab_ele_man_data, theory_time_data, course_data)
+
+
+class TestLabEngines(unittest.TestCase):
+
+    def check_lab_assignment(self, results_df, instance):
+        lab_time_data = instance[1]
+        day_id = {day: day_id for day_id, day in instance[2].items()}
+        assigned = results_df[results_df['lab_day'] != 'N/A']
+        merged = assigned.assign(id_day=assigned['lab_day'].map(day_id)).merge(
+            lab_time_data, left_on=['course_id', 'id_day', 'lab_start_time', 'lab_end_time'],
+            right_on=['course_id', 'id_day', 'start_time', 'end_time'])
+        # Capacities respected
+        load = merged.groupby(['course_id', 'lab']).size()
+        capacity = lab_time_data.set_index(['course_id', 'lab'])['capacity']
+        for key, count in load.items():
+            self.assertLessEqual(count, capacity[key])
+        # No student holds two overlapping labs
+        for _, labs in assigned.groupby('student_id'):
+            rows = list(labs.itertuples(index=False))
+            for i in range(len(rows)):
+                for j in range(i + 1, len(rows)):
+                    self.assertFalse(check_time_conflict(rows[i].lab_day, rows[i].lab_start_time, rows[i].lab_end_time,
+                                                         rows[j].lab_day, rows[j].lab_start_time, rows[j].lab_end_time))
+
+    def test_gale_shapley_lab_engine_is_feasible(self):
+        for seed in range(5):
+            instance = make_lab_instance(seed)
+            results_df = solve_lab_matching(*instance, engine='gale_shapley')
+            self.assertEqual(len(results_df), len(instance[0]))
+            self.check_lab_assignment(results_df, instance)
+
+    def test_ilp_lab_engine_is_feasible(self):
+        instance = make_lab_instance(0)
+        results_df = solve_lab_matching(*instance, engine='ilp')
+        self.assertIsNotNone(results_df)
+        self.assertFalse((results_df['lab_day'] == 'N/A').any())
+        self.check_lab_assignment(results_df, instance)
+        self.assertListEqual(list(results_df.columns), [
+            'student_id', 'student_name', 'course_id', 'course_name', 'course_type', 'theory_day',
+            'theory_start_time', 'theory_end_time', 'lab_day', 'lab_start_time', 'lab_end_time'])
+
+    def test_augment_lab_assignment(self):
+        """Augmenting an empty assignment gives a lab to courses without breaking capacities or clashing"""
+        for seed in range(3):
+            instance = make_lab_instance(seed)
+            matching = MatchingInstance.from_lab_data(*instance[:2], *instance[3:])
+            values = augment_lab_assignment(matching, np.zeros(len(matching.cand_section)))
+            chosen = values > 0.5
+            self.assertTrue(np.all(np.bincount(matching.cand_enrollment[chosen]) <= 1))
+            load = np.bincount(matching.cand_section[chosen], minlength=len(matching.section_capacity))
+            self.assertTrue(np.all(load <= matching.section_capacity))
+            for student in range(matching.num_students):
+                sections = matching.cand_section[chosen & (matching.cand_student == student)]
+                for i in range(len(sections)):
+                    for j in range(i + 1, len(sections)):
+                        a, b = sections[i], sections[j]
+                        self.assertFalse(matching.section_start[a] < matching.section_end[b]
+                                         and matching.section_start[b] < matching.section_end[a])
+            self.assertGreater(chosen.sum(), 0)
+
+    def test_augment_repacks_two_clashing_labs(self):
+        """The only section of course 1 clashes with both labs the student holds; they move together"""
+        student_course_matching = pd.DataFrame(
+            [[1, 'Ann', 'Mandatory', course_id, f"Course {course_id}"] for course_id in (1, 2, 3)],
+            columns=['student_id', 'student_name', 'course_type', 'course_id', 'course_name'])
+        lab_time_data = pd.DataFrame(
+            [[1, 'Course 1', 1, 1, 1, '10:00:00', '13:00:00', 1],
+             [2, 'Course 2', 1, 1, 1, '10:00:00', '11:00:00', 1],
+             [2, 'Course 2', 1, 2, 2, '10:00:00', '11:00:00', 1],
+             [3, 'Course 3', 1, 1, 1, '12:00:00', '13:00:00', 1],
+             [3, 'Course 3', 1, 2, 3, '12:00:00', '13:00:00', 1]],
+            columns=['course_id', 'course_name', 'allowed_for_program_id', 'lab', 'id_day', 'start_time',
+                     'end_time', 'capacity'])
+        pre_lab_ele_man_data = pd.DataFrame([[1, 1, 2, 1, 1], [1, 1, 3, 1, 1]],
+                                            columns=['student_id', 'program_id', 'course_id', 'lab',
+                                                     'preference_rank'])
+        theory_time_data = pd.DataFrame({'course_id': [1, 2, 3], 'course_name': '', 'id_day': 5,
+                                         'start_time': '08:00:00', 'end_time': '09:00:00'})
+        course_data = pd.DataFrame({'course_id': [1, 2, 3], 'course_name': ['Course 1', 'Course 2', 'Course 3'],
+                                    'mandatory': 1, 'program_id': 1, 'has_lab': 1})
+        matching = MatchingInstance.from_lab_data(student_course_matching, lab_time_data, pre_lab_ele_man_data,
+                                                  theory_time_data, course_data)
+        # Lab 1 of courses 2 and 3, both on Monday
+        values = np.isin(matching.section_lab_id[matching.cand_section], ['2-1', '3-1']).astype(float)
+        self.assertEqual(values.sum(), 2)
+        chosen = augment_lab_assignment(matching, values) > 0.5
+        self.assertListEqual(sorted(matching.section_lab_id[matching.cand_section[chosen]].tolist()),
+                             ['1-1', '2-2', '3-2'])
+
+    def test_milp_lab_engine_matches_ilp(self):
+        instance = make_lab_instance(1)
+        for conflict_formulation in ('pairwise', 'clique'):
+            ilp_df = solve_lab_matching(*instance, engine='ilp', conflict_formulation=conflict_formulation)
+            milp_df = solve_lab_matching(*instance, engine='milp', conflict_formulation=conflict_formulation)
+            self.assertListEqual(list(milp_df.columns), list(ilp_df.columns))
+            self.assertFalse((milp_df['lab_day'] == 'N/A').any())
+            self.check_lab_assignment(milp_df, instance)
+
+
+class TestMatchingInstance(unittest.TestCase):
+
+    def test_course_stage_arrays(self):
+        """The eligibility CSR lists every mandatory course and the ranked program electives"""
+        course_data, student_data, elective_capacity_data, elective_preference_data = make_course_instance(1)
+        # A repeated preference keeps its best rank
+        elective_preference_data = pd.concat([elective_preference_data, elective_preference_data.iloc[[0]].assign(preference_rank=9)])
+        instance = MatchingInstance.from_course_data(course_data, student_data, elective_capacity_data, elective_preference_data)
+        self.assertEqual(instance.elig_indptr[-1], len(instance.elig_course))
+        self.assertEqual(len(instance.pair_student), len(instance.elig_course))
+        for i, student_id in enumerate(student_data['student_id']):
+            rows = slice(instance.elig_indptr[i], instance.elig_indptr[i + 1])
+            courses = set(instance.course_ids[instance.elig_course[rows]])
+            prefs = elective_preference_data[elective_preference_data['student_id'] == student_id]
+            program = course_data[course_data['program_id'] == student_data['program_id'].iloc[i]]
+            expected = set(program.loc[program['mandatory'] == 1, 'course_id']) | set(prefs['course_id'])
+            self.assertSetEqual(courses, expected)
+            best = prefs.groupby('course_id')['preference_rank'].min()
+            for course, rank in zip(instance.elig_course[rows], instance.elig_rank[rows]):
+                self.assertEqual(rank, best.get(instance.course_ids[course], 0))
+        utility = instance.pair_utility
+        ranked = instance.elig_rank > 0
+        self.assertListEqual(utility[ranked].tolist(), [calculate_utility(r) for r in instance.elig_rank[ranked]])
+        self.assertFalse(utility[~ranked].any())
+
+    def test_validate_course_solution(self):
+        instance = MatchingInstance.from_course_data(*make_course_instance(2))
+        mandatory_only = validate_course_solution(instance, instance.elig_mandatory.astype(float))
+        self.assertDictEqual(mandatory_only, {'missing_mandatory': 0, 'wrong_elective_count': instance.num_students,
+                                              'over_capacity': 0})
+        violations = validate_course_solution(instance, np.zeros(len(instance.elig_course)))
+        self.assertEqual(violations['missing_mandatory'], int(instance.elig_mandatory.sum()))
+        self.assertEqual(violations['wrong_elective_count'], instance.num_students)
+
+    def test_shared_course_is_one_column(self):
+        """A course listed under two programs is coded once and eligible for both"""
+        course_data, student_data, elective_capacity_data, elective_preference_data = make_course_instance(0)
+        shared = pd.concat([course_data, course_data[course_data['course_id'] == 1].assign(program_id=2)])
+        instance = MatchingInstance.from_course_data(shared, student_data, elective_capacity_data, elective_preference_data)
+        self.assertEqual(instance.num_courses, len(course_data))
+        self.assertIn(0, instance.program_mandatory[2])
+        results_df = solve_course_matching(shared, student_data, elective_capacity_data, elective_preference_data)
+        self.assertEqual(len(results_df[results_df['course_id'] == 1]), len(student_data))
+
+    def test_elective_types(self):
+        course_data, student_data, elective_capacity_data, elective_preference_data = make_course_instance(0)
+        clones = student_data.assign(student_id=student_data['student_id'] + 500)
+        prefs = elective_preference_data.assign(student_id=elective_preference_data['student_id'] + 500)
+        instance = MatchingInstance.from_course_data(course_data, pd.concat([student_data, clones]),
+                                                     elective_capacity_data, pd.concat([elective_preference_data, prefs]))
+        student_type, first = instance.elective_types()
+        n = len(student_data)
+        np.testing.assert_array_equal(student_type[:n], student_type[n:])
+        self.assertTrue(np.all(first < n))
+        np.testing.assert_array_equal(student_type[first], np.arange(len(first)))
+
+    def test_lab_stage_arrays(self):
+        student_course_matching, lab_time_data, _, pre_lab_ele_man_data, theory_time_data, course_data = make_lab_instance(0)
+        instance = MatchingInstance.from_lab_data(student_course_matching, lab_time_data, pre_lab_ele_man_data,
+                                                  theory_time_data, course_data)
+        self.assertEqual(len(instance.cand_indptr), len(student_course_matching) + 1)
+        # Every enrollment may take any section of its course
+        self.assertTrue((np.diff(instance.cand_indptr) == 3).all())
+        self.assertTrue((instance.section_course[instance.cand_section] == instance.enroll_course[instance.cand_enrollment]).all())
+        self.assertEqual(int((instance.cand_rank > 0).sum()), len(pre_lab_ele_man_data))
+        self.assertEqual(instance.section_start[0], (lab_time_data['id_day'].iloc[0] - 1) * 24 * 60
+                         + int(lab_time_data['start_time'].iloc[0][:2]) * 60)
+
+
+class TestSolverConfig(unittest.TestCase):
+
+    def test_from_env(self):
+        environ = {'MATCHING_SOLVER_THREADS': '4', 'MATCHING_SOLVER_TIME_LIMIT': '2.5',
+                   'MATCHING_SOLVER_MIP_REL_GAP': '0.01', 'MATCHING_SOLVER_MSG': '0'}
+        config = SolverConfig.from_env(environ)
+        self.assertEqual((config.threads, config.time_limit, config.mip_rel_gap, config.msg), (4, 2.5, 0.01, 0))
+        self.assertEqual(SolverConfig.from_env(environ, threads=2).threads, 2)
+        self.assertIsNone(SolverConfig.from_env({}).time_limit)
+        with self.assertRaises(ValueError):
+            SolverConfig.from_env({'MATCHING_SOLVER_TIME_LIMIT': 'soon'})
+        with self.assertRaises(ValueError):
+            SolverConfig(threads=0)
+
+    def test_capped(self):
+        self.assertEqual(SolverConfig().capped(30).time_limit, 30)
+        self.assertEqual(SolverConfig(time_limit=10).capped(30).time_limit, 10)
+        self.assertEqual(SolverConfig(time_limit=100, threads=2).capped(30).threads, 2)
+
+    def test_solver_report(self):
+        """Every engine reports how it stopped"""
+        instance = make_course_instance(0)
+        config = SolverConfig(threads=2, time_limit=30, mip_rel_gap=0, msg=0)
+        for engine, status in (('ilp', 'optimal'), ('milp', 'optimal'), ('flow', 'optimal'), ('gale_shapley', 'heuristic')):
+            report = solve_course_matching(*instance, engine=engine, solver_config=config).attrs['solver_report']
+            self.assertEqual(report['status'], status)
+            self.assertEqual(report['engine'], engine)
+            self.assertGreater(report['objective'], 0)
+        self.assertEqual(report['gap'], None)
+        lab_report = solve_lab_matching(*make_lab_instance(0), engine='milp', solver_config=config).attrs['solver_report']
+        self.assertEqual(lab_report['status'], 'optimal')
+        self.assertEqual(lab_report['gap'], 0)
+
+    def test_cbc_log_printed_with_msg(self):
+        """msg prints CBC's log without PuLP's logPath warning; msg=0 keeps the solve quiet"""
+        instance = make_course_instance(0)
+        for msg in (1, 0):
+            output = io.StringIO()
+            with warnings.catch_warnings(record=True) as caught, contextlib.redirect_stdout(output):
+                warnings.simplefilter('always')
+                solve_course_matching(*instance, engine='ilp', solver_config=SolverConfig(msg=msg))
+            self.assertFalse([w for w in caught if 'logPath' in str(w.message)])
+            self.assertEqual("Result - " in output.getvalue(), bool(msg))
+
+
+class TestPresolve(unittest.TestCase):
+
+    def test_uncontested_rows_are_fixed(self):
+        """A forced pick, an uncontested capacity and a decoupled choice leave nothing to solve"""
+        rows = [('Mandatory', [0], '=', 1),
+                ('Pick', [1, 2, 3], '=', 2),
+                ('Capacity', [1, 4], '<', 5),
+                ('Other', [4, 5], '=', 1)]
+        fixed, remaining, stats = presolve(6, rows, [0, 3, 9, 5, 1, 2])
+        self.assertListEqual(fixed.tolist(), [1, 0, 1, 1, 0, 1])
+        self.assertListEqual(remaining, [])
+        self.assertEqual(stats, {'variables': 6, 'rows': 4, 'fixed_variables': 6, 'dropped_rows': 4})
+
+    def test_contested_rows_remain(self):
+        rows = [('A', [0, 1], '=', 1), ('B', [2, 3], '=', 1), ('Capacity', [0, 2], '<', 1), ('Blocked', [3], '=', 0)]
+        fixed, remaining, _ = presolve(4, rows, [5, 1, 5, 1])
+        # Blocking 3 forces 2, which fills the capacity and forces 1
+        self.assertListEqual(fixed.tolist(), [0, 1, 1, 0])
+        rows = [('A', [0, 1], '=', 1), ('B', [2, 3], '=', 1), ('Capacity', [0, 2], '<', 1)]
+        fixed, remaining, stats = presolve(4, rows, [5, 1, 5, 1])
+        self.assertListEqual(fixed.tolist(), [-1, -1, -1, -1])
+        self.assertEqual(len(remaining), 3)
+
+    def test_infeasible(self):
+        fixed, remaining, _ = presolve(2, [('A', [0, 1], '=', 2), ('Capacity', [1], '<', 0)], [1, 1])
+        self.assertIsNone(fixed)
+
+    def test_engines_report_presolve(self):
+        instance = make_course_instance(0)
+        results_df = solve_course_matching(*instance, engine='ilp')
+        stats = results_df.attrs['solver_report']['presolve']
+        # Every mandatory pair is fixed and its row removed
+        n_mandatory = (results_df['course_type'] == 'Mandatory').sum()
+        self.assertGreaterEqual(stats['fixed_variables'], n_mandatory)
+        self.assertGreaterEqual(stats['dropped_rows'], n_mandatory)
+
+
+def make_solved_matching(seed, n_labs=3):
+    """Solve both stages of a random instance; returns the arguments of IncrementalMatching.from_results"""
+    course_data, student_data, elective_capacity_data, elective_preference_data = make_course_instance(seed)
+    course_results = solve_course_matching(course_data, student_data, elective_capacity_data,
+                                           elective_preference_data, engine='flow')
+    rng = np.random.default_rng(seed)
+    enrolled = course_results['course_id'].value_counts()
+    sections = []
+    for course_id in course_data.loc[course_data['has_lab'] == 1, 'course_id'].unique():
+        for lab in range(1, n_labs + 1):
+            start = int(rng.integers(8, 18))
+            sections.append([course_id, f"Course {course_id}", 1, lab, int(rng.integers(1, 4)),
+                             f"{start:02d}:00:00", f"{start + 2:02d}:00:00", int(enrolled.get(course_id, 0)) // 2 + 2])
+    lab_time_data = pd.DataFrame(sections, columns=['course_id', 'course_name', 'allowed_for_program_id', 'lab',
+                                                    'id_day', 'start_time', 'end_time', 'capacity'])
+    theory_time_data = pd.DataFrame({'course_id': course_data['course_id'].unique(), 'course_name': '',
+                                     'id_day': 5, 'start_time': '08:00:00', 'end_time': '10:00:00'})
+    pre_lab_ele_man_data = pd.DataFrame(
+        [[student_id, 1, course_id, lab, rank] for student_id, course_id in zip(course_results['student_id'],
+                                                                                 course_results['course_id'])
+         for rank, lab in enumerate(rng.permutation(n_labs)[:2] + 1, start=1)],
+        columns=['student_id', 'program_id', 'course_id', 'lab', 'preference_rank'])
+    day_mapping = {1: 'Monday', 2: 'Tuesday', 3: 'Wednesday', 4: 'Thursday', 5: 'Friday'}
+    lab_results = solve_lab_matching(course_results, lab_time_data, day_mapping, pre_lab_ele_man_data,
+                                     theory_time_data, course_data)
+    return (course_data, student_data, elective_capacity_data, elective_preference_data, course_results,
+            lab_time_data, day_mapping, pre_lab_ele_man_data, theory_time_data, lab_results)
+
+
+class TestIncrementalMatching(unittest.TestCase):
+
+    def check_state(self, state):
+        """Every constraint of both stages holds, and the move index matches a rebuild"""
+        for course_id, capacity in state.capacity.items():
+            self.assertLessEqual(state.load[course_id], capacity)
+        for lab_id, holders in state.lab_holders.items():
+            self.assertLessEqual(len(holders), state.section_capacity[lab_id])
+        # Every course with labs has one, clashing with no lecture and no other lab of the student
+        for student_id in state.student_names:
+            courses = state.mandatory[student_id] + list(state.held[student_id])
+            busy = 0
+            for course_id in courses:
+                busy |= state.theory_mask[course_id]
+            for course_id in courses:
+                if course_id in state.has_lab and state.sections.get(course_id):
+                    mask = state.section_mask[state.lab_of[student_id, course_id]]
+                    self.assertFalse(busy & mask)
+                    busy |= mask
+
+        def index(matching):
+            return {(c, d, change): holders for c, targets in matching.movable.items()
+                    for d, by_change in targets.items() for change, holders in by_change.items() if holders}
+        rebuilt = IncrementalMatching(state.course_data, state.elective_capacity_data, state.lab_time_data,
+                                      state.day_mapping, state.theory_time_data)
+        rebuilt.electives = state.electives
+        for student_id in state.student_names:
+            for course_id in state.held[student_id]:
+                rebuilt._assign_elective(student_id, course_id)
+        self.assertEqual(index(rebuilt), index(state))
+
+    def test_results_round_trip(self):
+        """The state of a solved matching writes back the solver's tables"""
+        inputs = make_solved_matching(0)
+        state = IncrementalMatching.from_results(*inputs)
+        pd.testing.assert_frame_equal(state.course_results().reset_index(drop=True),
+                                      inputs[4][['student_id', 'student_name', 'course_type', 'course_id',
+                                                 'course_name']].reset_index(drop=True), check_dtype=False)
+        pd.testing.assert_frame_equal(state.lab_results().astype(str), inputs[9].astype(str))
+        self.check_state(state)
+
+    def test_add_students(self):
+        for seed in range(3):
+            inputs = make_solved_matching(seed)
+            state = IncrementalMatching.from_results(*inputs)
+            rng = np.random.default_rng(seed)
+            placed = 0
+            for i in range(10):
+                program_id = int(rng.integers(1, 3))
+                electives = inputs[0][(inputs[0]['program_id'] == program_id) & (inputs[0]['mandatory'] == 0)]
+                preferences = [(int(course_id), rank) for rank, course_id in
+                               enumerate(rng.permutation(electives['course_id'].to_numpy()), start=1)]
+                result = state.add_student(5000 + i, f"New {i}", program_id, 2, preferences)
+                if result is None:
+                    self.assertNotIn(5000 + i, state.student_names)
+                    self.check_state(state)
+                    continue
+                placed += 1
+                course_rows, lab_rows = result
+                self.assertEqual((course_rows['course_type'] == 'Elective').sum(), 2)
+                self.assertListEqual(lab_rows['course_id'].tolist(), course_rows['course_id'].tolist())
+                self.check_state(state)
+            self.assertGreater(placed, 0)
+            with self.assertRaises(ValueError):
+                state.add_student(int(inputs[1]['student_id'].iloc[0]), 'Again', 1, 2)
+
+    def test_failed_insert_rolls_back(self):
+        """With every elective full and no short path, the state is left as it was"""
+        state = IncrementalMatching.from_results(*make_solved_matching(1))
+        state.capacity = {course_id: state.load[course_id] for course_id in state.capacity}
+        course_results, lab_results = state.course_results(), state.lab_results()
+        self.assertIsNone(state.add_student(6000, 'Late', 1, 2))
+        self.assertNotIn(6000, state.student_names)
+        pd.testing.assert_frame_equal(state.course_results(), course_results)
+        pd.testing.assert_frame_equal(state.lab_results(), lab_results)
+        self.check_state(state)
+
+    def test_drop_course(self):
+        """A freed elective seat goes along improving chains; every mover gains"""
+        for seed in range(3):
+            state = IncrementalMatching.from_results(*make_solved_matching(seed))
+            moved = 0
+            for student_id in list(state.student_names)[:20]:
+                course_id = min(state.held[student_id])
+                utility = {mover: sum(state.electives[mover][c] for c in state.held[mover])
+                           for mover in state.student_names}
+                course_moves, _ = state.drop_course(student_id, course_id)
+                self.assertNotIn(course_id, state.held[student_id])
+                self.assertNotIn((student_id, course_id), state.lab_of)
+                for mover in {mover for mover, _, _ in course_moves}:
+                    self.assertGreater(sum(state.electives[mover][c] for c in state.held[mover]), utility[mover])
+                moved += len(course_moves)
+                self.check_state(state)
+            self.assertGreater(moved, 0)
+        with self.assertRaises(ValueError):
+            state.drop_course(student_id, course_id)
+
+    def test_drop_lab(self):
+        """A student waiting for a full lab moves into the seat another student frees"""
+        state = IncrementalMatching.from_results(*make_solved_matching(0))
+        # Move a student out of their first choice into a worse section that fits, then fill both
+        for key, lab_id in list(state.lab_of.items()):
+            worse = [other for other in state.sections[key[1]]
+                     if state._lab_value(key, other) < state._lab_value(key, lab_id)
+                     and state._displaced_by(key, other) == []]
+            if worse and len(state.lab_holders[lab_id]) > 1:
+                break
+        state._release_lab(key)
+        state._assign_lab(key, worse[0])
+        state.section_capacity = {other: len(holders) for other, holders in state.lab_holders.items()}
+        dropping = next(other for other in state.lab_holders[lab_id] if other[0] != key[0])
+        lab_moves = state.drop_lab(*dropping)
+        self.assertIn((key, worse[0], lab_id), lab_moves)
+        self.assertEqual(state.lab_of[key], lab_id)
+        self.assertIn(key[0], state.moved)
+        self.assertNotIn(dropping, state.lab_of)
+
+
+class TestConflictIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.lab_time_data = pd.DataFrame([
+            [1, 1, 3, '10:00:00', '12:00:00'],
+            [1, 2, 3, '11:30:00', '13:00:00'],
+            [2, 1, 3, '11:00:00', '12:30:00'],
+            [2, 2, 3, '12:00:00', '14:00:00'],
+            [3, 1, 4, '10:00:00', '12:00:00'],
+        ], columns=['course_id', 'lab', 'id_day', 'start_time', 'end_time'])
+        self.theory_time_data = pd.DataFrame([
+            [3, 3, '13:00:00', '15:00:00'],
+            [4, 4, '08:00:00', '10:00:00'],
+        ], columns=['course_id', 'id_day', 'start_time', 'end_time'])
+
+    def test_check_time_conflict_parses_clock_times(self):
+        self.assertTrue(check_time_conflict(3, "10:00:00", "12:00:00", 3, "11:00:00", "13:00:00"))
+        self.assertFalse(check_time_conflict(3, "10:00:00", "12:00:00", 3, "12:00:00", "14:00:00"))
+        self.assertFalse(check_time_conflict(3, "10:00:00", "12:00:00", 4, "10:00:00", "12:00:00"))
+        self.assertFalse(check_time_conflict(3, "10:00:00", "12:00:00", 3, "abc", "def"))
+
+    def test_sweep_matches_pairwise_check(self):
+        """The sweep line finds exactly the pairs the pairwise check finds"""
+        index = build_conflict_index(self.lab_time_data, self.theory_time_data)
+        labs = list(self.lab_time_data.itertuples(index=False))
+        for lab in labs:
+            lab_id = f"{lab.course_id}-{lab.lab}"
+            expected = {
+                f"{other.course_id}-{other.lab}" for other in labs
+                if other is not lab and check_time_conflict(lab.id_day, lab.start_time, lab.end_time,
+                                                            other.id_day, other.start_time, other.end_time)
+            }
+            self.assertSetEqual(index['lab_conflicts'][lab_id], expected)
+        self.assertSetEqual(index['theory_conflicts']['2-2'], {3})
+        self.assertSetEqual(index['theory_conflicts']['1-1'], set())
+        self.assertEqual(index['lab_slots']['3-1'], (3 * 24 * 60 + 600, 3 * 24 * 60 + 720))
+
+
+    def test_cliques_cover_every_conflicting_pair(self):
+        """Clique rows forbid exactly the pairs the pairwise rows forbid"""
+        index = build_conflict_index(self.lab_time_data, self.theory_time_data)
+        student_labs = ['1-1', '1-2', '2-1', '2-2', '3-1']
+        cliques = student_conflict_cliques(student_labs, index['lab_cliques'])
+        covered = {frozenset((a, b)) for clique in cliques for a in clique for b in clique if a != b}
+        pairs = {frozenset((lab_id, other)) for lab_id in student_labs for other in index['lab_conflicts'][lab_id]}
+        self.assertSetEqual(covered, pairs)
+        self.assertLess(len(cliques), len(pairs))
+
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.release = threading.Event()
+        self.phases = []
+        self.saved = []
+
+    def tearDown(self):
+        self.release.set()
+        self.directory.cleanup()
+
+    def run_job(self, solver_config, time_limit, progress):
+        """Stand-in for both stages, blocked until release is set"""
+        for phase in ('load', 'build', 'solve'):
+            progress('course', phase)
+        self.phases.append(self.queue.status(self.job_id)['phase'])
+        self.release.wait(10)
+        if time_limit < 0:
+            raise RuntimeError("no feasible course matching was found")
+        return {'reports': {'course': {'status': 'optimal', 'objective': np.float64(3)}, 'lab': {}},
+                'course_table': pd.DataFrame({'student_id': [1, 2], 'course_id': [1, 1]}),
+                'lab_table': pd.DataFrame({'student_id': [1, 2], 'lab_start_time': ['08:00:00', '10:00:00']})}
+
+    def wait(self, job_id):
+        for _ in range(1000):
+            status = self.queue.status(job_id)
+            if status['status'] in ('done', 'failed'):
+                return status
+            time.sleep(0.01)
+        self.fail("job did not finish")
+
+    def test_identical_submissions_coalesce(self):
+        self.queue = JobQueue(os.path.join(self.directory.name, 'jobs.db'), run=self.run_job, save=self.saved.append)
+        self.job_id = self.queue.submit(SolverConfig(), 60, key='inputs')
+        self.assertEqual(self.queue.submit(SolverConfig(), 60, key='inputs'), self.job_id)
+        self.assertIsNone(self.queue.result(self.job_id))
+        self.release.set()
+        status = self.wait(self.job_id)
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(self.phases, ['solve'])
+        result = self.queue.result(self.job_id)
+        self.assertEqual(result['reports']['course']['objective'], 3)
+        pd.testing.assert_frame_equal(result['table'], pd.DataFrame({'student_id': [1, 2],
+                                                                     'lab_start_time': ['08:00:00', '10:00:00']}))
+        # A finished job is not reused
+        self.job_id = self.queue.submit(SolverConfig(), 60, key='inputs')
+        self.assertNotEqual(self.job_id, status['id'])
+        self.assertEqual(self.wait(self.job_id)['status'], 'done')
+        self.assertIsNone(self.queue.status('unknown'))
+
+    def test_failed_job_and_shared_queue(self):
+        """A second queue on the same file sees the jobs of the first"""
+        path = os.path.join(self.directory.name, 'jobs.db')
+        self.queue = JobQueue(path, run=self.run_job, save=self.saved.append)
+        self.release.set()
+        self.job_id = self.queue.submit(SolverConfig(time_limit=5), -1, key='infeasible')
+        status = JobQueue(path, run=self.run_job, save=self.saved.append).status(self.job_id)
+        self.assertIn(status['status'], ('queued', 'running', 'failed'))
+        status = self.wait(self.job_id)
+        self.assertEqual((status['status'], status['stage'], status['phase']), ('failed', 'course', 'solve'))
+        self.assertEqual(status['error'], "no feasible course matching was found")
+        self.assertIsNone(self.queue.result(self.job_id))
+        self.assertListEqual(self.saved, [])
+
+    def test_cached_result_is_served_without_a_run(self):
+        path = os.path.join(self.directory.name, 'jobs.db')
+        self.queue = JobQueue(path, run=self.run_job, cache=ResultCache(path), save=self.saved.append)
+        self.release.set()
+        self.job_id = self.queue.submit(SolverConfig(), 60, key='inputs')
+        self.wait(self.job_id)
+        self.assertFalse(self.queue.result(self.job_id)['cached'])
+        self.assertEqual(len(self.saved), 1)
+        self.release.clear()
+        self.job_id = self.queue.submit(SolverConfig(), 60, key='other')
+        cached_id = self.queue.submit(SolverConfig(), 60, key='inputs')
+        # The cached tables are restored by the worker, not while another job runs
+        time.sleep(0.05)
+        self.assertEqual(self.queue.status(cached_id)['status'], 'queued')
+        self.assertEqual(len(self.saved), 1)
+        self.release.set()
+        self.wait(cached_id)
+        result = self.queue.result(cached_id)
+        self.assertTrue(result['cached'])
+        self.assertEqual(len(self.phases), 2)
+        self.assertEqual(len(self.saved), 3)
+        self.assertListEqual(self.saved[2]['course_table']['course_id'].tolist(), [1, 1])
+        self.assertListEqual(result['table']['lab_start_time'].tolist(), ['08:00:00', '10:00:00'])
+
+    def test_cache_failure_still_finishes_the_job(self):
+        path = os.path.join(self.directory.name, 'jobs.db')
+        cache = ResultCache(path)
+
+        def put(key, result):
+            raise sqlite3.OperationalError("disk I/O error")
+        cache.put = put
+        self.queue = JobQueue(path, run=self.run_job, cache=cache, save=self.saved.append)
+        self.release.set()
+        self.job_id = self.queue.submit(SolverConfig(), 60, key='inputs')
+        self.assertEqual(self.wait(self.job_id)['status'], 'done')
+        self.assertEqual(len(self.saved), 1)
+        # The queue goes on with the next job
+        self.job_id = self.queue.submit(SolverConfig(), 60, key='other')
+        self.assertEqual(self.wait(self.job_id)['status'], 'done')
+
+    def test_run_matching_passes_courses_in_memory(self):
+        """A run writes no result CSV; its lab stage solves for the course table of the same run"""
+        paths = ('student_course_matching.csv', 'student_lab_matching.csv')
+        before = [os.stat(path).st_mtime_ns for path in paths]
+        result = run_matching(SolverConfig(time_limit=30), 30, lambda stage, phase: None)
+        self.assertListEqual([os.stat(path).st_mtime_ns for path in paths], before)
+        labs = result['lab_table'].merge(result['course_table'], on=['student_id', 'course_id'])
+        self.assertEqual(len(labs), len(result['lab_table']))
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = ResultCache(os.path.join(self.directory.name, 'jobs.db'), max_entries=2)
+        tables = {'reports': {}, 'course_table': pd.DataFrame({'a': [1]}), 'lab_table': pd.DataFrame({'b': [2]})}
+        for key in ('a', 'b'):
+            cache.put(key, tables)
+            time.sleep(0.01)
+        self.assertIsNotNone(cache.get('a'))
+        time.sleep(0.01)
+        cache.put('c', tables)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        # An entry over the size bound is not kept
+        small = ResultCache(os.path.join(self.directory.name, 'small.db'), max_bytes=5)
+        small.put('a', tables)
+        self.assertIsNone(small.get('a'))
+
+    def test_fingerprint_ignores_formatting(self):
+        path = os.path.join(self.directory.name, 'student.csv')
+        config = SolverConfig()
+
+        def fingerprint(text, time_limit=60):
+            with open(path, 'w', newline='') as f:
+                f.write(text)
+            return input_fingerprint(config, time_limit, [path])
+        plain = fingerprint("student_id,name\n1,Ann\n2,Bo\n")
+        self.assertEqual(fingerprint("student_id, name \r\n1, Ann\r\n2,\"Bo\"\r\n"), plain)
+        self.assertNotEqual(fingerprint("student_id,name\n1,Ann\n2,Bo\n", time_limit=30), plain)
+        self.assertNotEqual(fingerprint("student_id,name\n1,Ann\n2,Bo\n3,Cy\n"), plain)
+
+    def test_progress_phases(self):
+        phases = []
+        solve_course_matching(*make_course_instance(0), engine='flow', progress=phases.append)
+        self.assertListEqual(phases, ['build', 'solve', 'extract'])
+
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv = os.path.join(self.directory.name, 'student.csv')
+        self.snapshots = os.path.join(self.directory.name, 'snapshot')
+        with open(self.csv, 'w') as f:
+            f.write("student_id ,name,program ,program_id,required_electives\n"
+                    "2501, Elena Murray ,MDS ,1,2\n2502,Dominik Allen,,3,2\n2503,Ann,MDS,1,2\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot_matches_csv(self):
+        expected = normalize(pd.read_csv(self.csv))
+        write_snapshot(self.csv, self.snapshots)
+        loaded = read_table(self.csv, self.snapshots)
+        pd.testing.assert_frame_equal(loaded, expected)
+        self.assertListEqual(loaded['name'].tolist(), ['Elena Murray', 'Dominik Allen', 'Ann'])
+        self.assertTrue(pd.isna(loaded['program'].iloc[1]))
+
+    def test_stale_snapshot_is_ignored(self):
+        write_snapshot(self.csv, self.snapshots)
+        with open(self.csv, 'a') as f:
+            f.write("2504,Bo,MIA,3,2\n")
+        os.utime(self.csv, (time.time() + 10, time.time() + 10))
+        self.assertEqual(len(read_table(self.csv, self.snapshots)), 4)
+
+    def test_append_during_import_is_not_hidden(self):
+        """A row appended after the import read the CSV, but before columns.json was written, is still seen"""
+        path = write_snapshot(self.csv, self.snapshots)
+        with open(self.csv, 'a') as f:
+            f.write("2504,Bo,MIA,3,2\n")
+        # The column list is newer than the CSV, as when written after the append
+        later = time.time() + 10
+        os.utime(os.path.join(path, 'columns.json'), (later, later))
+        self.assertEqual(len(read_table(self.csv, self.snapshots)), 4)
+
+    def test_preferences_read_in_chunks_keep_best_rank(self):
+        path = os.path.join(self.directory.name, 'pre_lab_ele_man.csv')
+        rng = np.random.default_rng(0)
+        rows = pd.DataFrame({'student_id ': np.sort(rng.integers(1, 40, 500)), 'program_id': 1,
+                             'course_id ': rng.integers(1, 4, 500), 'lab': rng.integers(1, 3, 500),
+                             'preference_rank ': rng.integers(1, 6, 500)})
+        rows.to_csv(path, index=False)
+        rows.columns = rows.columns.str.strip()
+        expected = (rows.sort_values('preference_rank', kind='stable')
+                    .drop_duplicates(['student_id', 'course_id', 'lab']).sort_index().reset_index(drop=True))
+        # Chunks split students (sorted file) and, shuffled, share them
+        for chunk_rows in (7, 64, 1000):
+            loaded = read_preferences(path, chunk_rows=chunk_rows, snapshot_dir=self.snapshots)
+            self.assertListEqual(list(loaded.dtypes.astype(str)), ['int32', 'int32', 'int32', 'int32', 'int8'])
+            pd.testing.assert_frame_equal(loaded, expected, check_dtype=False)
+        write_snapshot(path, self.snapshots)
+        pd.testing.assert_frame_equal(read_preferences(path, chunk_rows=64, snapshot_dir=self.snapshots),
+                                      expected, check_dtype=False)
+        rows.sample(frac=1, random_state=0).to_csv(path, index=False)
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        loaded = read_preferences(path, chunk_rows=64, snapshot_dir=self.snapshots)
+        pd.testing.assert_frame_equal(loaded.sort_values(['student_id', 'course_id', 'lab']).reset_index(drop=True),
+                                      expected.sort_values(['student_id', 'course_id', 'lab']).reset_index(drop=True),
+                                      check_dtype=False)
+
+    def test_preference_rank_out_of_range(self):
+        path = os.path.join(self.directory.name, 'elective_preference.csv')
+        with open(path, 'w') as f:
+            f.write("student_id ,program_id,course_id ,preference_rank \n2501,1,4,1\n2501,1,3,300\n")
+        # The error names the line, and the lock is released without masking it
+        with self.assertRaisesRegex(ValueError, "line 3: preference_rank 300"):
+            read_preferences(path, snapshot_dir=self.snapshots)
+
+
+
+class TestSqlDb(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.directory.name, 'student_matching.db')
+        self.csv_folder = os.path.dirname(os.path.abspath(__file__))
+        sql_db.load_csvs_to_db(self.csv_folder, self.db)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_schema_and_best_rank(self):
+        conn = sqlite3.connect(self.db)
+        try:
+            indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            ranks = conn.execute("SELECT preference_rank FROM elective_preference "
+                                 "WHERE student_id = 2505 AND course_id = 10").fetchall()
+            with self.assertRaises(sqlite3.IntegrityError):
+                conn.execute("INSERT INTO lab_time (course_id, lab) VALUES (1, 1)")
+        finally:
+            conn.close()
+        self.assertTrue({'elective_preference_course', 'pre_lab_ele_man_lab', 'student_program'} <= indexes)
+        self.assertListEqual(ranks, [(1,)])
+
+    def test_loaders_match_csv_inputs(self):
+        """Both stages solve to the same tables from the database as from the CSVs"""
+        csv = {name: normalize(pd.read_csv(os.path.join(self.csv_folder, f"{name}.csv")))
+               for name in ('course', 'student', 'elective_capacity', 'elective_preference', 'lab_time',
+                            'pre_lab_ele_man', 'theory_time')}
+        courses = solve_course_matching(*sql_db.load_data_first(self.db), engine='flow')
+        pd.testing.assert_frame_equal(courses, solve_course_matching(
+            csv['course'], csv['student'], csv['elective_capacity'], csv['elective_preference'], engine='flow'))
+        sql_db.save_course_matching(courses, self.db)
+        (student_course_matching, lab_time_data, day_mapping, pre_lab_ele_man_data, theory_time_data,
+         course_data) = sql_db.load_data_second(self.db)
+        pd.testing.assert_frame_equal(student_course_matching, courses, check_dtype=False)
+        labs = solve_lab_matching(student_course_matching, lab_time_data, day_mapping, pre_lab_ele_man_data,
+                                  theory_time_data, course_data, engine='gale_shapley')
+        pd.testing.assert_frame_equal(labs, solve_lab_matching(
+            courses, csv['lab_time'], day_mapping, csv['pre_lab_ele_man'], csv['theory_time'], csv['course'],
+            engine='gale_shapley'))
+        # A program block reads only its own students
+        _, student_data, _, elective_preference_data = sql_db.load_data_first(self.db, [1])
+        self.assertTrue((student_data['program_id'] == 1).all())
+        self.assertTrue(elective_preference_data['student_id'].isin(student_data['student_id']).all())
+
+    def test_course_of_several_programs(self):
+        folder = os.path.join(self.directory.name, 'csv')
+        os.mkdir(folder)
+        for filename in sql_db.FILES_TABLES:
+            with open(os.path.join(self.csv_folder, filename), 'rb') as f:
+                data = f.read()
+            if filename == 'course.csv':
+                # Elective 3 of program 1 also offered to program 2
+                data = data.rstrip(b'\r\n') + b'\r\n3,Deep learning,0,2,1\r\n'
+            with open(os.path.join(folder, filename), 'wb') as f:
+                f.write(data)
+        db = os.path.join(self.directory.name, 'shared.db')
+        sql_db.load_csvs_to_db(folder, db)
+        course_data, _, elective_capacity_data, _ = sql_db.load_data_first(db)
+        self.assertListEqual(sorted(course_data.loc[course_data['course_id'] == 3, 'program_id']), [1, 2])
+        self.assertEqual((elective_capacity_data['course_id'] == 3).sum(), 1)
+
+
+
+class TestStudentRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv = os.path.join(self.directory.name, 'student.csv')
+        with open(self.csv, 'w') as f:
+            f.write("student_id, name, program, program_id, required_electives\n2501,Elena Murray,MDS,1,2")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_concurrent_registrations_get_distinct_ids(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            ids = list(pool.map(lambda i: register_student(f"Student, {i}", 'MDS', 1, 2, path=self.csv), range(200)))
+            # Readers never see a partial row
+            for _ in range(20):
+                roster = read_csv_shared(self.csv)
+                self.assertFalse(roster.isna().any().any())
+        self.assertListEqual(sorted(ids), list(range(2502, 2702)))
+        roster = read_csv_shared(self.csv)
+        self.assertListEqual(roster['student_id'].tolist(), list(range(2501, 2702)))
+        self.assertEqual(roster[' name'].iloc[1].split(', ')[0], 'Student')
+
+    def test_first_student_of_an_empty_roster(self):
+        os.remove(self.csv)
+        open(self.csv, 'w').close()
+        self.assertEqual(register_student('Ann', 'MDS', 1, 2, path=self.csv), 1)
+        self.assertEqual(register_student('Bo', 'MDS', 1, 2, path=self.csv), 2)
+        self.assertListEqual(read_csv_shared(self.csv)['name'].tolist(), ['Ann', 'Bo'])
+
+    def test_mds_registrant_is_offered_program_1_electives(self):
+        """The program names map to the ids of program.csv, and an MDS student is placed in MDS courses"""
+        folder = os.path.dirname(os.path.abspath(__file__))
+        programs = program_ids(os.path.join(folder, 'program.csv'))
+        self.assertDictEqual(programs, {'MDS': 1, 'MPP': 2, 'MIA': 3})
+        csv = {name: normalize(pd.read_csv(os.path.join(folder, f"{name}.csv")))
+               for name in ('course', 'student', 'elective_capacity', 'elective_preference', 'lab_time',
+                            'pre_lab_ele_man', 'theory_time')}
+        day_mapping = {1: 'Monday', 2: 'Tuesday', 3: 'Wednesday', 4: 'Thursday', 5: 'Friday'}
+        course_results = solve_course_matching(csv['course'], csv['student'], csv['elective_capacity'],
+                                               csv['elective_preference'], engine='flow')
+        lab_results = solve_lab_matching(course_results, csv['lab_time'], day_mapping, csv['pre_lab_ele_man'],
+                                         csv['theory_time'], csv['course'], engine='gale_shapley')
+        state = IncrementalMatching.from_results(csv['course'], csv['student'], csv['elective_capacity'],
+                                                 csv['elective_preference'], course_results, csv['lab_time'],
+                                                 day_mapping, csv['pre_lab_ele_man'], csv['theory_time'],
+                                                 lab_results)
+        # Room in every lab section, so the placement only depends on the program
+        state.section_capacity = {lab_id: capacity + 1 for lab_id, capacity in state.section_capacity.items()}
+        placed = state.add_student(int(csv['student']['student_id'].max()) + 1, 'New', programs['MDS'], 2)
+        self.assertIsNotNone(placed)
+        course_rows, _ = placed
+        program_1 = csv['course'][csv['course']['program_id'] == 1]
+        self.assertEqual((course_rows['course_type'] == 'Elective').sum(), 2)
+        self.assertTrue(course_rows['course_id'].isin(program_1['course_id']).all())
+
+
+class TestPreferenceUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv = os.path.join(self.directory.name, 'elective_preference.csv')
+        with open(self.csv, 'wb') as f:
+            f.write(b"student_id ,program_id,course_id ,preference_rank \r\n2501,1,4,1\r\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_valid_rows_appended_and_rejected_rows_reported(self):
+        upload = ("student_id,program_id,course_id,preference_rank\n"
+                  "2504, 1, 3, 1\n"     # accepted
+                  "2504,1,1,2\n"        # course 1 is mandatory
+                  "999999,1,3,1\n"      # no such student
+                  "2502,1,3,1\n"        # 2502 is in program 3
+                  "2504,1,x,1\n"        # not an id
+                  "2504,1,3,0\n"        # rank below 1
+                  "2504,1,4,2.0\n")     # accepted
+        summary = ingest_preferences(io.BytesIO(upload.encode()), 'elective', path=self.csv, chunk_rows=2)
+        self.assertEqual(summary['accepted'], 2)
+        self.assertEqual(summary['rejected'], 5)
+        self.assertDictEqual(summary['reasons'], {"course_id is not an elective of program_id": 1,
+                                                  "unknown student_id": 1,
+                                                  "program_id is not the student's program": 1,
+                                                  "missing or non-integer value": 1,
+                                                  "preference_rank below 1": 1})
+        self.assertListEqual(summary['rejected_rows']['line'].tolist(), [3, 4, 5, 6, 7])
+        with open(self.csv, 'rb') as f:
+            self.assertEqual(f.read().split(b"\r\n")[1:], [b"2501,1,4,1", b"2504,1,3,1", b"2504,1,4,2", b""])
+
+    def test_lab_rows_of_another_program_rejected(self):
+        path = os.path.join(self.directory.name, 'pre_lab_ele_man.csv')
+        with open(path, 'w') as f:
+            f.write("student_id ,program_id,course_id ,lab,preference_rank \n2502,3,11,2,1\n")
+        upload = ("student_id,program_id,course_id,lab,preference_rank\n"
+                  "2502,3,12,1,1\n"     # accepted
+                  "2502,1,1,1,1\n"      # 2502 is in program 3
+                  "2502,3,12,9,2\n")    # no lab 9
+        summary = ingest_preferences(io.BytesIO(upload.encode()), 'lab', path=path)
+        self.assertEqual(summary['accepted'], 1)
+        self.assertDictEqual(summary['reasons'], {"program_id is not the student's program": 1,
+                                                  "no such (course_id, lab) section": 1})
+
+    def test_out_of_range_rows_rejected_and_upload_loads(self):
+        upload = ("student_id,program_id,course_id,preference_rank\n"
+                  "2504,1,3,200\n"           # rank beyond int8
+                  "3000000000,1,3,1\n"       # id beyond int32
+                  "2504,1,3,2\n")
+        summary = ingest_preferences(io.BytesIO(upload.encode()), 'elective', path=self.csv)
+        self.assertEqual(summary['accepted'], 1)
+        self.assertDictEqual(summary['reasons'], {"value out of range (int32 ids, int8 ranks)": 2})
+        loaded = read_preferences(self.csv, snapshot_dir=self.directory.name)
+        self.assertListEqual(loaded['preference_rank'].tolist(), [1, 2])
+
+    def test_missing_column_appends_nothing(self):
+        with self.assertRaises(ValueError):
+            ingest_preferences(io.BytesIO(b"student_id,course_id\n2502,3\n"), 'elective', path=self.csv)
+        self.assertEqual(len(pd.read_csv(self.csv)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import contextlib
+import io
+import sys
+import time
+import numpy as np
+import pandas as pd
+from algorithm_f import solve_course_matching, solve_lab_matching
+from solver_config import SolverConfig
+
+# Time-to-optimal of the 'ilp' engines with and without the Gale-Shapley warm start.
+#
+#   python benchmark_warm_start.py [n_students] [seed]
+#
+# Random instances with the columns of the backend CSVs: few electives with tight
+# capacities for the course stage, and many short, overlapping lab sections with
+# tight capacities for the lab stage.
+
+
+def make_course_data(rng, n_students, n_programs=3, n_mandatory=3, n_electives=12):
+    courses, capacities = [], []
+    course_id = 1
+    for program_id in range(1, n_programs + 1):
+        for i in range(n_mandatory + n_electives):
+            mandatory = int(i < n_mandatory)
+            courses.append([course_id, f"Course {course_id}", mandatory, program_id, 1])
+            if not mandatory:
+                capacities.append([course_id, f"Course {course_id}", 0])
+            course_id += 1
+    course_data = pd.DataFrame(courses, columns=['course_id', 'course_name', 'mandatory', 'program_id', 'has_lab'])
+
+    students, preferences = [], []
+    popularity = rng.dirichlet(np.ones(n_electives) * 0.7)
+    for i in range(n_students):
+        student_id = 10000 + i
+        program_id = int(rng.integers(1, n_programs + 1))
+        students.append([student_id, f"Student {student_id}", f"P{program_id}", program_id, 3])
+        electives = course_data[(course_data['program_id'] == program_id) & (course_data['mandatory'] == 0)]['course_id']
+        ranked = rng.choice(electives.to_numpy(), size=6, replace=False, p=popularity)
+        for rank, elective in enumerate(ranked, start=1):
+            preferences.append([student_id, program_id, int(elective), rank])
+    student_data = pd.DataFrame(students, columns=['student_id', 'name', 'program', 'program_id', 'required_electives'])
+    elective_capacity_data = pd.DataFrame(capacities, columns=['course_id', 'course_name', 'capacity'])
+    # Just enough seats in total, spread unevenly over the electives
+    per_program = student_data['program_id'].value_counts()
+    program_of = dict(zip(course_data['course_id'], course_data['program_id']))
+    elective_capacity_data['capacity'] = [
+        int(np.ceil(per_program.get(program_of[c], 0) * 3 / n_electives * rng.uniform(1.0, 1.8)))
+        for c in elective_capacity_data['course_id']]
+    elective_preference_data = pd.DataFrame(preferences, columns=['student_id', 'program_id', 'course_id',
+                                                                  'preference_rank'])
+    return course_data, student_data, elective_capacity_data, elective_preference_data
+
+
+def make_lab_data(rng, student_course_matching, course_data, n_labs=6):
+    sections = []
+    lab_courses = course_data.loc[course_data['has_lab'] == 1, 'course_id'].unique()
+    enrolled = student_course_matching['course_id'].value_counts()
+    for course_id in lab_courses:
+        for lab in range(1, n_labs + 1):
+            start = int(rng.integers(8, 18))
+            capacity = int(np.ceil(enrolled.get(course_id, 0) / n_labs * 1.3)) + 1
+            sections.append([course_id, f"Course {course_id}", 1, lab, int(rng.integers(1, 4)),
+                             f"{start:02d}:00:00", f"{start + 2:02d}:00:00", capacity])
+    lab_time_data = pd.DataFrame(sections, columns=['course_id', 'course_name', 'allowed_for_program_id', 'lab',
+                                                    'id_day', 'start_time', 'end_time', 'capacity'])
+    theory_time_data = pd.DataFrame({'course_id': lab_courses, 'course_name': '', 'id_day': 5,
+                                     'start_time': '08:00:00', 'end_time': '10:00:00'})
+    preferences = []
+    for student_id, course_id in zip(student_course_matching['student_id'], student_course_matching['course_id']):
+        for rank, lab in enumerate(rng.permutation(n_labs)[:3] + 1, start=1):
+            preferences.append([student_id, 1, course_id, int(lab), rank])
+    pre_lab_ele_man_data = pd.DataFrame(preferences, columns=['student_id', 'program_id', 'course_id', 'lab',
+                                                              'preference_rank'])
+    day_mapping = {1: 'Monday', 2: 'Tuesday', 3: 'Wednesday', 4: 'Thursday', 5: 'Friday'}
+    return lab_time_data, day_mapping, pre_lab_ele_man_data, theory_time_data
+
+
+def timed(solve, *args, **kwargs):
+    """Run a solve quietly; returns (seconds, solver report)."""
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results_df = solve(*args, **kwargs)
+    seconds = time.perf_counter() - started
+    return seconds, None if results_df is None else results_df.attrs['solver_report']
+
+
+def main():
+    n_students = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    rng = np.random.default_rng(seed)
+
+    course_inputs = make_course_data(rng, n_students)
+    with contextlib.redirect_stdout(io.StringIO()):
+        student_course_matching = solve_course_matching(*course_inputs, engine='flow')
+    lab_time_data, day_mapping, pre_lab_ele_man_data, theory_time_data = make_lab_data(
+        rng, student_course_matching, course_inputs[0])
+    lab_inputs = (student_course_matching, lab_time_data, day_mapping, pre_lab_ele_man_data, theory_time_data,
+                  course_inputs[0])
+
+    print(f"{n_students} students, seed {seed}")
+    print(f"{'stage':<8}{'warm start':<12}{'time limit':<12}{'seconds':>9}  {'status':<12}{'objective':>10}  gap")
+    for stage, solve, inputs in (('course', solve_course_matching, course_inputs), ('lab', solve_lab_matching, lab_inputs)):
+        for time_limit in (None, 1):
+            for warm_start in (False, True):
+                config = SolverConfig(time_limit=time_limit, msg=0, warm_start=warm_start)
+                seconds, report = timed(solve, *inputs, engine='ilp', solver_config=config)
+                status = 'no solution' if report is None else report['status']
+                objective = '' if report is None else f"{report['objective']:g}"
+                gap = '' if report is None or report['gap'] is None else f"{report['gap']:.2%}"
+                print(f"{stage:<8}{str(warm_start):<12}{str(time_limit):<12}{seconds:>9.2f}  {status:<12}{objective:>10}  {gap}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,19 @@
 #from students import Student
 
 #Helper libraries
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, abort
+import os
 import threading
+import time
 import webbrowser
 import algorithm_f
 import pandas as pd 
+from incremental import IncrementalMatching
+from jobs import JobQueue, results_locked
+from preference_upload import ingest_preferences
+from result_cache import ResultCache
+from student_registry import COLUMNS as STUDENT_COLUMNS, STUDENT_CSV, program_ids, read_csv_shared, register_student
+from solver_config import SolverConfig
 
 #Create a Flask app
 app = Flask(__name__)
@@ -17,11 +25,41 @@ app.secret_key = 'your_unique_secret_key'
 #Hardcoded variables
 USERNAME = 'admin'
 PASSWORD = 'password123'
-PROGRAM_MAP = {
-    'MPP': 1,
-    'MDS': 2,
-    'MIA': 3
-}
+#Program name -> program_id, from backend/program.csv
+PROGRAM_MAP = program_ids()
+#Hard upper bound on the solver time of one /algorithm request, in seconds
+ALGORITHM_TIME_LIMIT = 60
+#Last matching, kept in memory so that /demo can insert students into it (None: load from the saved CSVs)
+matching_state = None
+#Modification times of the saved CSVs the in-memory matching corresponds to
+matching_state_version = None
+#Requests run in threads; one at a time changes the in-memory matching (and, under
+#results_locked, the saved CSVs, which the jobs of every process write under that lock)
+matching_state_lock = threading.Lock()
+#Background runs of /algorithm and their results by input fingerprint, shared through SQLite with the other app processes
+job_queue = JobQueue(cache=ResultCache())
+
+def saved_matching_version():
+    return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None
+                 for path in ('student_course_matching.csv', 'student_lab_matching.csv'))
+
+def current_matching_state():
+    """
+    The last matching, reloaded when a job (of any process) has saved a new one; None if there is none.
+    Called under results_locked, like save_matching_state.
+    """
+    global matching_state, matching_state_version
+    version = saved_matching_version()
+    if matching_state is None or version != matching_state_version:
+        matching_state = IncrementalMatching.load()
+        matching_state_version = version
+    return matching_state
+
+def save_matching_state():
+    global matching_state_version
+    matching_state.course_results().to_csv('student_course_matching.csv', index=False)
+    matching_state.lab_results().to_csv('student_lab_matching.csv', index=False)
+    matching_state_version = saved_matching_version()
 
 @app.route("/", methods = ['GET', 'POST'])
 @app.route('/login', methods = ['GET', 'POST'])
@@ -63,39 +101,148 @@ def demo():
     courses_for_program = []
     if request.method == 'POST':
         try:
-            df = pd.read_csv('backend/student.csv')
             student_name = request.form.get('student_name')
             program = request.form.get('program')
             
             if student_name and program:
 
                 program_id = PROGRAM_MAP.get(program)
+                if program_id is None:
+                    raise ValueError(f"Unknown program '{program}', expected one of {', '.join(PROGRAM_MAP)}")
+                required_electives = 2
 
-                last_id =df['student_id'].iloc[-1]
-                new_row = [last_id + 1, student_name , program, 1, 2]
-                new_df = pd.DataFrame([new_row], columns = df.columns)
-                df = pd.concat([df, new_df], ignore_index=True)
-
-                df.to_csv('backend/student.csv', index=False)
+                #Appended with the next id under a file lock, without rewriting the roster
+                student_id = register_student(student_name, program, program_id, required_electives)
+                output = place_student(student_id, student_name, program_id, required_electives)
+                df = pd.DataFrame([[student_id, student_name, program, program_id, required_electives]],
+                                  columns=STUDENT_COLUMNS)
+            else:
+                df = read_csv_shared(STUDENT_CSV)
 
-            
-            output = df.to_html(classes='table table-bordered', index=False)
+            output = (output or "") + df.to_html(classes='table table-bordered', index=False)
         except Exception as e:
             output = f"<p style='color:red;'>Error: {str(e)}</p>"
             
     return render_template('demo.html', output = output)
 
+def place_student(student_id, name, program_id, required_electives):
+    """
+    Insert a new student into the last matching without a full re-solve and
+    save the updated result tables. Returns an HTML summary.
+    """
+    with matching_state_lock, results_locked():
+        if current_matching_state() is None:
+            return "<p>No matching yet: run the algorithm to assign the new student.</p>"
+        started = time.perf_counter()
+        placed = matching_state.add_student(int(student_id), name, int(program_id), int(required_electives))
+        seconds = time.perf_counter() - started
+        if placed is None:
+            return "<p>No free seat or short reassignment found: run the algorithm for a full re-match.</p>"
+        save_matching_state()
+        _, lab_rows = placed
+        return (f"<p>Placed in {seconds * 1000:.1f} ms, {len(matching_state.moved)} other students moved</p>"
+                + lab_rows.to_html(classes='table table-bordered', index=False))
+
+@app.route('/drop', methods = ['POST'])
+def drop():
+    """
+    A student drops a course (or only its lab): the freed seats are reassigned
+    along improving chains in the last matching, without a full re-solve.
+    The drop is not part of the input data, so the next /algorithm run
+    (re-solved or served from the cache) does not keep it.
+    """
+    output = None
+    try:
+        with matching_state_lock, results_locked():
+            if current_matching_state() is None:
+                output = "<p>No matching yet: run the algorithm first.</p>"
+            else:
+                student_id = int(request.form.get('student_id'))
+                course_id = int(request.form.get('course_id'))
+                started = time.perf_counter()
+                if request.form.get('lab_only'):
+                    course_moves, lab_moves = [], matching_state.drop_lab(student_id, course_id)
+                else:
+                    course_moves, lab_moves = matching_state.drop_course(student_id, course_id)
+                seconds = time.perf_counter() - started
+                save_matching_state()
+                moved = sorted(matching_state.moved)
+                output = (f"<p>Released in {seconds * 1000:.1f} ms: {len(course_moves)} course and "
+                          f"{len(lab_moves)} lab reassignments, {len(moved)} students moved</p>"
+                          "<p>Note: running the algorithm again re-matches from the preference data "
+                          "and discards this drop.</p>")
+                if moved:
+                    output += matching_state.lab_results(moved).to_html(classes='table table-bordered', index=False)
+    except Exception as e:
+        output = f"<p style='color:red;'>Error: {str(e)}</p>"
+    return render_template('demo.html', output = output)
+
+@app.route('/upload_preferences', methods = ['POST'])
+def upload_preferences():
+    """
+    Bulk upload of elective or lab preferences from a CSV file: the file is
+    validated chunk by chunk and its valid rows appended to the preference
+    data; rejected rows are reported with the reason.
+    """
+    try:
+        upload = request.files.get('preferences')
+        if upload is None or not upload.filename:
+            raise ValueError("No file uploaded")
+        started = time.perf_counter()
+        summary = ingest_preferences(upload.stream, request.form.get('kind', 'elective'))
+        seconds = time.perf_counter() - started
+        output = (f"<p>{summary['accepted']} rows added, {summary['rejected']} rejected "
+                  f"in {seconds:.1f}s</p>")
+        output += "".join(f"<p>{reason}: {count} rows</p>" for reason, count in summary['reasons'].items())
+        if summary['rejected']:
+            output += summary['rejected_rows'].to_html(classes='table table-bordered', index=False)
+    except Exception as e:
+        output = f"<p style='color:red;'>Error: {str(e)}</p>"
+    return render_template('demo.html', output = output)
+
 @app.route('/algorithm', methods = ['GET', 'POST'])
 def algorithm():
-    output = None
     if request.method == 'POST':
         try:
-            df_algo = algorithm_f.optimize_course_matching()
-            df_algo2 = algorithm_f.optimize_lab_matching()
-            output = df_algo2.to_html(classes='table table-bordered', index=False)
+            #Both stages share the time budget; the environment may only lower it
+            job_id = job_queue.submit(SolverConfig.from_env(), ALGORITHM_TIME_LIMIT)
         except Exception as e:
-            output = f"<p style='color:red;'>Error: {str(e)}</p>"
+            return render_template('algorithm.html', output = f"<p style='color:red;'>Error: {str(e)}</p>")
+        return redirect(url_for('algorithm_result', job_id=job_id))
+    return render_template('algorithm.html', output = None)
+
+@app.route('/algorithm/jobs/<job_id>')
+def algorithm_status(job_id):
+    """Status of a matching job: status, stage, phase, elapsed seconds and error."""
+    status = job_queue.status(job_id)
+    if status is None:
+        abort(404)
+    return jsonify(status)
 
+@app.route('/algorithm/jobs/<job_id>/result')
+def algorithm_result(job_id):
+    """The result table of a matching job, or its progress (refreshing) while it runs."""
+    status = job_queue.status(job_id)
+    if status is None:
+        abort(404)
+    if status['status'] == 'failed':
+        output = f"<p style='color:red;'>Error: {status['error']}</p>"
+    elif status['status'] != 'done':
+        phase = "queued" if status['status'] == 'queued' else f"{status['stage']} matching: {status['phase']}"
+        output = (f"<meta http-equiv='refresh' content='2'><p>Job {job_id}: {phase}, "
+                  f"{status['elapsed']:.1f}s elapsed</p>")
+    else:
+        result = job_queue.result(job_id)
+        reports = [("Course matching", result['reports']['course']),
+                   ("Lab matching", result['reports']['lab'])]
+        summary = "".join(
+            f"<p>{stage}: {report['status']}"
+            + ("" if report['gap'] is None else f", gap {report['gap']:.2%}")
+            + f", {report['seconds']:.1f}s</p>"
+            for stage, report in reports)
+        if result['cached']:
+            summary += "<p>Inputs unchanged since an earlier run: served from the result cache.</p>"
+        output = summary + result['table'].to_html(classes='table table-bordered', index=False)
     return render_template('algorithm.html', output = output)
 
 
@@ -0,0 +1,615 @@
+import os
+from collections import defaultdict
+import pandas as pd
+from algorithm_f import load_data_first, load_data_second
+from matching_instance import MatchingInstance, interval_mask, minute_of_week, utility_from_rank
+
+# Incremental re-matching: insert one student into a solved matching without a
+# full two-stage re-solve.
+#
+# The solved state is kept in dicts and sets, so an insertion only touches the
+# courses and labs the new student can take. A free seat is taken directly;
+# otherwise a bounded augmenting path moves holders of a full course on to
+# other electives they are eligible for (for labs: moves a displaced lab on to
+# another section of its course), and the path with the best net utility is
+# applied. Students moved to another elective get a lab for it the same way.
+# If no path within max_path_length moves exists, the insertion is rolled
+# back and add_student returns None: only a full re-solve can place the student.
+
+
+class IncrementalMatching:
+    def __init__(self, course_data, elective_capacity_data, lab_time_data, day_mapping, theory_time_data,
+                 max_path_length=3):
+        """
+        Empty state over the static inputs of both stages.
+        max_path_length: most students moved for one seat or lab
+        """
+        self.course_data = course_data
+        self.elective_capacity_data = elective_capacity_data
+        self.lab_time_data = lab_time_data.assign(
+            lab_id=lab_time_data['course_id'].astype(str) + '-' + lab_time_data['lab'].astype(str))
+        self.day_mapping = day_mapping
+        self.theory_time_data = theory_time_data
+        self.max_path_length = max_path_length
+
+        courses = course_data.drop_duplicates('course_id')
+        self.course_names = dict(zip(courses['course_id'], courses['course_name']))
+        self.course_position = {course_id: i for i, course_id in enumerate(courses['course_id'])}
+        self.has_lab = set(courses.loc[courses['has_lab'] == 1, 'course_id'])
+        self.capacity = dict(zip(elective_capacity_data['course_id'], elective_capacity_data['capacity']))
+
+        sections = self.lab_time_data.drop_duplicates(['course_id', 'lab'])
+        starts = minute_of_week(sections['id_day'], sections['start_time'])
+        ends = minute_of_week(sections['id_day'], sections['end_time'])
+        self.sections = defaultdict(list)  # course_id -> lab ids, in lab_time order
+        self.section_course = {}
+        self.section_mask = {}
+        self.section_capacity = {}
+        for lab_id, course_id, start, end, capacity in zip(sections['lab_id'], sections['course_id'], starts.tolist(),
+                                                           ends.tolist(), sections['capacity']):
+            self.sections[course_id].append(lab_id)
+            self.section_course[lab_id] = course_id
+            self.section_mask[lab_id] = interval_mask(start, end)
+            self.section_capacity[lab_id] = capacity
+        # Times as printed in the results tables, first row per course / lab
+        self.lab_times = {lab_id: (day_mapping.get(id_day, 'Unknown'), start, end) for lab_id, id_day, start, end in
+                          zip(sections['lab_id'], sections['id_day'], sections['start_time'], sections['end_time'])}
+        theory = theory_time_data.drop_duplicates('course_id')
+        self.theory_times = {course_id: (day_mapping.get(id_day, 'Unknown'), start, end) for course_id, id_day, start, end
+                             in zip(theory['course_id'], theory['id_day'], theory['start_time'], theory['end_time'])}
+        self.theory_mask = defaultdict(int)
+        starts = minute_of_week(theory_time_data['id_day'], theory_time_data['start_time'])
+        ends = minute_of_week(theory_time_data['id_day'], theory_time_data['end_time'])
+        for course_id, start, end in zip(theory_time_data['course_id'], starts.tolist(), ends.tolist()):
+            self.theory_mask[course_id] |= interval_mask(start, end)
+
+        self.student_names = {}  # student_id -> name, in matching order
+        self.mandatory = {}  # student_id -> mandatory course ids
+        self.electives = {}  # student_id -> {eligible elective: utility}
+        self.held = defaultdict(set)  # student_id -> assigned electives
+        self.holders = defaultdict(set)  # course_id -> students holding it as an elective
+        self.load = defaultdict(int)  # course_id -> assigned students, mandatory or elective
+        # course c -> elective d -> utility change -> holders of c eligible for d who do not hold it
+        self.movable = defaultdict(lambda: defaultdict(lambda: defaultdict(set)))
+        self.lab_utility = {}  # (student_id, course_id) -> {lab_id: utility}
+        self.lab_of = {}  # (student_id, course_id) -> assigned lab_id
+        self.lab_holders = defaultdict(set)  # lab_id -> (student_id, course_id) holding it
+        self.moved = set()  # students whose assignment changed in the last insertion
+        self._undo = []
+
+    @classmethod
+    def from_results(cls, course_data, student_data, elective_capacity_data, elective_preference_data, course_results,
+                     lab_time_data, day_mapping, pre_lab_ele_man_data, theory_time_data, lab_results, **kwargs):
+        """
+        State of a solved matching: the inputs of both stages and their results
+        tables. Only students in course_results are registered.
+        """
+        state = cls(course_data, elective_capacity_data, lab_time_data, day_mapping, theory_time_data, **kwargs)
+        state._register(MatchingInstance.from_course_data(course_data, student_data, elective_capacity_data,
+                                                          elective_preference_data),
+                        set(course_results['student_id']))
+        chosen = course_results[course_results['course_type'] == 'Elective']
+        for student_id, course_id in zip(chosen['student_id'], chosen['course_id']):
+            if student_id in state.student_names:
+                state._assign_elective(student_id, course_id)
+        state._register_labs(MatchingInstance.from_lab_data(course_results, lab_time_data, pre_lab_ele_man_data,
+                                                            theory_time_data, course_data))
+        # Results tables hold lab times, not lab ids
+        day_id = {day: id_day for id_day, day in day_mapping.items()}
+        by_time = defaultdict(list)
+        for lab_id, course_id, id_day, start, end in zip(state.lab_time_data['lab_id'], state.lab_time_data['course_id'],
+                                                         state.lab_time_data['id_day'], state.lab_time_data['start_time'],
+                                                         state.lab_time_data['end_time']):
+            by_time[course_id, id_day, start, end].append(lab_id)
+        for student_id, course_id, day, start, end in zip(lab_results['student_id'], lab_results['course_id'],
+                                                          lab_results['lab_day'], lab_results['lab_start_time'],
+                                                          lab_results['lab_end_time']):
+            labs = by_time.get((course_id, day_id.get(day), start, end), [])
+            if not labs or student_id not in state.student_names:
+                continue
+            # Of several sections at the same time, the first with a free seat
+            free = [lab_id for lab_id in labs if len(state.lab_holders[lab_id]) < state.section_capacity[lab_id]]
+            state._assign_lab((student_id, course_id), (free or labs)[0])
+        state._undo = []
+        return state
+
+    @classmethod
+    def load(cls, **kwargs):
+        """
+        State of the matching last saved by optimize_course_matching and
+        optimize_lab_matching, None if there is none.
+        """
+        if not (os.path.exists('student_course_matching.csv') and os.path.exists('student_lab_matching.csv')):
+            return None
+        course_data, student_data, elective_capacity_data, elective_preference_data = load_data_first()
+        (course_results, lab_time_data, day_mapping,
+         pre_lab_ele_man_data, theory_time_data, _) = load_data_second()
+        lab_results = pd.read_csv('student_lab_matching.csv')
+        return cls.from_results(course_data, student_data, elective_capacity_data, elective_preference_data,
+                                course_results, lab_time_data, day_mapping, pre_lab_ele_man_data, theory_time_data,
+                                lab_results, **kwargs)
+
+    def _register(self, instance, student_ids=None):
+        """Add the students of a course stage instance (only student_ids if given), without electives."""
+        electives = ~instance.elig_mandatory
+        utility = instance.pair_utility
+        for i, student_id in enumerate(instance.student_ids.tolist()):
+            if student_ids is not None and student_id not in student_ids:
+                continue
+            start, end = instance.elig_indptr[i], instance.elig_indptr[i + 1]
+            pairs = range(start, end)
+            self.student_names[student_id] = instance.student_names[i]
+            self.mandatory[student_id] = [instance.course_ids[instance.elig_course[p]] for p in pairs
+                                          if not electives[p]]
+            self.electives[student_id] = {instance.course_ids[instance.elig_course[p]]: int(utility[p])
+                                          for p in pairs if electives[p]}
+            for course_id in self.mandatory[student_id]:
+                self.load[course_id] += 1
+
+    def _register_labs(self, instance):
+        """Lab utilities of every candidate of a lab stage instance."""
+        utility = instance.cand_utility
+        for k in range(len(instance.cand_section)):
+            student_id = instance.student_ids[instance.cand_student[k]]
+            course_id = instance.course_ids[instance.enroll_course[instance.cand_enrollment[k]]]
+            lab_id = instance.section_lab_id[instance.cand_section[k]]
+            self.lab_utility.setdefault((student_id, course_id), {})[lab_id] = int(utility[k])
+
+    # Changes to the state, each logged with its inverse
+
+    def _assign_elective(self, student_id, course_id):
+        electives = self.electives[student_id]
+        for other in self.held[student_id]:
+            self.movable[other][course_id][electives[course_id] - electives.get(other, 0)].discard(student_id)
+        for other, utility in electives.items():
+            if other != course_id and other not in self.held[student_id]:
+                self.movable[course_id][other][utility - electives.get(course_id, 0)].add(student_id)
+        self.held[student_id].add(course_id)
+        self.holders[course_id].add(student_id)
+        self.load[course_id] += 1
+        self._undo.append(lambda: self._release_elective(student_id, course_id))
+
+    def _release_elective(self, student_id, course_id):
+        self.held[student_id].discard(course_id)
+        self.holders[course_id].discard(student_id)
+        self.load[course_id] -= 1
+        electives = self.electives[student_id]
+        for other, utility in electives.items():
+            if other != course_id and other not in self.held[student_id]:
+                self.movable[course_id][other][utility - electives.get(course_id, 0)].discard(student_id)
+        if course_id in electives:
+            for other in self.held[student_id]:
+                self.movable[other][course_id][electives[course_id] - electives.get(other, 0)].add(student_id)
+        self._undo.append(lambda: self._assign_elective(student_id, course_id))
+
+    def _assign_lab(self, key, lab_id):
+        self.lab_of[key] = lab_id
+        self.lab_holders[lab_id].add(key)
+        self._undo.append(lambda: self._release_lab(key))
+
+    def _release_lab(self, key):
+        lab_id = self.lab_of.pop(key)
+        self.lab_holders[lab_id].discard(key)
+        self._undo.append(lambda: self._assign_lab(key, lab_id))
+
+    def _release_mandatory(self, student_id, course_id):
+        position = self.mandatory[student_id].index(course_id)
+        del self.mandatory[student_id][position]
+        self.load[course_id] -= 1
+        self._undo.append(lambda: self._restore_mandatory(student_id, course_id, position))
+
+    def _restore_mandatory(self, student_id, course_id, position):
+        self.mandatory[student_id].insert(position, course_id)
+        self.load[course_id] += 1
+        self._undo.append(lambda: self._release_mandatory(student_id, course_id))
+
+    def _rollback(self, mark):
+        """Undo the changes logged after mark."""
+        while len(self._undo) > mark:
+            self._undo.pop()()
+            self._undo.pop()  # the undo logs its own inverse
+
+    # Course stage
+
+    def _seat_free(self, course_id):
+        capacity = self.capacity.get(course_id)
+        return capacity is None or self.load[course_id] < capacity
+
+    def _elective_path(self, student_id):
+        """
+        Augmenting path giving student_id one more elective, as a list of
+        (student, from course or None, to course) moves, or None.
+        Breadth-first over courses, at most max_path_length moves: the best net
+        utility among the shortest paths, so a free seat is taken directly.
+        """
+        held = self.held[student_id]
+        parent = {}  # course -> (previous course, student moving into it)
+        gain = {}  # course -> utility change of the path ending in it
+        level = []
+        for course_id, utility in self.electives[student_id].items():
+            if course_id not in held:
+                parent[course_id] = (None, student_id)
+                gain[course_id] = utility
+                level.append(course_id)
+        best = None
+        for depth in range(1, self.max_path_length + 1):
+            if best is not None:
+                break  # only the shortest paths; depth 1 is a free seat
+            next_level = {}
+            for course_id in level:
+                if self._seat_free(course_id):
+                    if best is None or gain[course_id] > gain[best]:
+                        best = course_id
+                    continue
+                if depth == self.max_path_length:
+                    continue
+                for other, by_change in self.movable[course_id].items():
+                    # The holder who loses least by moving on to other
+                    for change in sorted(by_change, reverse=True):
+                        holder = next((h for h in by_change[change] if h != student_id), None)
+                        if holder is not None:
+                            break
+                    else:
+                        continue
+                    value = gain[course_id] + change
+                    # A course is reached once, by its best path of the shortest length
+                    if other not in parent or (other in next_level and value > gain[other]):
+                        next_level[other] = True
+                        parent[other] = (course_id, holder)
+                        gain[other] = value
+            level = next_level
+        if best is None:
+            return None
+        moves = []
+        course_id = best
+        while course_id is not None:
+            previous, mover = parent[course_id]
+            moves.append((mover, previous, course_id))
+            course_id = previous
+        return moves
+
+    def _improving_chains(self, course_id, exclude):
+        """
+        Improving chains for a freed seat of course_id: the holder of another
+        elective who gains most moves into the seat, freeing theirs for the
+        next, and so on. Each chain is a list of (student, from course, to course)
+        moves; the chains end at every course reached with a positive total
+        gain, best first. Breadth-first, at most max_path_length moves;
+        exclude never moves.
+        """
+        parent = {course_id: None}  # freed course -> (course it moved into, student moving)
+        gain = {course_id: 0}
+        level = [course_id]
+        for _ in range(self.max_path_length):
+            next_level = {}
+            for freed in level:
+                for other, targets in self.movable.items():
+                    by_change = targets.get(freed)
+                    if not by_change or (other in parent and other not in next_level):
+                        continue
+                    # The waiting holder who gains most
+                    change, holder = max(((change, holder) for change, holders in by_change.items() if change > 0
+                                          for holder in holders if holder != exclude), default=(0, None))
+                    if holder is None:
+                        continue
+                    value = gain[freed] + change
+                    if other not in parent or value > gain[other]:
+                        parent[other] = (freed, holder)
+                        gain[other] = value
+                        next_level[other] = True
+            level = next_level
+        chains = []
+        for end in sorted((course for course in gain if gain[course] > 0), key=lambda course: -gain[course]):
+            moves = []
+            while parent[end] is not None:
+                freed, holder = parent[end]
+                moves.append((holder, end, freed))
+                end = freed
+            chains.append(moves[::-1])
+        return chains
+
+    # Lab stage
+
+    def _displaced_by(self, key, lab_id):
+        """Labs that lose their place when key takes lab_id, None if key cannot take it."""
+        student_id, course_id = key
+        mask = self.section_mask[lab_id]
+        courses = self.mandatory[student_id] + list(self.held[student_id])
+        if any(self.theory_mask[other] & mask for other in courses):
+            return None
+        displaced = [(student_id, other) for other in courses
+                     if other != course_id and (student_id, other) in self.lab_of
+                     and self.section_mask[self.lab_of[student_id, other]] & mask]
+        if len(self.lab_holders[lab_id]) >= self.section_capacity[lab_id]:
+            displaced.append(None)  # any holder of the lab
+        return displaced
+
+    def _lab_paths(self, key):
+        """
+        Augmenting paths giving key a lab, each a list of (key, lab) moves.
+        Breadth-first over displaced labs, at most max_path_length moves, each
+        displacing at most one lab; only the shortest paths are returned, best
+        net utility first, so a free lab is taken directly.
+        """
+        parent = {key: None}  # displaced key -> (key it made room for, lab taken)
+        gain = {key: 0}  # utility change of the path up to the key's move; a displaced key lost its lab
+        ends = []
+        level = [key]
+        for depth in range(1, self.max_path_length + 1):
+            if ends:
+                break
+            next_level = []
+            for mover in level:
+                current = self.lab_of.get(mover)
+                for lab_id in self.sections.get(mover[1], []):
+                    if lab_id == current:
+                        continue
+                    displaced = self._displaced_by(mover, lab_id)
+                    if displaced is None or len(displaced) > 1:
+                        continue
+                    utility = self._lab_value(mover, lab_id)
+                    if not displaced:
+                        ends.append((gain[mover] + utility, mover, lab_id))
+                        continue
+                    if depth == self.max_path_length:
+                        continue
+                    for other in (self.lab_holders[lab_id] if displaced[0] is None else displaced):
+                        if other not in parent:
+                            parent[other] = (mover, lab_id)
+                            gain[other] = gain[mover] + utility - self._lab_value(other, self.lab_of[other])
+                            next_level.append(other)
+            level = next_level
+        paths = []
+        for _, mover, lab_id in sorted(ends, key=lambda end: -end[0]):
+            moves = [(mover, lab_id)]
+            while parent[mover] is not None:
+                mover, lab_id = parent[mover]
+                moves.append((mover, lab_id))
+            paths.append(moves[::-1])
+        return paths
+
+    def _lab_value(self, key, lab_id):
+        return self.lab_utility.get(key, {}).get(lab_id, 0)
+
+    def _lab_chain(self, lab_id):
+        """
+        Improving chain for a freed seat of lab_id: the student holding another
+        section of the course who gains most and fits it into their week moves
+        in, freeing their section for the next, and so on. Returns the
+        (key, from lab, to lab) moves, best total gain first, at most
+        max_path_length moves.
+        """
+        parent = {lab_id: None}  # freed lab -> (lab it moved into, key moving)
+        gain = {lab_id: 0}
+        level = [lab_id]
+        for _ in range(self.max_path_length):
+            next_level = []
+            for freed in level:
+                for other in self.sections[self.section_course[freed]]:
+                    if other in parent:
+                        continue
+                    best = None
+                    for key in self.lab_holders[other]:
+                        change = self._lab_value(key, freed) - self._lab_value(key, other)
+                        displaced = self._displaced_by(key, freed)
+                        # Only the freed seat itself may be missing
+                        if change > 0 and displaced is not None and all(d is None for d in displaced) and (
+                                best is None or change > best[0]):
+                            best = (change, key)
+                    if best is not None:
+                        parent[other] = (freed, best[1])
+                        gain[other] = gain[freed] + best[0]
+                        next_level.append(other)
+            level = next_level
+        end = max(gain, key=gain.get)
+        moves = []
+        while parent[end] is not None:
+            freed, key = parent[end]
+            moves.append((key, end, freed))
+            end = freed
+        return moves[::-1]
+
+    def _place_lab(self, key):
+        """Give key a lab along the best path that still applies; False if there is none."""
+        for moves in self._lab_paths(key):
+            # The paths were searched on the current state; one that meets itself may no longer apply
+            mark = len(self._undo)
+            for (mover, lab_id), following in zip(moves, moves[1:] + [None]):
+                displaced = self._displaced_by(mover, lab_id)
+                expected = [] if following is None else [following[0]]
+                if displaced == [None] and following is not None and following[0] in self.lab_holders[lab_id]:
+                    displaced = expected
+                if displaced != expected:
+                    self._rollback(mark)
+                    break
+                if following is not None:
+                    self._release_lab(following[0])
+                if mover in self.lab_of:
+                    self._release_lab(mover)
+                self._assign_lab(mover, lab_id)
+            else:
+                self.moved.update(mover for (mover, _), _ in moves)
+                return True
+        return False
+
+    def add_student(self, student_id, name, program_id, required_electives, preferences=(), lab_preferences=()):
+        """
+        Insert a student into the matching.
+        preferences: (course_id, preference_rank) of the student's electives
+        lab_preferences: (course_id, lab, preference_rank) of the student's labs
+        Returns the student's rows of the course and lab results tables, or None
+        (state unchanged) if no augmenting path within the bound places them.
+        Students moved to make room are in self.moved.
+        """
+        if student_id in self.student_names:
+            raise ValueError(f"Student {student_id} is already matched")
+        student_data = pd.DataFrame([[student_id, name, '', program_id, required_electives]],
+                                    columns=['student_id', 'name', 'program', 'program_id', 'required_electives'])
+        elective_preference_data = pd.DataFrame([(student_id, program_id, course_id, rank)
+                                                 for course_id, rank in preferences],
+                                                columns=['student_id', 'program_id', 'course_id', 'preference_rank'])
+        self._undo = []
+        self.moved = set()
+        self._register(MatchingInstance.from_course_data(self.course_data, student_data, self.elective_capacity_data,
+                                                         elective_preference_data))
+        for course_id, lab, rank in lab_preferences:
+            self.lab_utility.setdefault((student_id, course_id), {})[f"{course_id}-{lab}"] = \
+                int(utility_from_rank([rank])[0])
+
+        def fail():
+            self._rollback(0)
+            for course_id in self.mandatory.pop(student_id):
+                self.load[course_id] -= 1
+            del self.student_names[student_id], self.electives[student_id]
+            for course_id, _, _ in lab_preferences:
+                self.lab_utility.pop((student_id, course_id), None)
+            self.moved = set()
+            return None
+
+        # Electives, one augmenting path each
+        needs_lab = [(student_id, course_id) for course_id in self.mandatory[student_id]]
+        for _ in range(int(required_electives)):
+            moves = self._elective_path(student_id)
+            if moves is None:
+                return fail()
+            for mover, previous, course_id in moves:
+                if previous is not None:
+                    self._release_elective(mover, previous)
+                    if (mover, previous) in self.lab_of:
+                        self._release_lab((mover, previous))
+                    self.moved.add(mover)
+                self._assign_elective(mover, course_id)
+                needs_lab.append((mover, course_id))
+
+        # Labs for the student's courses and for the electives others moved to
+        for key in needs_lab:
+            if key[1] in self.has_lab and self.sections.get(key[1]) and key not in self.lab_of:
+                if not self._place_lab(key):
+                    return fail()
+        self.moved.discard(student_id)
+        return self.course_results([student_id]), self.lab_results([student_id])
+
+    def drop_course(self, student_id, course_id):
+        """
+        A student drops a course (and its lab). The freed elective seat goes to
+        the waiting student who gains most, whose old seat cascades along the
+        best improving chain; freed lab seats cascade the same way.
+        All of it is applied at once or not at all.
+        Returns the (student_id, from, to) course moves and the
+        ((student_id, course_id), from lab, to lab) lab moves; students whose
+        assignment changed are in self.moved.
+        Only the matching changes, not the input tables: a full re-solve (or
+        a result served from the cache for the same inputs) discards the drop.
+        """
+        if student_id not in self.student_names:
+            raise ValueError(f"Student {student_id} is not matched")
+        if course_id not in self.held[student_id] and course_id not in self.mandatory[student_id]:
+            raise ValueError(f"Student {student_id} does not take course {course_id}")
+        self._undo = []
+        self.moved = set()
+        try:
+            freed_labs = []
+            if (student_id, course_id) in self.lab_of:
+                freed_labs.append(self.lab_of[student_id, course_id])
+                self._release_lab((student_id, course_id))
+            course_moves = []
+            if course_id in self.held[student_id]:
+                self._release_elective(student_id, course_id)
+                course_moves = self._apply_course_chain(course_id, student_id, freed_labs)
+            else:
+                self._release_mandatory(student_id, course_id)
+            lab_moves = []
+            for lab_id in freed_labs:
+                lab_moves.extend(self._apply_lab_chain(lab_id))
+        except Exception:
+            self._rollback(0)
+            self.moved = set()
+            raise
+        return course_moves, lab_moves
+
+    def drop_lab(self, student_id, course_id):
+        """
+        A student gives up the lab of a course (keeping the course); the freed
+        seat cascades along the best improving chain, as in drop_course.
+        Returns the lab moves. Like drop_course, a full re-solve discards it.
+        """
+        key = (student_id, course_id)
+        if key not in self.lab_of:
+            raise ValueError(f"Student {student_id} has no lab for course {course_id}")
+        self._undo = []
+        self.moved = set()
+        lab_id = self.lab_of[key]
+        try:
+            self._release_lab(key)
+            return self._apply_lab_chain(lab_id)
+        except Exception:
+            self._rollback(0)
+            self.moved = set()
+            raise
+
+    def _apply_course_chain(self, course_id, exclude, freed_labs):
+        """Apply the best improving chain for a freed seat whose movers all get a lab; returns its moves."""
+        for moves in self._improving_chains(course_id, exclude):
+            mark = len(self._undo)
+            n_freed = len(freed_labs)
+            moved = set(self.moved)
+            needs_lab = []
+            for holder, previous, target in moves:
+                # The chains were searched on the current state; one that meets itself may no longer apply
+                if previous not in self.held[holder] or target in self.held[holder]:
+                    break
+                if (holder, previous) in self.lab_of:
+                    freed_labs.append(self.lab_of[holder, previous])
+                    self._release_lab((holder, previous))
+                self._release_elective(holder, previous)
+                if not self._seat_free(target):
+                    break
+                self._assign_elective(holder, target)
+                needs_lab.append((holder, target))
+            else:
+                if all(self._place_lab(key) for key in needs_lab
+                       if key[1] in self.has_lab and self.sections.get(key[1]) and key not in self.lab_of):
+                    self.moved.update(holder for holder, _, _ in moves)
+                    return moves
+            del freed_labs[n_freed:]
+            self.moved = moved
+            self._rollback(mark)
+        return []
+
+    def _apply_lab_chain(self, lab_id):
+        """Apply the best improving chain for a freed seat of lab_id; returns its moves."""
+        moves = self._lab_chain(lab_id)
+        mark = len(self._undo)
+        for key, previous, target in moves:
+            self._release_lab(key)
+            if self._displaced_by(key, target) != []:
+                self._rollback(mark)
+                return []
+            self._assign_lab(key, target)
+        self.moved.update(key[0] for key, _, _ in moves)
+        return moves
+
+    def course_results(self, student_ids=None):
+        """Rows of the student_course_matching table (all students by default)."""
+        rows = []
+        for student_id in self.student_names if student_ids is None else student_ids:
+            name = self.student_names[student_id]
+            for course_id in self.mandatory[student_id]:
+                rows.append([student_id, name, 'Mandatory', course_id, self.course_names[course_id]])
+            for course_id in sorted(self.held[student_id], key=self.course_position.get):
+                rows.append([student_id, name, 'Elective', course_id, self.course_names[course_id]])
+        return pd.DataFrame(rows, columns=['student_id', 'student_name', 'course_type', 'course_id', 'course_name'])
+
+    def lab_results(self, student_ids=None):
+        """Rows of the student_lab_matching table (all students by default), as build_lab_results writes it."""
+        missing = ('N/A', 'N/A', 'N/A')
+        rows = []
+        for student_id, name, course_type, course_id, course_name in self.course_results(student_ids).itertuples(
+                index=False):
+            lab_id = self.lab_of.get((student_id, course_id))
+            rows.append([student_id, name, course_id, course_name, course_type,
+                         *self.theory_times.get(course_id, missing),
+                         *(missing if lab_id is None else self.lab_times[lab_id])])
+        return pd.DataFrame(rows, columns=['student_id', 'student_name', 'course_id', 'course_name', 'course_type',
+                                           'theory_day', 'theory_start_time', 'theory_end_time',
+                                           'lab_day', 'lab_start_time', 'lab_end_time'])
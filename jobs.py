@@ -0,0 +1,248 @@
+import contextlib
+import io
+import json
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import algorithm_f
+from result_cache import input_fingerprint, json_default
+from solver_config import SolverConfig
+from student_registry import locked
+
+# Background matching jobs for the /algorithm route.
+#
+# A job runs both stages (course, then lab matching) outside the request. The
+# queue is a table in a local SQLite file, so several app processes share it:
+# a submission schedules a drain on the submitting process's executor, whose
+# worker claims queued jobs with an atomic UPDATE until none is left. Only one
+# job runs at a time.
+#
+# The stages pass the course matching to each other in memory; the worker
+# writes both result CSVs at the end, together, under an exclusive lock on
+# RESULTS_LOCK. The incremental /demo and /drop updates hold the same lock
+# from reading the CSVs to writing them back, so no reader sees the course
+# table of one matching with the lab table of another.
+#
+# A submission with the same inputs and solver settings as a queued or running
+# job gets that job's id instead of starting a second run; with a ResultCache,
+# one matching a finished run is queued as well, but its worker restores the
+# cached tables instead of solving.
+#
+# Job life cycle: status 'queued' -> 'running' -> 'done' or 'failed'; while
+# running, stage is 'course' or 'lab' and phase is 'load', 'build', 'solve' or
+# 'extract'. A running job not updated for JOB_LEASE seconds (its process died)
+# is marked failed.
+
+JOBS_DB = 'matching_jobs.db'
+RESULTS_LOCK = 'matching_results.lock'
+JOB_LEASE = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    phase TEXT,
+    settings TEXT NOT NULL,
+    time_limit REAL,
+    submitted REAL NOT NULL,
+    started REAL,
+    updated REAL,
+    finished REAL,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, submitted);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status);
+"""
+
+
+def run_matching(solver_config, time_limit, progress):
+    """
+    Run both stages within time_limit seconds in total, as the /algorithm route
+    did. Returns the solver report of each stage and both matching tables,
+    without saving them.
+    progress(stage, phase) is called as each phase starts.
+    """
+    deadline = time.monotonic() + time_limit
+    courses = algorithm_f.optimize_course_matching(
+        solver_config=solver_config.capped(time_limit / 2),
+        progress=lambda phase: progress('course', phase), save=False)
+    if courses is None:
+        raise RuntimeError("no feasible course matching was found")
+    labs = algorithm_f.optimize_lab_matching(
+        solver_config=solver_config.capped(max(deadline - time.monotonic(), 1)),
+        progress=lambda phase: progress('lab', phase), student_course_matching=courses, save=False)
+    if labs is None:
+        raise RuntimeError("no feasible lab matching was found")
+    return {'reports': {'course': courses.attrs['solver_report'], 'lab': labs.attrs['solver_report']},
+            'course_table': courses, 'lab_table': labs}
+
+
+@contextlib.contextmanager
+def results_locked():
+    """Hold the exclusive lock of the result CSVs while the block reads or writes them."""
+    with open(RESULTS_LOCK, 'a+b') as f, locked(f):
+        yield
+
+
+def save_results(result):
+    """Write both tables of a result where the stages save them."""
+    with results_locked():
+        result['course_table'].to_csv('student_course_matching.csv', index=False)
+        result['lab_table'].to_csv('student_lab_matching.csv', index=False)
+
+
+class JobQueue:
+    def __init__(self, path=JOBS_DB, run=run_matching, max_workers=1, cache=None, save=save_results):
+        """
+        path: SQLite file of the queue, shared by every process using it
+        run: run(solver_config, time_limit, progress) -> {'reports', 'course_table', 'lab_table'}
+        max_workers: threads draining the queue in this process
+        cache: ResultCache of finished runs (None: every submission is solved)
+        save: save(result) writes the tables of a finished run or of a result served from the cache
+        """
+        self.path = path
+        self.run = run
+        self.cache = cache
+        self.save = save
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")  # readers of the status do not wait for a running update
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        # isolation_level=None: transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def submit(self, solver_config, time_limit, key=None):
+        """
+        Queue a run and return its job id, or the id of the queued or running job
+        with the same inputs and settings.
+        """
+        key = input_fingerprint(solver_config, time_limit) if key is None else key
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT id FROM jobs WHERE key = ? AND status IN ('queued', 'running')",
+                             (key,)).fetchone()
+            if row is not None:
+                db.execute("COMMIT")
+                return row[0]
+            job_id = uuid.uuid4().hex
+            db.execute("INSERT INTO jobs (id, key, status, settings, time_limit, submitted) "
+                       "VALUES (?, ?, 'queued', ?, ?, ?)",
+                       (job_id, key, json.dumps(solver_config.as_dict()), time_limit, now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        self.executor.submit(self._drain)
+        return job_id
+
+    def status(self, job_id):
+        """
+        The job as a dict (id, status, stage, phase, elapsed seconds since
+        submission, error), or None for an unknown id.
+        """
+        db = self._connect()
+        try:
+            row = db.execute("SELECT id, status, stage, phase, submitted, finished, error FROM jobs WHERE id = ?",
+                             (job_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        job_id, status, stage, phase, submitted, finished, error = row
+        return {'id': job_id, 'status': status, 'stage': stage, 'phase': phase,
+                'elapsed': (finished or time.time()) - submitted, 'error': error}
+
+    def result(self, job_id):
+        """
+        The solver reports and lab matching table of a finished job, and whether
+        they came from the cache, or None.
+        """
+        db = self._connect()
+        try:
+            row = db.execute("SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        result = json.loads(row[0])
+        return {'reports': result['reports'], 'table': pd.read_csv(io.StringIO(result['table'])),
+                'cached': result['cached']}
+
+    def _claim(self):
+        """Mark the oldest queued job running and return it, None if there is none or another job runs."""
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("UPDATE jobs SET status = 'failed', finished = ?, error = 'worker stopped' "
+                       "WHERE status = 'running' AND updated < ?", (now, now - JOB_LEASE))
+            if db.execute("SELECT 1 FROM jobs WHERE status = 'running'").fetchone() is not None:
+                db.execute("COMMIT")
+                return None
+            row = db.execute("SELECT id, key, settings, time_limit FROM jobs WHERE status = 'queued' "
+                             "ORDER BY submitted LIMIT 1").fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'running', started = ?, updated = ? WHERE id = ?",
+                           (now, now, row[0]))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+        return row
+
+    def _update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        db = self._connect()
+        try:
+            db.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                       (*fields.values(), job_id))
+        finally:
+            db.close()
+
+    def _drain(self):
+        """Run queued jobs until there is none this process may claim."""
+        while True:
+            row = self._claim()
+            if row is None:
+                return
+            job_id, key, settings, time_limit = row
+            solver_config = SolverConfig(**json.loads(settings))
+            try:
+                result = None if self.cache is None else self.cache.get(key)
+                cached = result is not None
+                if not cached:
+                    result = self.run(solver_config, time_limit,
+                                      lambda stage, phase: self._update(job_id, stage=stage, phase=phase))
+                self.save(result)
+            except Exception as e:
+                self._update(job_id, status='failed', finished=time.time(), error=str(e))
+                continue
+            if self.cache is not None and not cached:
+                try:
+                    self.cache.put(key, result)
+                except Exception as e:
+                    # The run is saved all the same; only a later identical submission solves again
+                    print(f"Result of job {job_id} not cached: {e}")
+            self._update(job_id, status='done', phase=None, finished=time.time(),
+                         result=_job_result(result, cached=cached))
+
+
+def _job_result(result, cached=False):
+    return json.dumps({'reports': result['reports'], 'table': result['lab_table'].to_csv(index=False),
+                       'cached': cached}, default=json_default)
@@ -0,0 +1,267 @@
+import numpy as np
+import pandas as pd
+
+# Integer-coded, array-backed representation of a matching run.
+#
+# Students, courses and lab sections get dense integer ids (their position in
+# the arrays below); the raw ids of the CSVs are only used again when the
+# results table is written. Per-student lists are stored in CSR form:
+# for student i the entries live at indptr[i]:indptr[i + 1].
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_time(value):
+    """
+    Convert a time of day to minutes since midnight.
+    Accepts 'HH:MM' / 'HH:MM:SS' strings (as in the CSVs) or a bare number of hours.
+    Raises ValueError for anything else.
+    """
+    parts = str(value).strip().split(':')
+    if len(parts) == 1:
+        return int(float(parts[0]) * 60)
+    if len(parts) > 3:
+        raise ValueError(f"Invalid time: {value}")
+    hours, minutes = int(parts[0]), int(parts[1])
+    return hours * 60 + minutes
+
+
+def minute_of_week(days, times):
+    """
+    Minute-of-week for each (id_day, time) pair, -1 where the day or time is invalid.
+    """
+    result = np.full(len(days), -1, dtype=np.int64)
+    for i, (day, time) in enumerate(zip(days, times)):
+        try:
+            result[i] = (int(day) - 1) * MINUTES_PER_DAY + parse_time(time)
+        except (ValueError, TypeError):
+            pass
+    return result
+
+
+def interval_mask(start, end):
+    """Bitmask of the minutes [start, end) of the week, 0 for an invalid interval."""
+    if start < 0 or end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+def utility_from_rank(ranks):
+    """Utility max(10 - rank, 1) for every ranked entry, 0 where rank is 0 (unranked)."""
+    ranks = np.asarray(ranks)
+    return np.where(ranks > 0, np.maximum(10 - ranks.astype(np.int64), 1), 0)
+
+
+def _csr_indptr(rows, n_rows):
+    """indptr of a CSR structure whose entries are sorted by row."""
+    return np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_rows)))).astype(np.int64)
+
+
+class MatchingInstance:
+    """
+    Compiled input of one matching stage.
+
+    Course stage (from_course_data):
+        student_ids, student_names, student_program, required_electives
+        course_ids, course_names, course_mandatory, course_has_lab
+        program_mandatory, program_electives
+                            program_id -> course list, in course.csv order
+        capacity            elective seats per course, -1 when the course has no capacity row
+        pref_indptr, pref_course, pref_rank
+                            sparse preference-rank matrix, each student's row sorted by rank
+        elig_indptr, elig_course, elig_mandatory, elig_rank
+                            eligible (student, course) pairs, mandatory courses first
+        pair_student        student of every eligible pair
+        elective_types()    students grouped by identical elective choice
+
+    Lab stage (from_lab_data):
+        student_ids, student_names, course_* as above
+        enroll_student, enroll_course
+                            rows of the course matching
+        section_lab_id, section_course, section_lab, section_capacity,
+        section_start, section_end
+                            lab sections with minute-of-week times (-1 if invalid)
+        theory_course, theory_start, theory_end
+                            theory sessions
+        cand_indptr, cand_section, cand_rank
+                            labs each enrollment can be assigned, in lab_time order
+        cand_enrollment, cand_student
+                            enrollment and student of every candidate
+        max_lab_rank        highest rank in the lab preferences
+    """
+
+    def _set_courses(self, course_data):
+        courses = course_data.drop_duplicates('course_id')
+        self.course_ids = courses['course_id'].to_numpy()
+        self.course_names = courses['course_name'].to_numpy(dtype=object)
+        self.course_mandatory = courses['mandatory'].to_numpy() == 1
+        self.course_has_lab = courses['has_lab'].to_numpy() == 1
+        self.course_index = pd.Index(self.course_ids)
+
+        # A course listed under several programs belongs to each of them
+        self.program_mandatory = {}
+        self.program_electives = {}
+        rows = self.course_index.get_indexer(course_data['course_id'])
+        for c, program_id, mandatory in zip(rows, course_data['program_id'], course_data['mandatory']):
+            target = self.program_mandatory if mandatory == 1 else self.program_electives
+            target.setdefault(program_id, []).append(int(c))
+
+    @property
+    def num_students(self):
+        return len(self.student_ids)
+
+    @property
+    def num_courses(self):
+        return len(self.course_ids)
+
+    @classmethod
+    def from_course_data(cls, course_data, student_data, elective_capacity_data, elective_preference_data):
+        """
+        Compile the course stage from the frames returned by load_data_first.
+
+        Eligible pairs are every mandatory course of the student's program plus
+        the program electives the student ranked; a student who ranked fewer
+        electives than required keeps the whole elective list of the program.
+        A course ranked more than once keeps its best rank.
+        """
+        instance = cls()
+        instance._set_courses(course_data)
+        instance.student_ids = student_data['student_id'].to_numpy()
+        instance.student_names = student_data['name'].to_numpy(dtype=object)
+        instance.student_program = student_data['program_id'].to_numpy()
+        instance.required_electives = student_data['required_electives'].to_numpy().astype(np.int64)
+        student_index = pd.Index(instance.student_ids)
+        n_students, n_courses = instance.num_students, instance.num_courses
+
+        # Capacity array
+        instance.capacity = np.full(n_courses, -1, dtype=np.int64)
+        course_rows = instance.course_index.get_indexer(elective_capacity_data['course_id'])
+        known = course_rows >= 0
+        instance.capacity[course_rows[known]] = elective_capacity_data['capacity'].to_numpy()[known]
+
+        # Sparse preference-rank matrix, best rank per (student, course)
+        prefs = pd.DataFrame({
+            'student': student_index.get_indexer(elective_preference_data['student_id']),
+            'course': instance.course_index.get_indexer(elective_preference_data['course_id']),
+            'rank': elective_preference_data['preference_rank'].to_numpy(),
+        })
+        prefs = prefs[(prefs['student'] >= 0) & (prefs['course'] >= 0)]
+        prefs = (prefs.sort_values(['student', 'rank'], kind='stable')
+                 .drop_duplicates(['student', 'course']))
+        instance.pref_indptr = _csr_indptr(prefs['student'].to_numpy(), n_students)
+        instance.pref_course = prefs['course'].to_numpy().astype(np.int32)
+        instance.pref_rank = prefs['rank'].to_numpy().astype(np.int32)
+
+        # Eligibility, per student: mandatory courses then electives, in course.csv order
+        elig_course, elig_rank, elig_mandatory, counts = [], [], [], []
+        for i in range(n_students):
+            start, end = instance.pref_indptr[i], instance.pref_indptr[i + 1]
+            ranks = dict(zip(instance.pref_course[start:end].tolist(), instance.pref_rank[start:end].tolist()))
+            program = instance.student_program[i]
+            mandatory = instance.program_mandatory.get(program, [])
+            electives = instance.program_electives.get(program, [])
+            ranked = [c for c in electives if c in ranks]
+            if len(ranked) < instance.required_electives[i]:
+                ranked = electives
+            courses = mandatory + ranked
+            elig_course.extend(courses)
+            elig_rank.extend(ranks.get(c, 0) for c in courses)
+            elig_mandatory.extend([True] * len(mandatory) + [False] * len(ranked))
+            counts.append(len(courses))
+
+        instance.elig_indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        instance.elig_course = np.array(elig_course, dtype=np.int32)
+        instance.elig_rank = np.array(elig_rank, dtype=np.int32)
+        instance.elig_mandatory = np.array(elig_mandatory, dtype=bool)
+        instance.pair_student = np.repeat(np.arange(n_students, dtype=np.int32), counts)
+        return instance
+
+    def elective_types(self):
+        """
+        Group students with the same elective choice into types: same number of
+        required electives and the same eligible electives with the same ranks.
+        Returns the type of every student and the first student of every type.
+        """
+        types = {}
+        student_type = np.empty(self.num_students, dtype=np.int64)
+        for i in range(self.num_students):
+            start, end = self.elig_indptr[i], self.elig_indptr[i + 1]
+            electives = ~self.elig_mandatory[start:end]
+            key = (int(self.required_electives[i]),
+                   self.elig_course[start:end][electives].tobytes(),
+                   self.elig_rank[start:end][electives].tobytes())
+            student_type[i] = types.setdefault(key, len(types))
+        first = np.full(len(types), self.num_students, dtype=np.int64)
+        np.minimum.at(first, student_type, np.arange(self.num_students))
+        return student_type, first
+
+    @property
+    def pair_utility(self):
+        """Utility of every eligible pair, 0 for unranked courses."""
+        return utility_from_rank(self.elig_rank)
+
+    @classmethod
+    def from_lab_data(cls, student_course_matching, lab_time_data, pre_lab_ele_man_data, theory_time_data,
+                      course_data):
+        """
+        Compile the lab stage from the frames returned by load_data_second.
+        Candidates are the sections of every enrolled course with has_lab == 1;
+        a lab ranked more than once keeps its best rank.
+        """
+        instance = cls()
+        instance._set_courses(course_data)
+
+        # Students and enrollments, in course matching order
+        instance.student_ids = student_course_matching['student_id'].unique()
+        student_index = pd.Index(instance.student_ids)
+        instance.student_names = (student_course_matching.groupby('student_id', sort=False)['student_name']
+                                  .first().reindex(instance.student_ids).to_numpy(dtype=object))
+        instance.enroll_student = student_index.get_indexer(student_course_matching['student_id']).astype(np.int32)
+        instance.enroll_course = instance.course_index.get_indexer(student_course_matching['course_id']).astype(np.int32)
+
+        # Lab sections
+        sections = lab_time_data.drop_duplicates(['course_id', 'lab'])
+        instance.section_lab_id = (sections['course_id'].astype(str) + '-' + sections['lab'].astype(str)).to_numpy(dtype=object)
+        instance.section_course = instance.course_index.get_indexer(sections['course_id']).astype(np.int32)
+        instance.section_lab = sections['lab'].to_numpy()
+        instance.section_capacity = sections['capacity'].to_numpy().astype(np.int64)
+        instance.section_start = minute_of_week(sections['id_day'], sections['start_time'])
+        instance.section_end = minute_of_week(sections['id_day'], sections['end_time'])
+
+        # Theory sessions
+        instance.theory_course = instance.course_index.get_indexer(theory_time_data['course_id']).astype(np.int32)
+        instance.theory_start = minute_of_week(theory_time_data['id_day'], theory_time_data['start_time'])
+        instance.theory_end = minute_of_week(theory_time_data['id_day'], theory_time_data['end_time'])
+
+        # Candidates: every section of every enrolled course with labs (first row per student and course)
+        enrollments = pd.DataFrame({'enrollment': np.arange(len(instance.enroll_student)),
+                                    'student_id': student_course_matching['student_id'].to_numpy(),
+                                    'course_id': student_course_matching['course_id'].to_numpy(),
+                                    'course': instance.enroll_course})
+        enrollments = enrollments[enrollments['course'] >= 0]
+        enrollments = enrollments[instance.course_has_lab[enrollments['course']]]
+        enrollments = enrollments.drop_duplicates(['student_id', 'course_id'])
+        section_table = pd.DataFrame({'course_id': sections['course_id'].to_numpy(),
+                                      'lab': instance.section_lab,
+                                      'section': np.arange(len(sections))})
+        candidates = enrollments.merge(section_table, on='course_id')
+
+        ranks = (pre_lab_ele_man_data.groupby(['student_id', 'course_id', 'lab'])['preference_rank'].min()
+                 .rename('rank').reset_index())
+        candidates = candidates.merge(ranks, on=['student_id', 'course_id', 'lab'], how='left')
+        candidates = candidates.sort_values(['enrollment', 'section'], kind='stable')
+
+        n_enrollments = len(instance.enroll_student)
+        instance.cand_enrollment = candidates['enrollment'].to_numpy().astype(np.int32)
+        instance.cand_indptr = _csr_indptr(instance.cand_enrollment, n_enrollments)
+        instance.cand_section = candidates['section'].to_numpy().astype(np.int32)
+        instance.cand_rank = candidates['rank'].fillna(0).to_numpy().astype(np.int32)
+        instance.cand_student = instance.enroll_student[instance.cand_enrollment]
+        instance.max_lab_rank = (int(pre_lab_ele_man_data['preference_rank'].max())
+                                 if len(pre_lab_ele_man_data) else 5)
+        return instance
+
+    @property
+    def cand_utility(self):
+        """Utility of every lab candidate, 0 for unranked labs."""
+        return utility_from_rank(self.cand_rank)
@@ -0,0 +1,147 @@
+import heapq
+from collections import deque
+
+# Min-cost flow solver used by the 'flow' course matching engine.
+#
+# Primal-dual successive shortest paths:
+# 1. Dijkstra on reduced costs (cost + pi[u] - pi[v]) from the source
+# 2. Update the node potentials pi with the (capped) shortest distances
+# 3. Push a maximum flow through the admissible arcs (reduced cost 0) with
+#    Dinic level graphs, i.e. along every shortest path at once
+# 4. Repeat until the sink can no longer be reached
+#
+# Costs must be non-negative integers. With small integer costs (the matching
+# utilities are 1..9) the number of Dijkstra phases stays small, so the whole
+# solve is a handful of O(E log V) passes.
+
+
+class MinCostFlow:
+    def __init__(self, num_nodes):
+        """
+        Create an empty flow network with nodes 0 .. num_nodes - 1.
+        """
+        self.num_nodes = num_nodes
+        self.graph = [[] for _ in range(num_nodes)]  # node -> outgoing arc ids
+        self.to = []  # arc id -> head node
+        self.cap = []  # arc id -> residual capacity
+        self.cost = []  # arc id -> cost per unit
+
+    def add_edge(self, u, v, capacity, cost):
+        """
+        Add an arc u -> v and return its id. Arc id ^ 1 is the reverse arc.
+        """
+        if cost < 0:
+            raise ValueError("MinCostFlow requires non-negative arc costs")
+        arc_id = len(self.to)
+        self.graph[u].append(arc_id)
+        self.to.append(v)
+        self.cap.append(capacity)
+        self.cost.append(cost)
+        self.graph[v].append(arc_id + 1)
+        self.to.append(u)
+        self.cap.append(0)
+        self.cost.append(-cost)
+        return arc_id
+
+    def flow(self, arc_id):
+        """
+        Flow currently sent through the forward arc arc_id.
+        """
+        return self.cap[arc_id ^ 1]
+
+    def solve(self, source, sink):
+        """
+        Send the maximum flow from source to sink at minimum cost.
+        Returns (total_flow, total_cost).
+        """
+        graph, to, cap, cost = self.graph, self.to, self.cap, self.cost
+        n = self.num_nodes
+        potential = [0] * n
+        total_flow = 0
+        total_cost = 0
+
+        while True:
+            # 1. Dijkstra on reduced costs, stopped once the sink is settled
+            dist = [None] * n
+            dist[source] = 0
+            heap = [(0, source)]
+            done = [False] * n
+            while heap:
+                d, u = heapq.heappop(heap)
+                if done[u]:
+                    continue
+                done[u] = True
+                if u == sink:
+                    break
+                pu = potential[u]
+                for e in graph[u]:
+                    if cap[e] > 0:
+                        v = to[e]
+                        if done[v]:
+                            continue
+                        nd = d + cost[e] + pu - potential[v]
+                        if dist[v] is None or nd < dist[v]:
+                            dist[v] = nd
+                            heapq.heappush(heap, (nd, v))
+            if not done[sink]:
+                break
+
+            # 2. Potentials: capping at dist[sink] keeps every reduced cost >= 0
+            dist_sink = dist[sink]
+            for v in range(n):
+                d = dist[v]
+                potential[v] += dist_sink if d is None or d > dist_sink else d
+
+            # 3. Max flow over the admissible (zero reduced cost) arcs
+            while True:
+                level = [-1] * n
+                level[source] = 0
+                queue = deque([source])
+                while queue:
+                    u = queue.popleft()
+                    pu = potential[u]
+                    for e in graph[u]:
+                        v = to[e]
+                        if cap[e] > 0 and level[v] < 0 and cost[e] + pu - potential[v] == 0:
+                            level[v] = level[u] + 1
+                            queue.append(v)
+                if level[sink] < 0:
+                    break
+
+                pointer = [0] * n
+                path = []
+                u = source
+                while True:
+                    if u == sink:
+                        pushed = min(cap[e] for e in path)
+                        for e in path:
+                            cap[e] -= pushed
+                            cap[e ^ 1] += pushed
+                            total_cost += pushed * cost[e]
+                        total_flow += pushed
+                        path = []
+                        u = source
+                        continue
+                    arcs = graph[u]
+                    advanced = False
+                    while pointer[u] < len(arcs):
+                        e = arcs[pointer[u]]
+                        v = to[e]
+                        if (cap[e] > 0 and level[v] == level[u] + 1
+                                and cost[e] + potential[u] - potential[v] == 0):
+                            path.append(e)
+                            u = v
+                            advanced = True
+                            break
+                        pointer[u] += 1
+                    if advanced:
+                        continue
+                    # Dead end: drop u from this level graph and step back
+                    level[u] = -1
+                    if not path:
+                        break
+                    e = path.pop()
+                    u = to[e ^ 1]
+                    pointer[u] += 1
+
+        return total_flow, total_cost
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from snapshot import PREFERENCE_DTYPES, read_table
+from student_registry import STUDENT_CSV, locked
+
+# Bulk upload of elective and lab preferences.
+#
+# An uploaded CSV is read in chunks of CHUNK_ROWS rows, so memory stays bounded
+# whatever its size. Each chunk is validated as a whole against the student
+# roster (the student and their program) and the course and lab catalogs;
+# accepted rows are written to a temporary file in the column order of the
+# target CSV, and appended to it at the end under an exclusive lock (see
+# student_registry), so readers see all of an upload or none of it. Rejected rows are counted by reason and the first
+# MAX_REJECTED_ROWS of them are returned with their line number.
+
+CHUNK_ROWS = 100_000
+MAX_REJECTED_ROWS = 100
+
+PREFERENCE_FILES = {
+    'elective': 'backend/elective_preference.csv',
+    'lab': 'backend/pre_lab_ele_man.csv',
+}
+PREFERENCE_COLUMNS = {
+    'elective': ['student_id', 'program_id', 'course_id', 'preference_rank'],
+    'lab': ['student_id', 'program_id', 'course_id', 'lab', 'preference_rank'],
+}
+
+
+# Rejection reasons by code; code 0 accepts the row
+REASONS = [None, "missing or non-integer value", "unknown student_id", "preference_rank below 1",
+           "value out of range (int32 ids, int8 ranks)", "program_id is not the student's program"]
+CATALOG_REASONS = {
+    'elective': "course_id is not an elective of program_id",
+    'lab': "no such (course_id, lab) section",
+}
+
+
+def _pair_keys(first, second):
+    """One int64 per id pair, for a single np.isin against a catalog of pairs."""
+    return (np.asarray(first, dtype=np.int64) << 32) + np.asarray(second, dtype=np.int64)
+
+
+def _catalogs(kind):
+    """
+    Valid ids of the upload: students, their (student, program) pairs in the
+    roster, and electives (course, program) or lab sections (course, lab).
+    """
+    student_data = read_table(STUDENT_CSV)
+    students = student_data['student_id'].to_numpy(dtype=np.int64)
+    roster = _pair_keys(students, student_data['program_id'])
+    if kind == 'elective':
+        course_data = read_table('backend/course.csv')
+        electives = course_data[course_data['mandatory'] == 0]
+        return students, roster, _pair_keys(electives['course_id'], electives['program_id'])
+    lab_time_data = read_table('backend/lab_time.csv')
+    return students, roster, _pair_keys(lab_time_data['course_id'], lab_time_data['lab'])
+
+
+def _as_integers(chunk, columns):
+    """
+    The columns of the chunk as int64, with the rows holding a missing or
+    non-integer value flagged. Columns the parser already read as integers are
+    taken as they are; only the others are coerced value by value.
+    """
+    values = np.zeros((len(chunk), len(columns)), dtype=np.int64)
+    invalid = np.zeros(len(chunk), dtype=bool)
+    for i, col in enumerate(columns):
+        column = chunk[col]
+        if column.dtype.kind in 'iu':
+            values[:, i] = column.to_numpy()
+            continue
+        if column.dtype == object:
+            column = pd.to_numeric(column.str.strip(), errors='coerce')
+        numbers = column.to_numpy(dtype=np.float64)
+        whole = np.isfinite(numbers) & (np.floor(numbers) == numbers)
+        invalid |= ~whole
+        # Clipped so that huge numbers stay out of range instead of wrapping around
+        values[whole, i] = np.clip(numbers[whole], -2 ** 62, 2 ** 62)
+    return values, invalid
+
+
+def _validate(values, invalid, kind, students, roster, catalog):
+    """Reason code of each row (see REASONS, 6: not in the catalog), 0 for accepted rows."""
+    columns = PREFERENCE_COLUMNS[kind]
+    column = {name: values[:, i] for i, name in enumerate(columns)}
+    codes = np.zeros(len(values), dtype=np.int8)
+
+    def reject(mask, code):
+        codes[mask & (codes == 0)] = code
+
+    reject(invalid, 1)
+    # The matching reads preferences in these compact dtypes (see snapshot.read_preferences)
+    for name in columns:
+        limits = np.iinfo(PREFERENCE_DTYPES[name])
+        reject((column[name] < limits.min) | (column[name] > limits.max), 4)
+    reject(~np.isin(column['student_id'], students), 2)
+    reject(~np.isin(_pair_keys(column['student_id'], column['program_id']), roster), 5)
+    second = column['program_id'] if kind == 'elective' else column['lab']
+    reject(~np.isin(_pair_keys(column['course_id'], second), catalog), 6)
+    reject(column['preference_rank'] < 1, 3)
+    return codes
+
+
+def ingest_preferences(stream, kind, path=None, chunk_rows=CHUNK_ROWS):
+    """
+    Validate the preferences CSV read from stream and append the valid rows to
+    the preference file of kind ('elective' or 'lab'), or to path.
+    Returns a summary: rows accepted and rejected, rejected rows by reason, and
+    up to MAX_REJECTED_ROWS rejected rows (with their line number in the upload).
+    Raises ValueError if the upload lacks a required column.
+    """
+    if kind not in PREFERENCE_FILES:
+        raise ValueError(f"Unknown preference kind '{kind}', expected one of {sorted(PREFERENCE_FILES)}")
+    columns = PREFERENCE_COLUMNS[kind]
+    target = path or PREFERENCE_FILES[kind]
+    with open(target, 'rb') as f:
+        header = f.readline()
+    target_columns = [name.strip() for name in header.decode().rstrip('\r\n').split(',')]
+    # Appended lines end like the existing ones
+    line_end = '\r\n' if header.endswith(b'\r\n') else '\n'
+    students, roster, catalog = _catalogs(kind)
+
+    reason_names = REASONS + [CATALOG_REASONS[kind]]
+    accepted = 0
+    rejected = 0
+    reasons = {}
+    rejected_rows = []
+    staging = tempfile.NamedTemporaryFile('w+', suffix='.csv', newline='', delete=False,
+                                          dir=os.path.dirname(target))
+    try:
+        for chunk in pd.read_csv(stream, chunksize=chunk_rows, skipinitialspace=True):
+            chunk.columns = chunk.columns.str.strip()
+            missing = [name for name in columns if name not in chunk.columns]
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(missing)}")
+            values, invalid = _as_integers(chunk, columns)
+            codes = _validate(values, invalid, kind, students, roster, catalog)
+            ok = codes == 0
+            accepted += int(ok.sum())
+            rejected += int((~ok).sum())
+            for code, count in zip(*np.unique(codes[~ok], return_counts=True)):
+                reasons[reason_names[code]] = reasons.get(reason_names[code], 0) + int(count)
+            if len(rejected_rows) < MAX_REJECTED_ROWS and not ok.all():
+                bad = np.flatnonzero(~ok)[:MAX_REJECTED_ROWS - len(rejected_rows)]
+                sample = chunk.iloc[bad][columns].assign(reason=[reason_names[code] for code in codes[bad]])
+                # Line 1 is the header
+                sample.insert(0, 'line', chunk.index[bad] + 2)
+                rejected_rows.extend(sample.to_dict('records'))
+            rows = pd.DataFrame(values[ok], columns=columns)
+            # One write per chunk rather than one per row
+            staging.write(rows.reindex(columns=target_columns).to_csv(header=False, index=False,
+                                                                      lineterminator=line_end))
+        staging.close()
+
+        if accepted:
+            with open(target, 'a+b') as out, locked(out):
+                if out.seek(0, os.SEEK_END) > 0:
+                    out.seek(-1, os.SEEK_END)
+                    if out.read(1) != b'\n':
+                        out.write(line_end.encode())
+                with open(staging.name, 'rb') as rows:
+                    shutil.copyfileobj(rows, out, 1024 * 1024)
+                out.flush()
+                os.fsync(out.fileno())
+    finally:
+        staging.close()
+        os.remove(staging.name)
+    return {'accepted': accepted, 'rejected': rejected, 'reasons': reasons,
+            'rejected_rows': pd.DataFrame(rejected_rows, columns=['line', *columns, 'reason'])}
@@ -0,0 +1,101 @@
+from collections import deque
+import numpy as np
+
+# Presolve for the binary programs of the 'ilp' engines.
+#
+# A model is a list of rows (name, variables, sense, rhs): the sum of the listed
+# binary variables is == rhs (sense '=') or <= rhs (sense '<'). The reductions
+# below are applied until none is left:
+# 1. A row whose remaining right-hand side is 0 fixes its free variables to 0
+# 2. An '=' row with exactly rhs free variables fixes them to 1
+# 3. A '<' row whose free variables cannot exceed the right-hand side is dropped
+#    (an uncontested capacity)
+# 4. An '=' row whose free variables appear in no other row is decoupled from
+#    the model: its rhs best variables (by objective) are fixed to 1, the rest to 0
+# Rows left without free variables are dropped. Fixing a variable updates the
+# remaining right-hand side of every row it appears in.
+
+
+def presolve(n_vars, rows, objective):
+    """
+    Presolve a maximization over n_vars binary variables.
+    Returns (fixed, rows, stats): fixed holds 0/1 for fixed variables and -1 for
+    free ones; rows are the remaining rows over free variables only, with their
+    right-hand sides reduced; stats counts the variables and rows before and
+    after. fixed and rows are None if the presolve proves the model infeasible.
+    """
+    objective = np.asarray(objective)
+    fixed = np.full(n_vars, -1, dtype=np.int8)
+    variables = [np.asarray(row[1], dtype=np.int64) for row in rows]
+    sense = [row[2] for row in rows]
+    rhs = [int(row[3]) for row in rows]
+    free = [len(row_vars) for row_vars in variables]
+    active = [True] * len(rows)
+    var_rows = [[] for _ in range(n_vars)]
+    for r, row_vars in enumerate(variables):
+        for j in row_vars.tolist():
+            var_rows[j].append(r)
+    n_active = [len(var_row) for var_row in var_rows]  # active rows per free variable
+    queue = deque(range(len(rows)))
+    queued = [True] * len(rows)
+
+    def push(r):
+        if active[r] and not queued[r]:
+            queued[r] = True
+            queue.append(r)
+
+    def fix(j, value):
+        fixed[j] = value
+        for r in var_rows[j]:
+            if active[r]:
+                free[r] -= 1
+                rhs[r] -= value
+                push(r)
+
+    def drop(r):
+        active[r] = False
+        for j in variables[r].tolist():
+            if fixed[j] < 0:
+                n_active[j] -= 1
+                if n_active[j] == 1:
+                    for other in var_rows[j]:
+                        push(other)
+
+    def stats():
+        return {'variables': n_vars, 'rows': len(rows),
+                'fixed_variables': int(np.count_nonzero(fixed >= 0)),
+                'dropped_rows': len(rows) - sum(active)}
+
+    while queue:
+        r = queue.popleft()
+        queued[r] = False
+        if not active[r]:
+            continue
+        if rhs[r] < 0 or (sense[r] == '=' and rhs[r] > free[r]):
+            return None, None, stats()
+        if free[r] == 0:
+            drop(r)
+            continue
+        free_vars = [j for j in variables[r].tolist() if fixed[j] < 0]
+        if rhs[r] == 0:
+            for j in free_vars:
+                fix(j, 0)
+        elif sense[r] == '=' and rhs[r] == free[r]:
+            for j in free_vars:
+                fix(j, 1)
+        elif sense[r] == '<' and free[r] <= rhs[r]:
+            drop(r)
+        elif sense[r] == '=' and all(n_active[j] == 1 for j in free_vars):
+            best = sorted(free_vars, key=lambda j: -objective[j])
+            chosen = set(best[:rhs[r]])
+            for j in best:
+                fix(j, 1 if j in chosen else 0)
+
+    # Variables outside every remaining row take their best value
+    for j in np.flatnonzero(fixed < 0).tolist():
+        if n_active[j] == 0:
+            fixed[j] = 1 if objective[j] > 0 else 0
+
+    remaining = [(rows[r][0], [j for j in variables[r].tolist() if fixed[j] < 0], sense[r], rhs[r])
+                 for r in range(len(rows)) if active[r]]
+    return fixed, remaining, stats()
@@ -0,0 +1,111 @@
+import hashlib
+import io
+import json
+import sqlite3
+import time
+import pandas as pd
+from snapshot import INPUT_CSVS, read_table
+
+# Content-addressed cache of matching results.
+#
+# A run is keyed on a fingerprint of its normalized inputs (every backend CSV
+# both stages read, with the whitespace stripping of load_data_first and
+# load_data_second) and its solver settings. The course and lab matching tables
+# and the solver reports are stored under that key, in a table of the jobs'
+# SQLite file, so every app process shares them. Changing the data (a student
+# added by /demo, new preferences) changes the key: stale results are never
+# served, they only age out. Least recently used entries are evicted beyond
+# max_entries or max_bytes of stored tables.
+
+RESULTS_DB = 'matching_jobs.db'
+CACHE_MAX_ENTRIES = 32
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    reports TEXT NOT NULL,
+    course_table TEXT NOT NULL,
+    lab_table TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+
+def input_fingerprint(solver_config, time_limit=None, paths=INPUT_CSVS):
+    """
+    Hash of the normalized input tables and the solver settings of a run.
+    Formatting that the loaders discard (spacing, quoting, line endings) does
+    not change it; row order does, as it can change the matching.
+    """
+    digest = hashlib.sha256(f"{solver_config!r} time_limit={time_limit}".encode())
+    for path in paths:
+        df = read_table(path)
+        digest.update(f"{path}\0{list(df.columns)}\0{list(df.dtypes.astype(str))}\0".encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def json_default(value):
+    """numpy scalars as plain numbers (solver reports)."""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class ResultCache:
+    def __init__(self, path=RESULTS_DB, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def get(self, key):
+        """The cached result (reports, course_table, lab_table) under key, or None."""
+        db = self._connect()
+        try:
+            row = db.execute("SELECT reports, course_table, lab_table FROM results WHERE key = ?",
+                             (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        finally:
+            db.close()
+        reports, course_table, lab_table = row
+        return {'reports': json.loads(reports),
+                'course_table': pd.read_csv(io.StringIO(course_table)),
+                'lab_table': pd.read_csv(io.StringIO(lab_table))}
+
+    def put(self, key, result):
+        """Store a result under key, then evict the least recently used entries beyond the bounds."""
+        reports = json.dumps(result['reports'], default=json_default)
+        course_table = result['course_table'].to_csv(index=False)
+        lab_table = result['lab_table'].to_csv(index=False)
+        size = len(reports) + len(course_table) + len(lab_table)
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR REPLACE INTO results (key, reports, course_table, lab_table, size, last_used) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", (key, reports, course_table, lab_table, size, time.time()))
+            db.execute("""
+                DELETE FROM results WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key,
+                               SUM(size) OVER (ORDER BY last_used DESC, key) AS total,
+                               ROW_NUMBER() OVER (ORDER BY last_used DESC, key) AS n
+                        FROM results)
+                    WHERE total > ? OR n > ?)""", (self.max_bytes, self.max_entries))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
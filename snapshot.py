@@ -0,0 +1,256 @@
+import contextlib
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from student_registry import locked, read_csv_shared
+
+# Columnar snapshots of the input CSVs.
+#
+# A snapshot of backend/<name>.csv is the directory backend/snapshot/<name>/:
+# one .npy file per column plus a columns.json listing them in order, with the
+# size and modification time the CSV had when it was read for the import. Column
+# names and string values are stripped once at import, so the loaders' clean-up
+# has nothing left to do. Numeric columns keep the dtype pandas parsed at import;
+# string columns are dictionary-encoded as int32 codes into a categories array.
+# Numeric columns are memory-mapped on load; strings are decoded with one take.
+#
+# read_table uses the snapshot only while the CSV still has that size and
+# modification time, so an edited CSV (a student added by /demo, even during the
+# import) is read directly until the next import.
+#
+# The preference tables, the only inputs that grow with students x courses, are
+# read by read_preferences instead: chunk by chunk, with declared compact dtypes
+# (int32 ids, int8 ranks), keeping each preference once with its best rank as it
+# goes, so a large export never sits in memory as parsed int64 or text columns.
+#
+#   python snapshot.py [csv ...]    (default: every input CSV of both stages)
+
+SNAPSHOT_DIR = 'backend/snapshot'
+
+# Every file read by load_data_first and load_data_second, except the course
+# matching the lab stage reads back
+INPUT_CSVS = ('backend/course.csv', 'backend/student.csv', 'backend/elective_capacity.csv',
+              'backend/elective_preference.csv', 'backend/lab_time.csv', 'backend/day.csv',
+              'backend/pre_lab_ele_man.csv', 'backend/theory_time.csv')
+
+# Compact dtypes of the preference tables
+PREFERENCE_DTYPES = {'student_id': np.int32, 'program_id': np.int32, 'course_id': np.int32, 'lab': np.int32,
+                     'preference_rank': np.int8}
+CHUNK_ROWS = 1_000_000
+
+
+def snapshot_path(csv_path, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, os.path.splitext(os.path.basename(csv_path))[0])
+
+
+def normalize(df):
+    """Strip column names and the values of string columns, as the loaders do."""
+    df.columns = df.columns.str.strip()
+    for col in df.select_dtypes(include=['object']).columns:
+        df[col] = df[col].str.strip()
+    return df
+
+
+def write_snapshot(csv_path, snapshot_dir=SNAPSHOT_DIR):
+    """Import a CSV into its snapshot directory; returns the directory."""
+    # Stat and read under one shared lock: the snapshot is of exactly the file that was stat'ed
+    with open(csv_path, 'rb') as f, locked(f, exclusive=False):
+        source = os.fstat(f.fileno())
+        df = normalize(pd.read_csv(f))
+    path = snapshot_path(csv_path, snapshot_dir)
+    os.makedirs(path, exist_ok=True)
+    columns = []
+    for i, col in enumerate(df.columns):
+        if df[col].dtype == object:
+            codes, categories = pd.factorize(df[col], use_na_sentinel=True)
+            np.save(os.path.join(path, f"{i}.npy"), codes.astype(np.int32))
+            np.save(os.path.join(path, f"{i}.categories.npy"), categories.to_numpy().astype(str))
+            columns.append({'name': col, 'kind': 'string'})
+        else:
+            np.save(os.path.join(path, f"{i}.npy"), df[col].to_numpy())
+            columns.append({'name': col, 'kind': 'numeric'})
+    # Written last: a snapshot without its column list is incomplete and ignored
+    with open(os.path.join(path, 'columns.json'), 'w') as f:
+        json.dump({'source': {'size': source.st_size, 'mtime_ns': source.st_mtime_ns}, 'columns': columns}, f)
+    return path
+
+
+def read_snapshot(path):
+    with open(os.path.join(path, 'columns.json')) as f:
+        columns = json.load(f)['columns']
+    data = {}
+    for i, column in enumerate(columns):
+        values = np.load(os.path.join(path, f"{i}.npy"), mmap_mode='r')
+        if column['kind'] == 'string':
+            categories = np.load(os.path.join(path, f"{i}.categories.npy")).astype(object)
+            # Code -1 is a missing value
+            data[column['name']] = np.append(categories, np.nan).take(values)
+        else:
+            data[column['name']] = np.asarray(values)  # a plain ndarray view of the mapped file
+    return pd.DataFrame(data, copy=False)
+
+
+def _is_current(csv_path, snapshot_dir):
+    """Whether the snapshot of csv_path is complete and of the CSV as it is now."""
+    columns_file = os.path.join(snapshot_path(csv_path, snapshot_dir), 'columns.json')
+    if not os.path.exists(columns_file):
+        return False
+    with open(columns_file) as f:
+        source = json.load(f)
+    # A bare column list is an import from before the source was recorded
+    if not isinstance(source, dict):
+        return False
+    stat = os.stat(csv_path)
+    return source['source'] == {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_table(csv_path, snapshot_dir=SNAPSHOT_DIR):
+    """
+    The table of csv_path with stripped names and strings: from its snapshot
+    when that is complete and the CSV unchanged since, else parsed from the CSV.
+    """
+    if _is_current(csv_path, snapshot_dir):
+        return read_snapshot(snapshot_path(csv_path, snapshot_dir))
+    # Under a shared lock: rows appended by a registration are read whole or not at all
+    return normalize(read_csv_shared(csv_path))
+
+
+def _compact(chunk, csv_path, first_row):
+    """
+    The preference columns of a chunk (a frame or a dict of arrays) in their
+    compact dtypes. first_row is the position of the chunk's first row in the
+    table; a value that does not fit raises ValueError naming its CSV line.
+    """
+    data = {}
+    for col, dtype in PREFERENCE_DTYPES.items():
+        if col not in chunk:
+            continue
+        values = np.asarray(chunk[col])
+        limits = np.iinfo(dtype)
+        outside = np.flatnonzero((values < limits.min) | (values > limits.max))
+        if len(outside):
+            # Line 1 is the header
+            raise ValueError(f"{csv_path} line {first_row + outside[0] + 2}: {col} {values[outside[0]]} "
+                             f"out of the {np.dtype(dtype).name} range")
+        data[col] = values.astype(dtype)
+    return data
+
+
+def _preference_chunks(csv_path, chunk_rows, snapshot_dir):
+    """The preference columns of csv_path, chunk_rows rows at a time, as dicts of compact arrays."""
+    if _is_current(csv_path, snapshot_dir):
+        path = snapshot_path(csv_path, snapshot_dir)
+        with open(os.path.join(path, 'columns.json')) as f:
+            names = [column['name'] for column in json.load(f)['columns']]
+        # Memory-mapped: only the slice being converted is read
+        columns = {name: np.load(os.path.join(path, f"{i}.npy"), mmap_mode='r') for i, name in enumerate(names)}
+        n_rows = len(next(iter(columns.values()))) if columns else 0
+        for start in range(0, n_rows, chunk_rows):
+            yield _compact({name: values[start:start + chunk_rows] for name, values in columns.items()},
+                           csv_path, start)
+        return
+    # The lock is held on a descriptor of its own: the chunk reader closes the handle it reads from
+    with open(csv_path, 'rb') as lock_file, locked(lock_file, exclusive=False):
+        header = pd.read_csv(csv_path, nrows=0).columns
+        # Declared, not inferred: a stray text value fails the read instead of turning the column into strings
+        dtype = {name: np.int64 for name in header if name.strip() in PREFERENCE_DTYPES}
+        first_row = 0
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_rows, usecols=list(dtype), dtype=dtype):
+            chunk.columns = chunk.columns.str.strip()
+            yield _compact(chunk, csv_path, first_row)
+            first_row += len(chunk)
+
+
+def _best_ranks(data):
+    """
+    Positions of the rows of data (a dict of equal-length arrays) to keep: for
+    each preference (student, course and lab if any) the row with the best rank,
+    the first of them on ties, in their original order.
+    """
+    keys = [data[col] for col in ('student_id', 'course_id', 'lab') if col in data]
+    rank = data['preference_rank']
+    if not len(rank):
+        return np.arange(0)
+    # Offsets from the minimum of each column, packed high to low (rank last)
+    # into one int64 when they fit: a single sort instead of one per column
+    widths = [int(column.max()) - int(column.min()) for column in (*keys, rank)]
+    widths = [width.bit_length() for width in widths]
+    if sum(widths) <= 63:
+        packed = np.zeros(len(rank), dtype=np.int64)
+        for column, width in zip((*keys, rank), widths):
+            packed <<= width
+            packed |= column - column.min().astype(np.int64)
+        # Stable: equal ranks stay in row order
+        order = np.argsort(packed, kind='stable')
+        packed = packed[order]
+        packed >>= widths[-1]
+        first = np.ones(len(order), dtype=bool)
+        np.not_equal(packed[1:], packed[:-1], out=first[1:])
+        del packed
+    else:
+        order = np.lexsort([rank, *reversed(keys)])
+        same = np.ones(len(order) - 1, dtype=bool)
+        for key in keys:
+            sorted_key = key[order]
+            same &= sorted_key[1:] == sorted_key[:-1]
+        first = np.concatenate(([True], ~same))
+    return np.sort(order[first])
+
+
+def read_preferences(csv_path, chunk_rows=CHUNK_ROWS, snapshot_dir=SNAPSHOT_DIR):
+    """
+    The preference table of csv_path (elective or lab preferences) with compact
+    dtypes: each preference once with its best rank, the rows of each student
+    in file order. Read in chunks from the snapshot when up to date, else from
+    the CSV; duplicates are dropped within each chunk as it is read, then
+    across chunks.
+    """
+    parts = []
+    carry = None
+    # Closed on error too: the CSV's shared lock is not held until collection
+    with contextlib.closing(_preference_chunks(csv_path, chunk_rows, snapshot_dir)) as chunks:
+        for data in chunks:
+            if carry is not None:
+                data = {col: np.concatenate((carry[col], values)) for col, values in data.items()}
+            if not len(data['student_id']):
+                continue
+            # The rows of the last student wait for the next chunk, where the student may continue
+            last = data['student_id'] == data['student_id'][-1]
+            carry = {col: values[last] for col, values in data.items()}
+            data = {col: values[~last] for col, values in data.items()}
+            keep = _best_ranks(data)
+            parts.append({col: values[keep] for col, values in data.items()})
+    if carry is not None:
+        keep = _best_ranks(carry)
+        parts.append({col: values[keep] for col, values in carry.items()})
+    if not parts:
+        return pd.DataFrame({col: np.array([], dtype=dtype) for col, dtype in PREFERENCE_DTYPES.items()
+                             if col in pd.read_csv(csv_path, nrows=0).columns.str.strip()})
+    # A preference can only repeat across chunks whose students overlap; an
+    # export grouped by student (the usual order) needs no second pass
+    bounds = sorted((part['student_id'].min(), part['student_id'].max())
+                    for part in parts if len(part['student_id']))
+    overlapping = any(low <= previous_high for (_, previous_high), (low, _) in zip(bounds, bounds[1:]))
+    data = {}
+    for col in list(parts[0]):
+        # Column by column, so only one column is ever held twice
+        data[col] = np.concatenate([part.pop(col) for part in parts])
+    if overlapping:
+        keep = _best_ranks(data)
+        data = {col: values[keep] for col, values in data.items()}
+    # Column by column: a frame built from the dict would copy the int32 columns into one block
+    table = pd.DataFrame(index=pd.RangeIndex(len(data['student_id'])))
+    for col in list(data):
+        table[col] = data.pop(col)
+    return table
+
+
+def main():
+    for csv_path in sys.argv[1:] or INPUT_CSVS:
+        print(f"{csv_path} -> {write_snapshot(csv_path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+
+# Settings for the MIP solvers of the 'ilp' (CBC) and 'milp' (HiGHS) engines.
+#
+# Every field can be set in code or through an environment variable:
+#   MATCHING_SOLVER_THREADS       CBC threads (HiGHS through SciPy runs its own default)
+#   MATCHING_SOLVER_TIME_LIMIT    seconds per solve
+#   MATCHING_SOLVER_MIP_REL_GAP   relative optimality gap at which the solver may stop
+#   MATCHING_SOLVER_MSG           1 to print the solver log, 0 to keep it quiet
+#   MATCHING_SOLVER_WARM_START    1 to seed CBC with the Gale-Shapley matching
+#   MATCHING_SOLVER_SEED          seed of the tie-break between identical students ('aggregated' engine)
+
+ENV_PREFIX = 'MATCHING_SOLVER_'
+
+
+class SolverConfig:
+    def __init__(self, threads=None, time_limit=None, mip_rel_gap=None, msg=1, warm_start=False, seed=None):
+        """
+        threads: number of solver threads (None: solver default)
+        time_limit: time limit of one solve, in seconds (None: no limit)
+        mip_rel_gap: relative gap tolerance (None: solver default)
+        msg: solver log level, 0 (silent) or 1
+        warm_start: start CBC ('ilp' engines) from the Gale-Shapley matching
+        seed: seed for handing out the seats of identical students ('aggregated'
+            engine; None: in input order)
+        """
+        if threads is not None and threads < 1:
+            raise ValueError(f"threads must be at least 1, got {threads}")
+        if time_limit is not None and time_limit <= 0:
+            raise ValueError(f"time_limit must be positive, got {time_limit}")
+        if mip_rel_gap is not None and mip_rel_gap < 0:
+            raise ValueError(f"mip_rel_gap must be non-negative, got {mip_rel_gap}")
+        self.threads = threads
+        self.time_limit = time_limit
+        self.mip_rel_gap = mip_rel_gap
+        self.msg = msg
+        self.warm_start = warm_start
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls, environ=None, **overrides):
+        """
+        Build a config from the MATCHING_SOLVER_* environment variables.
+        Keyword arguments take precedence over the environment.
+        """
+        environ = os.environ if environ is None else environ
+        settings = {}
+        for name, parse in (('threads', int), ('time_limit', float), ('mip_rel_gap', float), ('msg', int),
+                            ('warm_start', lambda value: bool(int(value))), ('seed', int)):
+            value = environ.get(ENV_PREFIX + name.upper())
+            if value not in (None, ''):
+                try:
+                    settings[name] = parse(value)
+                except ValueError:
+                    raise ValueError(f"Invalid {ENV_PREFIX + name.upper()}: {value!r}")
+        settings.update(overrides)
+        return cls(**settings)
+
+    def as_dict(self):
+        """The fields of the config, as keyword arguments of SolverConfig."""
+        return {'threads': self.threads, 'time_limit': self.time_limit,
+                'mip_rel_gap': self.mip_rel_gap, 'msg': self.msg, 'warm_start': self.warm_start,
+                'seed': self.seed}
+
+    def replace(self, **changes):
+        """Copy of the config with some fields changed."""
+        settings = self.as_dict()
+        settings.update(changes)
+        return SolverConfig(**settings)
+
+    def capped(self, max_time_limit):
+        """Copy of the config whose time limit is at most max_time_limit seconds."""
+        if self.time_limit is not None and self.time_limit <= max_time_limit:
+            return self
+        return self.replace(time_limit=max_time_limit)
+
+    def __repr__(self):
+        return (f"SolverConfig(threads={self.threads}, time_limit={self.time_limit}, "
+                f"mip_rel_gap={self.mip_rel_gap}, msg={self.msg}, warm_start={self.warm_start}, seed={self.seed})")
@@ -0,0 +1,98 @@
+import contextlib
+import csv
+import io
+import os
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Append-only registration of students into backend/student.csv.
+#
+# A registration appends one row under an exclusive lock on the file, after
+# reading the last student id from the end of the file: ids are allocated
+# atomically, concurrent registrations (threads or processes) never lose a row,
+# and the cost does not grow with the roster. Readers parse the file under a
+# shared lock, so a matching run sees every complete registration before it
+# started and none of the ones that follow.
+#
+# Locks are advisory (flock); on Windows, which has no shared locks, readers and
+# writers take turns on the first byte of the file.
+
+STUDENT_CSV = 'backend/student.csv'
+PROGRAM_CSV = 'backend/program.csv'
+COLUMNS = ['student_id', 'name', 'program', 'program_id', 'required_electives']
+FIRST_STUDENT_ID = 1
+# A row is far shorter; the tail read only has to reach the last line break
+TAIL_BYTES = 64 * 1024
+
+
+@contextlib.contextmanager
+def locked(f, exclusive=True):
+    """Hold a lock on the open file f while the block runs: shared for readers, exclusive for writers."""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield f
+        finally:
+            # Closing the file has released the lock already
+            if not f.closed:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        position = f.tell()
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        f.seek(position)
+        try:
+            yield f
+        finally:
+            if not f.closed:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_csv_shared(path):
+    """pd.read_csv of a file no writer is appending to meanwhile."""
+    with open(path, 'rb') as f, locked(f, exclusive=False):
+        return pd.read_csv(f)
+
+
+def program_ids(path=PROGRAM_CSV):
+    """Program name -> program_id, as listed in backend/program.csv."""
+    programs = pd.read_csv(path, skipinitialspace=True)
+    programs.columns = programs.columns.str.strip()
+    return {name.strip(): int(program_id) for program_id, name in zip(programs['program_id'], programs['program'])}
+
+
+def _last_row(f):
+    """The fields of the last line of the open binary file f, None for an empty file."""
+    size = f.seek(0, os.SEEK_END)
+    f.seek(max(size - TAIL_BYTES, 0))
+    lines = [line for line in f.read().splitlines() if line.strip()]
+    if not lines:
+        return None
+    return next(csv.reader([lines[-1].decode()]))
+
+
+def register_student(name, program, program_id, required_electives, path=STUDENT_CSV):
+    """Append a student with the next free id; returns the id."""
+    with open(path, 'a+b') as f, locked(f):
+        last = _last_row(f)
+        row = io.StringIO()
+        writer = csv.writer(row, lineterminator='\n')
+        if last is None:
+            writer.writerow(COLUMNS)
+        # No student yet (only the header): the first id
+        student_id = int(last[0]) + 1 if last is not None and last[0].strip().isdigit() else FIRST_STUDENT_ID
+        writer.writerow([student_id, name, program, program_id, required_electives])
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+        f.write(row.getvalue().encode())
+        f.flush()
+        os.fsync(f.fileno())
+    return student_id